@@ -0,0 +1,62 @@
+"""Настройка соединений SQLite для работы под нагрузкой.
+
+Каждое новое соединение получает PRAGMA из SQLITE_PRAGMAS. Журнал WAL
+позволяет читать во время записи, а synchronous=NORMAL в режиме WAL
+синхронизирует диск только при контрольных точках. busy_timeout
+заставляет писателя подождать чужую блокировку вместо немедленной
+ошибки «database is locked». mmap_size и cache_size держат горячие
+страницы в памяти процесса.
+
+Соединения живут CONN_MAX_AGE секунд и переиспользуются между
+запросами, поэтому PRAGMA выполняются редко. health() проверяет, что
+базы отвечают и режим журнала тот, что ожидается.
+"""
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def pragmas():
+    # без настройки соединения остаются с PRAGMA SQLite по умолчанию
+    return getattr(settings, 'SQLITE_PRAGMAS', {})
+
+
+def configure(connection):
+    """Выполняет PRAGMA на соединении SQLite."""
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        # synchronous и journal_mode нельзя менять внутри транзакции
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas().items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    configure(connection)
+
+
+def health():
+    """Состояние баз: {алиас: {'ok': ..., ...}}.
+
+    Для SQLite в ответ попадают режим журнала и синхронизации, чтобы
+    было видно, что PRAGMA применились.
+    """
+    result = {}
+    for connection in connections.all():
+        state = {'ok': True}
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+                if connection.vendor == 'sqlite':
+                    for name in ('journal_mode', 'synchronous'):
+                        cursor.execute(f'PRAGMA {name}')
+                        state[name] = cursor.fetchone()[0]
+        except DatabaseError as error:
+            state = {'ok': False, 'error': str(error)}
+            # сломанное соединение не переживёт запрос
+            connection.close_if_unusable_or_obsolete()
+        result[connection.alias] = state
+    return result
@@ -0,0 +1,59 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from core import perf
+
+
+class Command(BaseCommand):
+    help = ('Сводка замеров PerformanceMiddleware по представлениям '
+            'из файлов всех процессов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-age',
+            type=int,
+            default=300,
+            help='Пропускать файлы процессов, не обновлявшиеся дольше, с.',
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Вывести гистограммы как есть, в JSON.',
+        )
+
+    def handle(self, *args, **options):
+        views = perf.load_snapshots(options['max_age'])
+        if options['json']:
+            self.stdout.write(json.dumps(
+                {'bounds': [str(bound) for bound in perf.BOUNDS],
+                 'views': views},
+                ensure_ascii=False, indent=2))
+            return
+        if not views:
+            self.stdout.write('Замеров нет.')
+            return
+        self.stdout.write(
+            f'{"представление":<28}{"N":>9}{"p50":>7}{"p95":>7}'
+            f'{"p99":>7}{"SQL":>7}{"SQL, мс":>9}{"шабл., мс":>10}'
+            f'{"кэш":>7}')
+        for view, item in sorted(
+                views.items(), key=lambda pair: -pair[1]['sums']['wall']):
+            self.stdout.write(self.row(view, item))
+        self.stdout.write(
+            'N — запросов в окне; p50-p99 — верхние границы корзин, мс; '
+            'SQL и время — в среднем на запрос; кэш — доля попаданий.')
+
+    @staticmethod
+    def row(view, item):
+        count = item['count'] or 1
+        sums = item['sums']
+        lookups = sums['cache_hits'] + sums['cache_misses']
+        hit_ratio = (
+            f'{sums["cache_hits"] / lookups:.0%}' if lookups else '—')
+        p50, p95, p99 = (
+            perf.quantile(item['wall'], q) for q in (0.5, 0.95, 0.99))
+        return (
+            f'{view:<28}{item["count"]:>9}{p50:>7g}{p95:>7g}{p99:>7g}'
+            f'{sums["queries"] / count:>7.1f}{sums["sql"] / count:>9.1f}'
+            f'{sums["tpl"] / count:>10.1f}{hit_ratio:>7}')
@@ -0,0 +1,109 @@
+"""Вспомогательные функции для отдачи медиафайлов.
+
+Сами байты по возможности отдаёт не Python: либо фронтовой сервер по
+заголовку X-Sendfile/X-Accel-Redirect, либо WSGI-сервер через
+wsgi.file_wrapper (gunicorn и uWSGI используют os.sendfile).
+"""
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+SENDFILE_HEADERS = {
+    'x-sendfile': 'X-Sendfile',
+    'x-accel-redirect': 'X-Accel-Redirect',
+}
+
+
+class InvalidRange(Exception):
+    pass
+
+
+def etag(stat):
+    """Сильный ETag по времени изменения и размеру, как у nginx."""
+    return '"{:x}-{:x}"'.format(stat.st_mtime_ns, stat.st_size)
+
+
+def parse_range(header, size):
+    """(начало, длина) диапазона из заголовка Range или None.
+
+    None означает «отдать файл целиком»: заголовка нет, он непонятен
+    или запрашивает несколько диапазонов. InvalidRange — диапазон
+    лежит за концом файла.
+    """
+    match = RANGE_RE.match(header.replace(' ', '')) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # «последние N байт»
+        length = min(int(last), size)
+        if length == 0:
+            raise InvalidRange(header)
+        return size - length, length
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise InvalidRange(header)
+    return start, end - start + 1
+
+
+def if_range_matches(request, current_etag, last_modified):
+    """If-Range: диапазон отдаётся, только если файл не менялся."""
+    validator = request.META.get('HTTP_IF_RANGE')
+    if not validator:
+        return True
+    return validator in (current_etag, last_modified)
+
+
+class FileRange:
+    """Окно открытого файла для FileResponse.
+
+    read() не выходит за границу диапазона, а fileno() позволяет
+    WSGI-серверу отправить ровно Content-Length байт через sendfile
+    с текущей позиции файла.
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.file.seek(start)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def sendfile_mode():
+    mode = getattr(settings, 'MEDIA_SENDFILE', None)
+    if mode is not None and mode not in SENDFILE_HEADERS:
+        raise ImproperlyConfigured(
+            'MEDIA_SENDFILE: ожидается None или одно из '
+            f'{list(SENDFILE_HEADERS)}')
+    return mode
+
+
+def sendfile_header(path, full_path):
+    """Имя и значение заголовка для фронтового сервера."""
+    mode = sendfile_mode()
+    if mode == 'x-accel-redirect':
+        prefix = getattr(
+            settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+        return SENDFILE_HEADERS[mode], prefix + quote(path)
+    return SENDFILE_HEADERS[mode], full_path
@@ -0,0 +1,318 @@
+"""Счётчики и гистограммы для /metrics в текстовом формате Prometheus.
+
+Значения копятся в памяти процесса под одной блокировкой, так что inc
+и observe стоят пары словарных операций. Раз в METRICS_FLUSH_INTERVAL
+секунд процесс сохраняет их в свой файл в METRICS_DIR. Представление
+/metrics сначала сохраняет значения своего процесса, затем складывает
+файлы всех процессов: воркеры prefork-сервера видны одной выдачей.
+
+Файл называется по pid и времени запуска процесса, поэтому новый
+процесс с освободившимся pid не затирает файл старого. Файлы
+завершившихся процессов при выдаче переносятся в общий архив,
+чтобы счётчики не убывали, а каталог не рос. Значения за последние
+METRICS_FLUSH_INTERVAL секунд жизни процесса теряются. Без fcntl
+(Windows) архива нет и файлы просто копятся.
+"""
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+FLUSH_INTERVAL = 5
+FILE_PREFIX = 'metrics-'
+ARCHIVE_NAME = f'{FILE_PREFIX}archive.json'
+LOCK_NAME = 'archive.lock'
+
+
+def metrics_dir():
+    return getattr(
+        settings, 'METRICS_DIR',
+        os.path.join(tempfile.gettempdir(), 'yatube-metrics'))
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.values = {}
+        self.flushed_at = time.monotonic()
+        self.started = time.time_ns()
+
+    def register(self, metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f'Метрика {metric.name} уже объявлена')
+            self.metrics[metric.name] = metric
+            self.values[metric.name] = {}
+
+    def clear(self):
+        with self.lock:
+            for values in self.values.values():
+                values.clear()
+
+    def collect(self):
+        """{имя: {'meta': ..., 'values': {метки: значение}}} процесса."""
+        with self.lock:
+            return {
+                name: {
+                    'meta': metric.meta(),
+                    'values': {
+                        key: list(value) if isinstance(value, list) else value
+                        for key, value in self.values[name].items()
+                    },
+                }
+                for name, metric in self.metrics.items()
+            }
+
+    def path(self):
+        return os.path.join(
+            metrics_dir(),
+            f'{FILE_PREFIX}{os.getpid()}-{self.started}.json')
+
+    def flush(self):
+        """Атомарно сохраняет значения процесса в его файл."""
+        self.flushed_at = time.monotonic()
+        path = self.path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w') as file:
+            json.dump({
+                'pid': os.getpid(),
+                'started': self.started,
+                'metrics': self.collect(),
+            }, file)
+        os.replace(path + '.tmp', path)
+
+    def maybe_flush(self):
+        interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', FLUSH_INTERVAL)
+        with self.lock:
+            due = time.monotonic() - self.flushed_at >= interval
+            if due:
+                self.flushed_at = time.monotonic()
+        if due:
+            self.flush()
+
+
+REGISTRY = Registry()
+
+
+class Counter:
+    """Монотонный счётчик; имя по соглашению кончается на _total."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.registry = registry
+        registry.register(self)
+
+    def meta(self):
+        return {'kind': self.kind, 'help': self.documentation}
+
+    def key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(
+                f'{self.name}: ожидаются метки {self.labels}, '
+                f'получены {tuple(labels)}')
+        return json.dumps(
+            [[name, str(labels[name])] for name in self.labels],
+            ensure_ascii=False)
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        values = self.registry.values[self.name]
+        with self.registry.lock:
+            values[key] = values.get(key, 0) + amount
+
+
+class Histogram(Counter):
+    """Гистограмма: число наблюдений по корзинам и их сумма."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labels, registry)
+
+    def meta(self):
+        return dict(super().meta(), buckets=self.buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        # последняя корзина — +Inf, за ней сумма наблюдений
+        index = bisect_left(self.buckets, value)
+        values = self.registry.values[self.name]
+        with self.registry.lock:
+            entry = values.get(key)
+            if entry is None:
+                entry = values[key] = [0] * (len(self.buckets) + 2)
+            entry[index] += 1
+            entry[-1] += value
+
+    def inc(self, amount=1, **labels):
+        raise TypeError('У гистограммы есть только observe')
+
+
+def _add(total, value):
+    if isinstance(value, list):
+        if total is None:
+            return list(value)
+        return [a + b for a, b in zip(total, value)]
+    return (total or 0) + value
+
+
+def _read(path):
+    try:
+        with open(path) as file:
+            return json.load(file)['metrics']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _merge(merged, metrics):
+    for metric, item in metrics.items():
+        target = merged.setdefault(
+            metric, {'meta': item['meta'], 'values': {}})
+        for key, value in item['values'].items():
+            target['values'][key] = _add(target['values'].get(key), value)
+    return merged
+
+
+def _names(directory):
+    names = os.listdir(directory) if os.path.isdir(directory) else []
+    return [
+        name for name in names
+        if name.startswith(FILE_PREFIX) and name.endswith('.json')
+    ]
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # процесс есть, но чужой
+        return True
+    return True
+
+
+def _dead(names):
+    """Файлы процессов, которых уже нет.
+
+    Живым может быть только самый поздний по времени запуска файл
+    каждого pid: более ранние оставили процессы, чей pid уже занят.
+    """
+    latest = {}
+    processes = []
+    for name in names:
+        try:
+            pid, started = map(int, name[len(FILE_PREFIX):-5].split('-'))
+        except ValueError:
+            continue
+        processes.append((name, pid, started))
+        latest[pid] = max(latest.get(pid, started), started)
+    return [
+        name for name, pid, started in processes
+        if started < latest[pid] or not _alive(pid)
+    ]
+
+
+def archive(directory):
+    """Переносит значения завершившихся процессов в архив.
+
+    Вызывается под блокировкой каталога: иначе два процесса сложили
+    бы одни и те же файлы в архив дважды.
+    """
+    own = os.path.basename(REGISTRY.path())
+    dead = [name for name in _dead(_names(directory)) if name != own]
+    if not dead:
+        return
+    path = os.path.join(directory, ARCHIVE_NAME)
+    merged = _merge({}, _read(path) or {})
+    for name in dead:
+        _merge(merged, _read(os.path.join(directory, name)) or {})
+    with open(path + '.tmp', 'w') as file:
+        json.dump({'metrics': merged}, file)
+    os.replace(path + '.tmp', path)
+    for name in dead:
+        os.remove(os.path.join(directory, name))
+
+
+def _merged(directory):
+    merged = {}
+    for name in _names(directory):
+        _merge(merged, _read(os.path.join(directory, name)) or {})
+    return merged
+
+
+def load():
+    """Складывает файлы всех процессов и архив завершившихся."""
+    directory = metrics_dir()
+    if fcntl is None or not os.path.isdir(directory):
+        return _merged(directory)
+    with open(os.path.join(directory, LOCK_NAME), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        archive(directory)
+        return _merged(directory)
+
+
+def _escape(value, quotes=True):
+    # в HELP кавычки не экранируются, в значениях меток — экранируются
+    value = value.replace('\\', '\\\\').replace('\n', '\\n')
+    return value.replace('"', '\\"') if quotes else value
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+
+def _histogram_lines(name, pairs, entry, buckets):
+    cumulative = 0
+    bounds = [_number(float(bound)) for bound in buckets] + ['+Inf']
+    for bound, count in zip(bounds, entry[:-1]):
+        cumulative += count
+        yield f'{name}_bucket{_labels(pairs + [["le", bound]])} {cumulative}'
+    yield f'{name}_sum{_labels(pairs)} {_number(float(entry[-1]))}'
+    yield f'{name}_count{_labels(pairs)} {cumulative}'
+
+
+def render(merged):
+    """Текстовый формат экспозиции Prometheus 0.0.4."""
+    lines = []
+    for name in sorted(merged):
+        meta, values = merged[name]['meta'], merged[name]['values']
+        lines.append(f'# HELP {name} {_escape(meta["help"], quotes=False)}')
+        lines.append(f'# TYPE {name} {meta["kind"]}')
+        for key in sorted(values):
+            pairs = json.loads(key)
+            if meta['kind'] == 'histogram':
+                lines.extend(_histogram_lines(
+                    name, pairs, values[key], meta['buckets']))
+            else:
+                lines.append(f'{name}{_labels(pairs)} {_number(values[key])}')
+    return '\n'.join(lines) + '\n'
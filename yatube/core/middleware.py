@@ -0,0 +1,87 @@
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from . import metrics, perf, routers
+
+REQUESTS = metrics.Counter(
+    'yatube_http_requests_total', 'Запросы по представлениям и статусам.',
+    ['view', 'status'])
+VIEW_DURATION = metrics.Histogram(
+    'yatube_view_duration_seconds', 'Время ответа представления.', ['view'])
+DB_QUERIES = metrics.Counter(
+    'yatube_db_queries_total', 'SQL-запросы по представлениям.', ['view'])
+DB_SECONDS = metrics.Counter(
+    'yatube_db_seconds_total', 'Время SQL по представлениям.', ['view'])
+TEMPLATE_SECONDS = metrics.Counter(
+    'yatube_template_seconds_total', 'Время рендеринга шаблонов.', ['view'])
+
+
+class PerformanceMiddleware:
+    """Замеряет каждый запрос: замеры идут в Server-Timing и в /metrics.
+
+    Стоит первым в MIDDLEWARE, чтобы время учитывало остальные
+    middleware. Заголовок получают только при DEBUG и сотрудники.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        perf.instrument()
+
+    def __call__(self, request):
+        record = perf.start()
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(record.query))
+                response = self.get_response(request)
+        finally:
+            perf.finish()
+        record.wall = (time.perf_counter() - start) * 1000
+        match = request.resolver_match
+        record.view = match.view_name if match else '<unresolved>'
+        perf.recorder.add(record)
+        perf.recorder.maybe_snapshot()
+        self.observe(record, response)
+        user = getattr(request, 'user', None)
+        if settings.DEBUG or (user is not None and user.is_staff):
+            response['Server-Timing'] = perf.server_timing(record)
+        return response
+
+    @staticmethod
+    def observe(record, response):
+        view = record.view
+        REQUESTS.inc(view=view, status=response.status_code)
+        VIEW_DURATION.observe(record.wall / 1000, view=view)
+        DB_QUERIES.inc(record.queries, view=view)
+        DB_SECONDS.inc(record.sql / 1000, view=view)
+        TEMPLATE_SECONDS.inc(record.tpl / 1000, view=view)
+        metrics.REGISTRY.maybe_flush()
+
+
+class ReplicaMiddleware:
+    """Читающие представления идут на реплику, записи закрепляют браузер
+    за основной базой.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        routers.begin()
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = routers.end()
+        if wrote:
+            routers.pin(response)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = request.resolver_match.view_name
+        if view in routers.read_views() and not routers.pinned(request):
+            routers.use_replica()
@@ -0,0 +1,298 @@
+"""Замеры производительности запросов.
+
+PerformanceMiddleware заводит на время запроса запись Record и кладёт её
+в поток. SQL считается через execute_wrapper соединений, время шаблонов
+и обращения к кэшу — обёртками над Template.render и методами get
+бэкендов кэша, которые ставит instrument(). Обёртки ничего не делают,
+если записи в потоке нет, например в командах и фоновых потоках;
+только чтения фрагментов шаблонов считаются всегда, для /metrics.
+
+Готовые записи копятся в recorder: по каждому представлению хранятся
+последние PERF_WINDOW запросов. Раз в PERF_SNAPSHOT_INTERVAL секунд
+процесс сохраняет гистограммы в свой файл в PERF_SNAPSHOT_DIR, откуда
+их собирает команда perf_report.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.utils import TEMPLATE_FRAGMENT_KEY_TEMPLATE
+from django.template.base import Template
+
+from . import metrics
+
+# верхние границы корзин гистограмм, миллисекунды
+BOUNDS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+TIMINGS = ('wall', 'sql', 'tpl')
+COUNTERS = ('queries', 'cache_hits', 'cache_misses')
+WINDOW = 1000
+SNAPSHOT_INTERVAL = 10
+SNAPSHOT_PREFIX = 'perf-'
+# template.cache.<имя фрагмента>.<хеш>
+FRAGMENT_KEY_PREFIX = TEMPLATE_FRAGMENT_KEY_TEMPLATE.split('%')[0]
+
+FRAGMENT_CACHE = metrics.Counter(
+    'yatube_fragment_cache_total',
+    'Чтения закэшированных фрагментов шаблонов: hit или miss.',
+    ['fragment', 'result'])
+
+_local = threading.local()
+_missing = object()
+
+
+class Record:
+    """Замеры одного запроса; время в миллисекундах."""
+
+    def __init__(self):
+        self.view = None
+        self.wall = 0.0
+        self.sql = 0.0
+        self.tpl = 0.0
+        self.queries = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.template_depth = 0
+
+    def values(self):
+        return tuple(getattr(self, name) for name in TIMINGS + COUNTERS)
+
+    def query(self, execute, sql, params, many, context):
+        """Обёртка для connection.execute_wrapper."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql += (time.perf_counter() - start) * 1000
+            self.queries += 1
+
+
+def current():
+    return getattr(_local, 'record', None)
+
+
+def start():
+    _local.record = Record()
+    return _local.record
+
+
+def finish():
+    _local.record = None
+
+
+def server_timing(record):
+    """Значение заголовка Server-Timing."""
+    return ', '.join([
+        f'app;dur={record.wall:.1f}',
+        f'db;dur={record.sql:.1f};desc="{record.queries} queries"',
+        f'tpl;dur={record.tpl:.1f}',
+        f'cache;desc="hits={record.cache_hits} '
+        f'misses={record.cache_misses}"',
+    ])
+
+
+def _timed_render(render):
+    @wraps(render)
+    def inner(self, context):
+        record = current()
+        # вложенные {% include %} уже учтены во внешнем шаблоне
+        if record is None or record.template_depth:
+            return render(self, context)
+        record.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            record.tpl += (time.perf_counter() - start) * 1000
+            record.template_depth -= 1
+    inner.perf_instrumented = True
+    return inner
+
+
+def _counted_get(get):
+    @wraps(get)
+    def inner(self, key, default=None, version=None):
+        value = get(self, key, _missing, version)
+        hit = value is not _missing
+        record = current()
+        if record is not None:
+            if hit:
+                record.cache_hits += 1
+            else:
+                record.cache_misses += 1
+        if isinstance(key, str) and key.startswith(FRAGMENT_KEY_PREFIX):
+            FRAGMENT_CACHE.inc(
+                fragment=key[len(FRAGMENT_KEY_PREFIX):].split('.')[0],
+                result='hit' if hit else 'miss')
+        return value if hit else default
+    inner.perf_instrumented = True
+    return inner
+
+
+def _counted_get_many(get_many):
+    @wraps(get_many)
+    def inner(self, keys, version=None):
+        keys = list(keys)
+        found = get_many(self, keys, version)
+        record = current()
+        if record is not None:
+            record.cache_hits += len(found)
+            record.cache_misses += len(keys) - len(found)
+        return found
+    inner.perf_instrumented = True
+    return inner
+
+
+def _patch(owner, name, wrapper):
+    method = getattr(owner, name)
+    if not getattr(method, 'perf_instrumented', False):
+        setattr(owner, name, wrapper(method))
+
+
+_instrument_lock = threading.Lock()
+
+
+def instrument():
+    """Ставит обёртки над шаблонами и кэшами; повторный вызов безвреден."""
+    with _instrument_lock:
+        _patch(Template, 'render', _timed_render)
+        for alias in settings.CACHES:
+            backend = type(caches[alias])
+            _patch(backend, 'get', _counted_get)
+            _patch(backend, 'get_many', _counted_get_many)
+
+
+def window():
+    return getattr(settings, 'PERF_WINDOW', WINDOW)
+
+
+def snapshot_dir():
+    return getattr(
+        settings, 'PERF_SNAPSHOT_DIR',
+        os.path.join(tempfile.gettempdir(), 'yatube-perf'))
+
+
+def bucket(value):
+    for index, bound in enumerate(BOUNDS):
+        if value <= bound:
+            return index
+
+
+def histogram(rows):
+    """Гистограммы и суммы по списку Record.values()."""
+    result = {
+        'count': len(rows),
+        'sums': dict.fromkeys(TIMINGS + COUNTERS, 0),
+    }
+    for name in TIMINGS:
+        result[name] = [0] * len(BOUNDS)
+    for row in rows:
+        for name, value in zip(TIMINGS + COUNTERS, row):
+            result['sums'][name] += value
+            if name in TIMINGS:
+                result[name][bucket(value)] += 1
+    return result
+
+
+def merge(histograms):
+    """Складывает гистограммы одного представления из разных процессов."""
+    result = histogram([])
+    for item in histograms:
+        result['count'] += item['count']
+        for name, value in item['sums'].items():
+            result['sums'][name] += value
+        for name in TIMINGS:
+            result[name] = [a + b for a, b in zip(result[name], item[name])]
+    return result
+
+
+def quantile(counts, q):
+    """Верхняя граница корзины, в которую попадает q-квантиль."""
+    total = sum(counts)
+    if not total:
+        return 0
+    seen = 0
+    for bound, count in zip(BOUNDS, counts):
+        seen += count
+        if seen >= q * total:
+            return bound
+
+
+class Recorder:
+    """Скользящее окно последних запросов по каждому представлению."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rows = defaultdict(lambda: deque(maxlen=window()))
+        self.snapshot_at = time.monotonic()
+
+    def add(self, record):
+        with self.lock:
+            self.rows[record.view].append(record.values())
+
+    def histograms(self):
+        with self.lock:
+            rows = {view: list(items) for view, items in self.rows.items()}
+        return {view: histogram(items) for view, items in rows.items()}
+
+    def clear(self):
+        with self.lock:
+            self.rows.clear()
+
+    def snapshot_path(self):
+        return os.path.join(
+            snapshot_dir(), f'{SNAPSHOT_PREFIX}{os.getpid()}.json')
+
+    def snapshot(self):
+        """Атомарно сохраняет гистограммы процесса в его файл."""
+        self.snapshot_at = time.monotonic()
+        data = {
+            'pid': os.getpid(),
+            'time': time.time(),
+            'bounds': [str(bound) for bound in BOUNDS],
+            'views': self.histograms(),
+        }
+        path = self.snapshot_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w') as file:
+            json.dump(data, file)
+        os.replace(path + '.tmp', path)
+
+    def maybe_snapshot(self):
+        interval = getattr(
+            settings, 'PERF_SNAPSHOT_INTERVAL', SNAPSHOT_INTERVAL)
+        with self.lock:
+            due = time.monotonic() - self.snapshot_at >= interval
+            if due:
+                self.snapshot_at = time.monotonic()
+        if due:
+            self.snapshot()
+
+
+recorder = Recorder()
+
+
+def load_snapshots(max_age):
+    """Гистограммы всех процессов, обновлявшихся не дольше max_age назад."""
+    directory = snapshot_dir()
+    if not os.path.isdir(directory):
+        return {}
+    views = defaultdict(list)
+    for name in os.listdir(directory):
+        if not (name.startswith(SNAPSHOT_PREFIX) and name.endswith('.json')):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            continue
+        if time.time() - data['time'] > max_age:
+            continue
+        for view, item in data['views'].items():
+            views[view].append(item)
+    return {view: merge(items) for view, items in views.items()}
@@ -0,0 +1,113 @@
+"""Чтение с реплик с гарантией «читаю свои записи».
+
+ReplicaMiddleware включает реплику только на время представлений из
+REPLICA_READ_VIEWS: лент, профиля и страницы поста. Реплика выбирается
+одна на запрос, чтобы страница не собиралась из разных снимков. Всё
+остальное, как и любая запись, идёт в основную базу.
+
+Реплика может отставать, поэтому после запроса, который что-то записал,
+браузер на REPLICA_PIN_SECONDS секунд закрепляется за основной базой:
+автор сразу видит свой пост и свой комментарий. Срок закрепления живёт
+в куке, а не в данных сессии: сохранение сессии стоило бы каждому
+пишущему запросу ещё нескольких SQL-запросов. Если запись случилась
+посреди читающего запроса, его оставшиеся чтения тоже идут в основную
+базу. Таблица сессий читается только из основной базы: в неё пишут
+почти в каждом запросе.
+"""
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+READ_VIEWS = (
+    'posts:index', 'posts:group_list', 'posts:profile',
+    'posts:post_detail', 'posts:follow_index',
+)
+PIN_SECONDS = 10
+PIN_COOKIE = 'db_primary_until'
+PRIMARY_APPS = ('sessions',)
+
+_local = threading.local()
+
+
+def replicas():
+    return getattr(settings, 'REPLICA_DATABASES', [])
+
+
+def pin_seconds():
+    """Сколько читать с основной базы после записи; должно покрывать
+    отставание реплик."""
+    return getattr(settings, 'REPLICA_PIN_SECONDS', PIN_SECONDS)
+
+
+def read_views():
+    return getattr(settings, 'REPLICA_READ_VIEWS', READ_VIEWS)
+
+
+def begin():
+    """Начало запроса: чтение с основной базы, записей ещё не было."""
+    _local.replica = None
+    _local.wrote = False
+
+
+def use_replica():
+    """Направляет чтения запроса на случайную реплику, если они есть."""
+    aliases = replicas()
+    if aliases:
+        _local.replica = random.choice(aliases)
+    return _local.replica
+
+
+def current_replica():
+    """Реплика, с которой сейчас читает запрос, или None."""
+    return getattr(_local, 'replica', None)
+
+
+def record_write():
+    """Запрос записал: дальше он читает с основной базы."""
+    _local.replica = None
+    _local.wrote = True
+
+
+def end():
+    """Конец запроса; возвращает True, если он что-то записал."""
+    wrote = getattr(_local, 'wrote', False)
+    begin()
+    return wrote
+
+
+def pinned(request):
+    try:
+        until = float(request.COOKIES.get(PIN_COOKIE, 0))
+    except ValueError:
+        return False
+    return until > time.time()
+
+
+def pin(response):
+    """Закрепляет браузер за основной базой после записи."""
+    seconds = pin_seconds()
+    response.set_cookie(
+        PIN_COOKIE, f'{time.time() + seconds:.3f}', max_age=seconds,
+        httponly=True, samesite='Lax')
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in PRIMARY_APPS:
+            return DEFAULT_DB_ALIAS
+        return current_replica()
+
+    def db_for_write(self, model, **hints):
+        # дальше запрос читает то, что сам записал
+        record_write()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # реплики — копии основной базы
+        aliases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
@@ -0,0 +1,532 @@
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+from http import HTTPStatus
+from io import StringIO
+from unittest import mock, skipIf
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.models import Comment, Follow, Group, Post
+
+from . import db, metrics, perf, routers
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+CONTENT = bytes(range(256)) * 4
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ServeMediaTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        os.makedirs(os.path.join(TEMP_MEDIA_ROOT, 'posts'), exist_ok=True)
+        with open(os.path.join(TEMP_MEDIA_ROOT, 'posts', 'a.png'), 'wb') as f:
+            f.write(CONTENT)
+        cls.url = reverse('media', args=['posts/a.png'])
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_file_is_served_with_validators(self):
+        """Файл отдаётся целиком с ETag, Last-Modified и типом."""
+        response = self.client.get(ServeMediaTest.url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(b''.join(response.streaming_content), CONTENT)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['Content-Length'], str(len(CONTENT)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+        self.assertIn('max-age=', response['Cache-Control'])
+
+    def test_conditional_get_returns_not_modified(self):
+        """Повторный запрос с валидаторами получает 304 без тела."""
+        first = self.client.get(ServeMediaTest.url)
+        by_etag = self.client.get(
+            ServeMediaTest.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(by_etag.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(by_etag.content, b'')
+        by_date = self.client.get(
+            ServeMediaTest.url,
+            HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(by_date.status_code, HTTPStatus.NOT_MODIFIED)
+        changed = self.client.get(
+            ServeMediaTest.url, HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(changed.status_code, HTTPStatus.OK)
+
+    def test_byte_ranges(self):
+        """Диапазон отдаётся кодом 206 ровно нужной длины."""
+        cases = {
+            'bytes=10-19': (10, 20),
+            'bytes=1000-': (1000, len(CONTENT)),
+            'bytes=-24': (len(CONTENT) - 24, len(CONTENT)),
+            'bytes=1020-5000': (1020, len(CONTENT)),
+        }
+        for header, (start, end) in cases.items():
+            with self.subTest(range=header):
+                response = self.client.get(
+                    ServeMediaTest.url, HTTP_RANGE=header)
+                self.assertEqual(
+                    response.status_code, HTTPStatus.PARTIAL_CONTENT)
+                self.assertEqual(
+                    b''.join(response.streaming_content),
+                    CONTENT[start:end])
+                self.assertEqual(
+                    response['Content-Range'],
+                    f'bytes {start}-{end - 1}/{len(CONTENT)}')
+                self.assertEqual(response['Content-Length'], str(end - start))
+
+    def test_unsatisfiable_and_stale_ranges(self):
+        """Диапазон за концом файла — 416, устаревший If-Range — весь файл."""
+        response = self.client.get(
+            ServeMediaTest.url, HTTP_RANGE=f'bytes={len(CONTENT)}-')
+        self.assertEqual(
+            response.status_code, HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(
+            response['Content-Range'], f'bytes */{len(CONTENT)}')
+        response = self.client.get(
+            ServeMediaTest.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"old"')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(b''.join(response.streaming_content), CONTENT)
+
+    def test_sendfile_modes_delegate_to_front_server(self):
+        """В режиме sendfile тело отдаёт фронтовой сервер."""
+        full_path = os.path.join(TEMP_MEDIA_ROOT, 'posts', 'a.png')
+        with self.settings(MEDIA_SENDFILE='x-sendfile'):
+            response = self.client.get(ServeMediaTest.url)
+        self.assertEqual(response['X-Sendfile'], full_path)
+        self.assertEqual(response.content, b'')
+        with self.settings(
+                MEDIA_SENDFILE='x-accel-redirect',
+                MEDIA_ACCEL_REDIRECT_PREFIX='/internal/'):
+            response = self.client.get(ServeMediaTest.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/internal/posts/a.png')
+        self.assertIn('ETag', response)
+
+    def test_missing_and_escaping_paths_are_not_found(self):
+        """Отсутствующий файл, каталог и путь вне MEDIA_ROOT — 404."""
+        for path in ('posts/missing.png', 'posts', '../settings.py'):
+            with self.subTest(path=path):
+                response = self.client.get(settings.MEDIA_URL + path)
+                self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_only_safe_methods(self):
+        """Медиа принимает только GET и HEAD."""
+        response = self.client.post(ServeMediaTest.url)
+        self.assertEqual(
+            response.status_code, HTTPStatus.METHOD_NOT_ALLOWED)
+        response = self.client.head(ServeMediaTest.url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+
+class PerformanceMiddlewareTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Замерщик')
+        cls.staff = User.objects.create_user(
+            username='Сотрудник', is_staff=True)
+
+    def setUp(self):
+        cache.clear()
+        perf.recorder.clear()
+
+    @staticmethod
+    def timing(response):
+        return dict(
+            (part.split(';')[0].strip(), part)
+            for part in response['Server-Timing'].split(','))
+
+    @override_settings(DEBUG=True)
+    def test_server_timing_matches_request(self):
+        """Server-Timing содержит время, SQL, шаблоны и кэш запроса."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('posts:index'))
+        timing = self.timing(response)
+        self.assertEqual(set(timing), {'app', 'db', 'tpl', 'cache'})
+        self.assertIn(f'"{len(queries)} queries"', timing['db'])
+        self.assertNotIn('tpl;dur=0.0', timing['tpl'])
+        first = perf.recorder.histograms()['posts:index']['sums']
+        self.assertGreater(first['cache_misses'], 0)
+        self.client.get(reverse('posts:index'))
+        second = perf.recorder.histograms()['posts:index']['sums']
+        self.assertGreater(
+            second['cache_hits'] - first['cache_hits'], first['cache_hits'])
+        self.assertIn(
+            f'hits={first["cache_hits"]} misses={first["cache_misses"]}',
+            timing['cache'])
+
+    def test_header_is_for_staff_only(self):
+        """Без DEBUG заголовок видят только сотрудники."""
+        response = self.client.get(reverse('posts:index'))
+        self.assertNotIn('Server-Timing', response)
+        self.client.force_login(PerformanceMiddlewareTest.staff)
+        response = self.client.get(reverse('posts:index'))
+        self.assertIn('Server-Timing', response)
+
+    def test_records_are_grouped_by_view_name(self):
+        """Записи копятся по имени представления."""
+        self.client.force_login(PerformanceMiddlewareTest.user)
+        for _ in range(3):
+            self.client.get(reverse('posts:follow_index'))
+        self.client.get('/no-such-page/')
+        histograms = perf.recorder.histograms()
+        self.assertEqual(histograms['posts:follow_index']['count'], 3)
+        self.assertEqual(
+            sum(histograms['posts:follow_index']['wall']), 3)
+        self.assertIn('<unresolved>', histograms)
+
+    @override_settings(PERF_WINDOW=2)
+    def test_window_keeps_latest_requests(self):
+        """Окно хранит только последние PERF_WINDOW запросов."""
+        perf.recorder.rows.clear()
+        for _ in range(5):
+            self.client.get(reverse('about:author'))
+        histograms = perf.recorder.histograms()
+        self.assertEqual(histograms['about:author']['count'], 2)
+
+    def test_report_merges_process_snapshots(self):
+        """perf_report собирает файлы процессов в одну сводку."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with override_settings(PERF_SNAPSHOT_DIR=directory):
+            self.client.get(reverse('posts:index'))
+            perf.recorder.snapshot()
+            other = os.path.join(directory, 'perf-1.json')
+            shutil.copy(perf.recorder.snapshot_path(), other)
+            out = StringIO()
+            call_command('perf_report', '--json', stdout=out)
+            views = json.loads(out.getvalue())['views']
+            self.assertEqual(views['posts:index']['count'], 2)
+            out = StringIO()
+            call_command('perf_report', stdout=out)
+            self.assertIn('posts:index', out.getvalue())
+
+    def test_quantile_uses_bucket_bounds(self):
+        counts = [0] * len(perf.BOUNDS)
+        counts[0], counts[3] = 90, 10
+        self.assertEqual(perf.quantile(counts, 0.5), perf.BOUNDS[0])
+        self.assertEqual(perf.quantile(counts, 0.95), perf.BOUNDS[3])
+
+
+class MetricsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Метролог')
+        cls.author = User.objects.create_user(username='Наблюдаемый')
+
+    def setUp(self):
+        cache.clear()
+        metrics.REGISTRY.clear()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings_override = override_settings(METRICS_DIR=directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def scrape(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            response['Content-Type'],
+            'text/plain; version=0.0.4; charset=utf-8')
+        return response.content.decode()
+
+    def test_views_and_fragments_are_counted(self):
+        """Запросы, время ответа и кэш фрагмента index_page."""
+        for _ in range(2):
+            self.client.get(reverse('posts:index'))
+        text = self.scrape()
+        self.assertIn('# TYPE yatube_view_duration_seconds histogram', text)
+        self.assertIn(
+            'yatube_http_requests_total{view="posts:index",status="200"} 2',
+            text)
+        self.assertIn(
+            'yatube_view_duration_seconds_count{view="posts:index"} 2', text)
+        self.assertIn(
+            'yatube_view_duration_seconds_bucket'
+            '{view="posts:index",le="+Inf"} 2', text)
+        self.assertIn(
+            'yatube_fragment_cache_total'
+            '{fragment="index_page",result="miss"}', text)
+        self.assertIn(
+            'yatube_fragment_cache_total'
+            '{fragment="index_page",result="hit"} 1', text)
+
+    def test_domain_events_are_counted(self):
+        """Подписки, отписки и комментарии попадают в счётчики."""
+        follow = Follow.objects.create(
+            user=MetricsTest.user, author=MetricsTest.author)
+        follow.delete()
+        post = Post.objects.create(text='Пост', author=MetricsTest.author)
+        self.client.force_login(MetricsTest.user)
+        self.client.post(
+            reverse('posts:add_comment', args=[post.pk]), {'text': 'Да'})
+        text = self.scrape()
+        self.assertIn('yatube_follows_total{action="create"} 1', text)
+        self.assertIn('yatube_follows_total{action="delete"} 1', text)
+        self.assertIn('yatube_comments_inserted_total 1', text)
+        self.assertIn('yatube_comment_batch_size_count 1', text)
+
+    def test_processes_are_summed(self):
+        """Выдача складывает файлы всех процессов."""
+        counter = metrics.REGISTRY.metrics['yatube_follows_total']
+        counter.inc(action='create')
+        metrics.REGISTRY.flush()
+        shutil.copy(
+            metrics.REGISTRY.path(),
+            os.path.join(settings.METRICS_DIR, 'metrics-1-0.json'))
+        self.assertIn(
+            'yatube_follows_total{action="create"} 2', self.scrape())
+
+    @skipIf(metrics.fcntl is None, 'архив требует fcntl')
+    def test_dead_processes_are_archived(self):
+        """Файлы завершившихся процессов и тех, чей pid занят новым,
+        переносятся в архив; суммы при этом не меняются.
+        """
+        counter = metrics.REGISTRY.metrics['yatube_follows_total']
+        counter.inc(action='create')
+        metrics.REGISTRY.flush()
+        directory = settings.METRICS_DIR
+        own = metrics.REGISTRY.path()
+        pid = os.getpid()
+        for name in (
+            'metrics-999999-1.json',
+            f'metrics-{pid}-{metrics.REGISTRY.started - 1}.json',
+        ):
+            shutil.copy(own, os.path.join(directory, name))
+        with mock.patch.object(
+                metrics, '_alive', side_effect=lambda other: other == pid):
+            for _ in range(2):
+                self.assertIn(
+                    'yatube_follows_total{action="create"} 3', self.scrape())
+        self.assertEqual(sorted(os.listdir(directory)), sorted([
+            metrics.ARCHIVE_NAME, metrics.LOCK_NAME, os.path.basename(own),
+        ]))
+
+    def test_counters_are_thread_safe(self):
+        """Параллельные inc не теряют приращений."""
+        registry = metrics.Registry()
+        counter = metrics.Counter('test_total', 'Тест.', registry=registry)
+        histogram = metrics.Histogram(
+            'test_seconds', 'Тест.', buckets=(1,), registry=registry)
+
+        def work():
+            for _ in range(1000):
+                counter.inc()
+                histogram.observe(0.5)
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        text = metrics.render(registry.collect())
+        self.assertIn('test_total 8000', text)
+        self.assertIn('test_seconds_bucket{le="1.0"} 8000', text)
+        self.assertIn('test_seconds_sum 4000.0', text)
+
+    def test_label_values_are_escaped(self):
+        registry = metrics.Registry()
+        counter = metrics.Counter(
+            'test_total', 'Тест.', ['view'], registry=registry)
+        counter.inc(view='a"b\\c')
+        self.assertIn(
+            'test_total{view="a\\"b\\\\c"} 1',
+            metrics.render(registry.collect()))
+
+    def test_hidden_from_public(self):
+        """Посторонним /metrics не показывается."""
+        response = self.client.get(
+            reverse('metrics'), REMOTE_ADDR='203.0.113.5')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+
+REPLICAS = ('replica_a', 'replica_b')
+
+
+@override_settings(REPLICA_DATABASES=list(REPLICAS), REPLICA_PIN_SECONDS=60)
+class ReplicaRoutingTest(TransactionTestCase):
+    """Реплики — копии тестовой базы в отдельных файлах SQLite."""
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for alias in REPLICAS:
+            connections.databases[alias] = {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(directory, f'{alias}.sqlite3'),
+            }
+            self.addCleanup(self.drop_replica, alias)
+        self.author = User.objects.create_user(username='Писатель')
+        self.reader = User.objects.create_user(username='Читатель')
+        self.group = Group.objects.create(
+            title='Группа', slug='replicas', description='')
+        self.post = Post.objects.create(
+            author=self.author, group=self.group, text='Пост основной базы')
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.replicate()
+        self.client.force_login(self.reader)
+
+    @staticmethod
+    def drop_replica(alias):
+        connections[alias].close()
+        if hasattr(connections._connections, alias):
+            delattr(connections._connections, alias)
+        del connections.databases[alias]
+
+    def replicate(self):
+        """Копирует основную базу в реплики и помечает их посты."""
+        connection.ensure_connection()
+        for alias in REPLICAS:
+            connections[alias].close()
+            target = sqlite3.connect(connections.databases[alias]['NAME'])
+            connection.connection.backup(target)
+            target.close()
+            Post.objects.using(alias).update(text=f'Пост {alias}')
+
+    def test_feed_pages_read_from_a_replica(self):
+        """Ленты, профиль и пост читаются с реплики."""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', args=[self.group.slug]),
+            reverse('posts:profile', args=[self.author.username]),
+            reverse('posts:post_detail', args=[self.post.pk]),
+            reverse('posts:follow_index'),
+        )
+        for url in urls:
+            with self.subTest(url=url), mock.patch(
+                    'core.routers.random.choice', return_value='replica_b'):
+                response = self.client.get(url)
+                self.assertContains(response, 'Пост replica_b')
+                self.assertNotContains(response, 'Пост основной базы')
+
+    def test_replica_is_chosen_once_per_request(self):
+        """Каждый запрос выбирает реплику заново, но только одну."""
+        seen = set()
+        for alias in REPLICAS * 2:
+            with mock.patch('core.routers.random.choice',
+                            return_value=alias) as choice:
+                response = self.client.get(reverse('posts:index'))
+            choice.assert_called_once()
+            self.assertContains(response, f'Пост {alias}')
+            seen.add(alias)
+        self.assertEqual(seen, set(REPLICAS))
+
+    def test_writes_go_to_primary_and_pin_reads(self):
+        """Запись идёт в основную базу, и автор сразу её видит."""
+        url = reverse('posts:post_detail', args=[self.post.pk])
+        self.assertContains(self.client.get(url), 'Пост replica_')
+        response = self.client.post(
+            reverse('posts:add_comment', args=[self.post.pk]),
+            {'text': 'Свежий комментарий'})
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+        self.assertTrue(Comment.objects.filter(
+            text='Свежий комментарий').exists())
+        for alias in REPLICAS:
+            self.assertFalse(
+                Comment.objects.using(alias).exists())
+        response = self.client.get(url)
+        self.assertContains(response, 'Пост основной базы')
+        self.assertContains(response, 'Свежий комментарий')
+        self.client.cookies[routers.PIN_COOKIE] = '0'
+        self.assertContains(self.client.get(url), 'Пост replica_')
+
+    def test_other_views_read_from_primary(self):
+        """Формы записи и поиск читают основную базу."""
+        self.client.force_login(self.author)
+        response = self.client.get(
+            reverse('posts:post_edit', args=[self.post.pk]))
+        self.assertContains(response, 'Пост основной базы')
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+        self.assertContains(
+            self.client.get(reverse('posts:search'), {'q': 'основной'}),
+            'Пост основной базы')
+
+    def test_without_replicas_everything_reads_primary(self):
+        with self.settings(REPLICA_DATABASES=[]):
+            self.assertContains(
+                self.client.get(reverse('posts:index')), 'Пост основной базы')
+
+
+class SQLiteTuningTest(TestCase):
+    def open_file_database(self):
+        """Новое соединение с отдельным файлом SQLite."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings_dict = dict(connection.settings_dict)
+        settings_dict['NAME'] = os.path.join(directory, 'tuned.sqlite3')
+        wrapper = DatabaseWrapper(settings_dict, alias='tuned')
+        self.addCleanup(wrapper.close)
+        wrapper.ensure_connection()
+        return wrapper
+
+    def pragma(self, wrapper, name):
+        with wrapper.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_new_connection_gets_pragmas(self):
+        wrapper = self.open_file_database()
+        self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'wal')
+        # 1 — NORMAL
+        self.assertEqual(self.pragma(wrapper, 'synchronous'), 1)
+        expected = settings.SQLITE_PRAGMAS
+        self.assertEqual(
+            self.pragma(wrapper, 'busy_timeout'), expected['busy_timeout'])
+        self.assertEqual(
+            self.pragma(wrapper, 'cache_size'), expected['cache_size'])
+
+    @override_settings(SQLITE_PRAGMAS={})
+    def test_pragmas_are_configurable(self):
+        wrapper = self.open_file_database()
+        self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'delete')
+
+    def test_transaction_is_left_alone(self):
+        """Внутри транзакции PRAGMA пропускаются, а не падают."""
+        before = self.pragma(connection, 'synchronous')
+        with override_settings(SQLITE_PRAGMAS={'synchronous': 'OFF'}):
+            db.configure(connection)
+        self.assertEqual(self.pragma(connection, 'synchronous'), before)
+
+    def test_connections_are_persistent(self):
+        self.assertGreater(settings.DATABASES['default']['CONN_MAX_AGE'], 0)
+
+    def test_health(self):
+        response = self.client.get(reverse('health'))
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        data = response.json()
+        self.assertTrue(data['ok'])
+        self.assertTrue(data['databases']['default']['ok'])
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_health_reports_broken_database(self):
+        with mock.patch.object(
+                connection, 'cursor',
+                side_effect=OperationalError('disk I/O error')):
+            response = self.client.get(reverse('health'))
+        self.assertEqual(
+            response.status_code, HTTPStatus.SERVICE_UNAVAILABLE)
+        data = response.json()
+        self.assertFalse(data['ok'])
+        self.assertEqual(
+            data['databases']['default'],
+            {'ok': False, 'error': 'disk I/O error'})
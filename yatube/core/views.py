@@ -1,4 +1,17 @@
+import mimetypes
+import os
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
 from django.shortcuts import render
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_safe
+
+from . import db, media, metrics
 
 
 def page_not_found(request, exception):
@@ -11,3 +24,105 @@ def csrf_failure(request, reason=''):
 
 def server_error(request, reason=''):
     return render(request, 'core/500.html', status=500)
+
+
+def too_many_requests(request, retry_after):
+    response = render(
+        request, 'core/429.html', {'retry_after': retry_after}, status=429)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+@require_safe
+def export_metrics(request):
+    """Метрики всех процессов для Prometheus.
+
+    Доступны при DEBUG, с адресов из INTERNAL_IPS и сотрудникам.
+    """
+    allowed = (
+        settings.DEBUG
+        or request.META.get('REMOTE_ADDR') in settings.INTERNAL_IPS
+        or request.user.is_staff
+    )
+    if not allowed:
+        raise Http404('Страница не найдена')
+    metrics.REGISTRY.flush()
+    return HttpResponse(
+        metrics.render(metrics.load()),
+        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@never_cache
+@require_safe
+def health(request):
+    """Проверка для балансировщика: 200, если все базы отвечают, иначе 503."""
+    databases = db.health()
+    ok = all(state['ok'] for state in databases.values())
+    return JsonResponse(
+        {'ok': ok, 'databases': databases}, status=200 if ok else 503)
+
+
+@require_safe
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Файл не найден')
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404('Файл не найден')
+    if not os.path.isfile(full_path):
+        raise Http404('Файл не найден')
+    current_etag = media.etag(stat)
+    last_modified = http_date(stat.st_mtime)
+    headers = {
+        'ETag': current_etag,
+        'Last-Modified': last_modified,
+        'Accept-Ranges': 'bytes',
+    }
+    response = get_conditional_response(
+        request, etag=current_etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        response = file_response(
+            request, path, full_path, stat.st_size,
+            media.if_range_matches(request, current_etag, last_modified),
+        )
+    for header, value in headers.items():
+        response[header] = value
+    patch_cache_control(
+        response, public=True,
+        max_age=getattr(settings, 'MEDIA_CACHE_MAX_AGE', 86400))
+    return response
+
+
+def file_response(request, path, full_path, size, range_allowed):
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+    if media.sendfile_mode():
+        # байты и диапазоны отдаёт фронтовой сервер
+        response = HttpResponse(content_type=content_type)
+        header, value = media.sendfile_header(path, full_path)
+        response[header] = value
+        return response
+    try:
+        byte_range = media.parse_range(
+            request.META.get('HTTP_RANGE'), size) if range_allowed else None
+    except media.InvalidRange:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    file = open(full_path, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+    else:
+        start, length = byte_range
+        response = FileResponse(
+            media.FileRange(file, start, length),
+            status=206, content_type=content_type)
+        response['Content-Range'] = (
+            f'bytes {start}-{start + length - 1}/{size}')
+        response['Content-Length'] = length
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return response
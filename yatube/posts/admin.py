@@ -1,9 +1,31 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ORDER_VAR, SEARCH_VAR
+from django.db.models import F
 
-from .models import Comment, Follow, Group, Post
+from . import search
+from .models import Comment, Follow, Group, Post, ThumbnailJob
 
 
-class PostAdmin(admin.ModelAdmin):
+class FullTextSearchMixin:
+    """Поиск в админке через полнотекстовый индекс вместо LIKE."""
+
+    search_kind = search.POST
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term or not search.available():
+            return super().get_search_results(
+                request, queryset, search_term)
+        return search.matching(queryset, search_term, self.search_kind), False
+
+    def get_ordering(self, request):
+        # без выбранной в таблице сортировки — по рангу совпадения
+        if (search.available() and request.GET.get(SEARCH_VAR)
+                and ORDER_VAR not in request.GET):
+            return [F('search_rank').asc()]
+        return super().get_ordering(request)
+
+
+class PostAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ('pk', 'text', 'pub_date', 'author', 'group', 'image')
     search_fields = ('text',)
     list_filter = ('pub_date',)
@@ -17,7 +39,8 @@ class GroupAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(FullTextSearchMixin, admin.ModelAdmin):
+    search_kind = search.COMMENT
     list_display = ('pk', 'text', 'author', 'post', 'pub_date')
     search_fields = ('text',)
     list_filter = ('author', 'pub_date',)
@@ -31,7 +54,14 @@ class FollowAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
 
 
+class ThumbnailJobAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'post', 'image', 'status', 'attempts', 'updated')
+    list_filter = ('status',)
+    empty_value_display = '-пусто-'
+
+
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group, GroupAdmin)
 admin.site.register(Comment, CommentAdmin)
 admin.site.register(Follow, FollowAdmin)
+admin.site.register(ThumbnailJob, ThumbnailJobAdmin)
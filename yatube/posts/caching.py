@@ -0,0 +1,165 @@
+"""Версии закэшированных фрагментов ленты.
+
+Карточка поста кэшируется под ключом, в который входят версии поста,
+его группы и автора, а страницы ленты — под ключом с поколением ленты.
+Сигналы записывают новую версию при сохранении, поэтому старые фрагменты
+просто перестают читаться и вытесняются сами.
+
+Версия начинается со времени своего создания. Пока она моложе
+REPLICA_PIN_SECONDS, реплика может ещё не знать о записи, которая её
+сменила, поэтому фрагмент, собранный по данным реплики, хранится под
+отдельным ключом этой реплики (см. replica_scope).
+"""
+import time
+import uuid
+
+from core import routers
+from django.core.cache import cache
+
+CARD_VERSION_KEY = 'post_card_version:{kind}:{pk}'
+
+
+def _new_version():
+    return f'{int(time.time() * 1000):x}-{uuid.uuid4().hex[:8]}'
+
+
+def _created(version):
+    try:
+        return int(str(version).split('-')[0], 16) / 1000
+    except ValueError:
+        return None
+
+
+def replica_scope(*versions):
+    """Суффикс ключа фрагмента: '@реплика', если его собирают по данным
+    реплики, а какая-то из версий моложе REPLICA_PIN_SECONDS, иначе ''.
+    """
+    alias = routers.current_replica()
+    if alias is None:
+        return ''
+    now = time.time()
+    for version in versions:
+        created = _created(version)
+        if created is not None and 0 <= now - created < routers.pin_seconds():
+            return f'@{alias}'
+    return ''
+
+
+def bump_card_version(kind, pk):
+    """Новая версия карточек для поста, группы или автора."""
+    cache.set(CARD_VERSION_KEY.format(kind=kind, pk=pk), _new_version(), None)
+
+
+def version(kind, pk):
+    """Версия карточек одного поста, группы или автора."""
+    key = CARD_VERSION_KEY.format(kind=kind, pk=pk)
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, _new_version(), None)
+        value = cache.get(key)
+    return value
+
+
+def card_version(post):
+    """Составная версия карточки поста: пост, группа и автор."""
+    keys = [
+        CARD_VERSION_KEY.format(kind='post', pk=post.pk),
+        CARD_VERSION_KEY.format(kind='group', pk=post.group_id),
+        CARD_VERSION_KEY.format(kind='author', pk=post.author_id),
+    ]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # версия вытеснена: начинаем новую, а не возвращаемся к старой
+            cache.add(key, _new_version(), None)
+            versions[key] = cache.get(key)
+    values = [versions[key] for key in keys]
+    return '.'.join(str(value) for value in values) + replica_scope(*values)
+
+
+FEED_GENERATION_KEY = 'feed_generation'
+FEED_MODIFIED_KEY = 'feed_modified'
+FOLLOW_VERSION_KEY = 'follow_version:{pk}'
+FRAGMENT_LOCK_TIMEOUT = 30
+FRAGMENT_WAIT = 2
+FRAGMENT_WAIT_STEP = 0.05
+
+
+def feed_generation():
+    """Поколение ленты: меняется при любой записи, влияющей на ленту."""
+    generation = cache.get(FEED_GENERATION_KEY)
+    if generation is None:
+        cache.add(FEED_GENERATION_KEY, _new_version(), None)
+        generation = cache.get(FEED_GENERATION_KEY)
+    return generation
+
+
+def bump_feed_generation():
+    cache.set_many({
+        FEED_GENERATION_KEY: _new_version(),
+        FEED_MODIFIED_KEY: time.time(),
+    }, None)
+
+
+def _timestamp(key):
+    value = cache.get(key)
+    if value is None:
+        # отметка вытеснена: считаем, что изменение было только что
+        cache.add(key, time.time(), None)
+        value = cache.get(key)
+    return value
+
+
+def feed_modified():
+    """Время последнего изменения ленты для заголовка Last-Modified."""
+    return _timestamp(FEED_MODIFIED_KEY)
+
+
+def follow_version(user_id):
+    """Время последнего изменения подписок пользователя или на него."""
+    return _timestamp(FOLLOW_VERSION_KEY.format(pk=user_id))
+
+
+def bump_follow_version(*user_ids):
+    now = time.time()
+    cache.set_many({
+        FOLLOW_VERSION_KEY.format(pk=user_id): now for user_id in user_ids
+    }, None)
+
+
+def _wait_for(key):
+    deadline = time.monotonic() + FRAGMENT_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(FRAGMENT_WAIT_STEP)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[1]
+    return None
+
+
+def get_or_render(key, timeout, render):
+    """Фрагмент из кэша; пересобирает его только один воркер.
+
+    Запись хранится дольше timeout: после «мягкого» истечения один
+    воркер под блокировкой пересобирает фрагмент, а остальные отдают
+    прежнюю версию. Если записи нет совсем, остальные ждут сборки.
+    """
+    lock_key = f'{key}:lock'
+    entry = cache.get(key)
+    if entry is not None:
+        fresh_until, value = entry
+        if time.time() < fresh_until:
+            return value
+        if not cache.add(lock_key, 1, FRAGMENT_LOCK_TIMEOUT):
+            return value
+    elif not cache.add(lock_key, 1, FRAGMENT_LOCK_TIMEOUT):
+        value = _wait_for(key)
+        if value is not None:
+            return value
+        return render()
+    try:
+        value = render()
+        cache.set(key, (time.time() + timeout, value), timeout * 2)
+    finally:
+        cache.delete(lock_key)
+    return value
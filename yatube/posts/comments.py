@@ -0,0 +1,216 @@
+"""Групповая запись комментариев и ограничение их частоты.
+
+Во время наплыва комментариев под популярным постом каждый запрос ждал
+бы блокировку записи SQLite ради одной строки. Здесь потоки процесса
+складывают комментарии в общую пачку. Первый из них становится ведущим:
+ждёт не дольше COMMENT_BATCH_WINDOW секунд или пока пачка не наберёт
+COMMENT_BATCH_SIZE штук, а пока пишется предыдущая пачка, текущая
+продолжает копиться. Затем ведущий записывает пачку одним bulk_create
+в одной транзакции и будит остальных.
+
+Запрос возвращается только после коммита своей пачки, поэтому автор
+сразу видит свой комментарий, а подтверждённый комментарий не теряется
+при падении процесса. bulk_create не шлёт сигналов: счётчики и
+поисковый индекс обновляются здесь же, по пачке целиком. При
+шардировании пачка делится по шардам постов.
+
+Частота ограничивается счётчиками в кэше с фиксированным окном:
+COMMENT_USER_RATE на пользователя и COMMENT_POST_RATE на пост.
+"""
+import math
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from core import routers
+from django.conf import settings
+from django.core.cache import cache
+from django.db import (DEFAULT_DB_ALIAS, DatabaseError, connection,
+                       transaction)
+
+from . import metrics, search, sharding, stats
+from .models import Comment
+
+BATCH_SIZE = 100
+BATCH_WINDOW = 0.005
+USER_RATE = (10, 60)
+POST_RATE = (120, 60)
+
+
+def batch_size():
+    return getattr(settings, 'COMMENT_BATCH_SIZE', BATCH_SIZE)
+
+
+def batch_window():
+    return getattr(settings, 'COMMENT_BATCH_WINDOW', BATCH_WINDOW)
+
+
+def _assign_pks(comments, database):
+    """Проставляет первичные ключи после bulk_create.
+
+    На SQLite Django не получает ключи вставленных строк. Транзакция
+    держит блокировку записи с первой вставки до коммита, поэтому
+    последние len(comments) строк таблицы — наши, в порядке вставки.
+    """
+    if comments[0].pk is not None:
+        return
+    pks = Comment.objects.using(database).order_by('-pk').values_list(
+        'pk', flat=True)[:len(comments)]
+    for comment, pk in zip(comments, reversed(list(pks))):
+        comment.pk = pk
+
+
+def write(comments):
+    """Записывает комментарии: одна транзакция на базу.
+
+    Одиночный комментарий сохраняется обычным save(), остальное делают
+    сигналы. Если пачка не записалась (например, пост успели удалить),
+    комментарии пишутся по одному, чтобы ошибка досталась только
+    виновнику. Возвращает {id(комментария): исключение}.
+    """
+    if len(comments) == 1:
+        try:
+            comments[0].save()
+        except DatabaseError as error:
+            return {id(comments[0]): error}
+        metrics.COMMENTS.inc()
+        metrics.COMMENT_BATCH_SIZE.observe(1)
+        return {}
+    batches = {}
+    for comment in comments:
+        batches.setdefault(
+            sharding.database_for(comment), []).append(comment)
+    errors = {}
+    for database, batch in batches.items():
+        errors.update(_write_batch(database, batch))
+    return errors
+
+
+def _write_batch(database, comments):
+    """Пачка одной базы; счётчики и индекс — в той же транзакции."""
+    try:
+        with ExitStack() as stack:
+            for alias in dict.fromkeys((database, DEFAULT_DB_ALIAS)):
+                stack.enter_context(transaction.atomic(using=alias))
+            sharding.assign_ids(comments)
+            Comment.objects.using(database).bulk_create(comments)
+            _assign_pks(comments, database)
+            for author_id, count in Counter(
+                    comment.author_id for comment in comments).items():
+                stats.bump(author_id, 'comments_count', count)
+            search.index_comments(comments)
+    except DatabaseError:
+        for comment in comments:
+            comment.pk = None
+        errors = {}
+        for comment in comments:
+            errors.update(write([comment]))
+        return errors
+    metrics.COMMENTS.inc(len(comments))
+    metrics.COMMENT_BATCH_SIZE.observe(len(comments))
+    return {}
+
+
+class Batch:
+    def __init__(self):
+        self.comments = []
+        self.errors = {}
+        self.done = threading.Event()
+
+
+class CommentWriter:
+    """Собирает комментарии потоков процесса в пачки."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.batch = None
+        self.writing = False
+
+    def save(self, comment):
+        if connection.in_atomic_block:
+            # откат внешней транзакции унёс бы и чужие комментарии
+            errors = write([comment])
+        else:
+            errors = self.join(comment)
+        error = errors.get(id(comment))
+        if error is not None:
+            raise error
+
+    def join(self, comment):
+        with self.condition:
+            batch = self.batch
+            leader = batch is None or len(batch.comments) >= batch_size()
+            if leader:
+                batch = self.batch = Batch()
+            batch.comments.append(comment)
+            if len(batch.comments) >= batch_size():
+                self.condition.notify_all()
+        if leader:
+            self.lead(batch)
+        else:
+            batch.done.wait()
+        return batch.errors
+
+    def lead(self, batch):
+        deadline = time.monotonic() + batch_window()
+        with self.condition:
+            while True:
+                remaining = deadline - time.monotonic()
+                full = len(batch.comments) >= batch_size()
+                if not self.writing and (full or remaining <= 0):
+                    break
+                self.condition.wait(None if self.writing else remaining)
+            if self.batch is batch:
+                self.batch = None
+            self.writing = True
+        try:
+            batch.errors = write(batch.comments)
+        finally:
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+            batch.done.set()
+
+
+writer = CommentWriter()
+
+
+def save(comment):
+    """Сохраняет комментарий в составе пачки; возвращается после коммита."""
+    # пачку может записать поток другого запроса, а отметка о записи
+    # живёт в потоке: ставим её здесь, чтобы этот запрос закрепился
+    # за основной базой
+    routers.record_write()
+    writer.save(comment)
+
+
+def _hit(key, limit, period):
+    """Учитывает попытку; возвращает секунды до конца окна или 0."""
+    now = time.time()
+    window = int(now // period)
+    key = f'{key}:{window}'
+    cache.add(key, 0, period)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        # ключ вытеснили между add и incr
+        cache.set(key, 1, period)
+        count = 1
+    if count > limit:
+        return max(1, math.ceil((window + 1) * period - now))
+    return 0
+
+
+def throttle(user_id, post_id):
+    """Секунды, через которые можно повторить, или 0, если можно сейчас."""
+    limits = (
+        ('user', user_id, getattr(settings, 'COMMENT_USER_RATE', USER_RATE)),
+        ('post', post_id, getattr(settings, 'COMMENT_POST_RATE', POST_RATE)),
+    )
+    for scope, pk, (limit, period) in limits:
+        retry_after = _hit(f'comments:{scope}:{pk}', limit, period)
+        if retry_after:
+            metrics.COMMENTS_THROTTLED.inc(scope=scope)
+            return retry_after
+    return 0
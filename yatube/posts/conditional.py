@@ -0,0 +1,174 @@
+"""Условный GET для лент и страницы поста.
+
+До вызова представления одним агрегатным запросом считается состояние
+страницы: последняя дата и число постов или комментариев, счётчики
+автора. К нему добавляются поколение ленты из кэша (правки постов,
+групп и имён авторов), версия подписок и всё, от чего зависит вид
+страницы для конкретного пользователя. Главная лента описывается
+одним поколением: агрегат по всей таблице постов на каждый GET /
+стоил бы дороже самой страницы. Если клиент прислал тот же
+ETag или Last-Modified, представление не вызывается и шаблон
+не рендерится: ответ 304.
+
+Last-Modified получают только анонимы: If-Modified-Since сверяет одно
+время, а не зрителя, и после входа или выхода браузер получил бы 304
+со страницей прежнего пользователя. Страницы вошедших сверяются по ETag.
+"""
+import hashlib
+from datetime import datetime
+from functools import wraps
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from . import caching, group_feed, sharding
+from .models import Comment, Post, User
+
+STATS_FIELDS = (
+    'stats__posts_count',
+    'stats__followers_count',
+    'stats__following_count',
+    'stats__comments_count',
+)
+
+
+def conditional(state):
+    """Декоратор: state(request, **kwargs) -> (части ETag, время) или None.
+
+    None означает, что страницу нечем описать (например, её нет),
+    и запрос уходит в представление как обычно.
+    """
+    def decorator(view):
+        @wraps(view)
+        def inner(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            result = state(request, *args, **kwargs)
+            if result is None:
+                return view(request, *args, **kwargs)
+            parts, modified = result
+            etag = quote_etag(
+                hashlib.md5('|'.join(map(str, parts)).encode()).hexdigest())
+            last_modified = None
+            if not request.user.is_authenticated:
+                last_modified = int(modified)
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                response['ETag'] = etag
+                if last_modified is not None:
+                    response['Last-Modified'] = http_date(last_modified)
+            return response
+        return inner
+    return decorator
+
+
+def _timestamp(value):
+    return value.timestamp() if value else 0
+
+
+def _viewer(request, *authors):
+    """Части состояния, зависящие от того, кто смотрит страницу.
+
+    Год из подвала и пользователь в шапке и кнопках «Редактировать»;
+    для страниц с кнопкой подписки — версия подписок зрителя.
+    """
+    user = request.user
+    year = datetime.now().year
+    parts = [year, user.pk]
+    # новый год в подвале меняет страницу и для If-Modified-Since
+    times = [datetime(year, 1, 1).timestamp()]
+    if user.is_authenticated and authors:
+        parts.append(caching.follow_version(user.pk))
+    return parts, times
+
+
+def _profile_row(username):
+    if not sharding.enabled():
+        return User.objects.filter(username=username).annotate(
+            last=Max('posts__pub_date'),
+        ).values_list('pk', 'last', *STATS_FIELDS).first()
+    row = User.objects.filter(username=username).values_list(
+        'pk', *STATS_FIELDS).first()
+    if row is None:
+        return None
+    last = sharding.on_author_shard(
+        Post.objects.filter(author_id=row[0]), row[0]).aggregate(
+        Max('pub_date'))['pub_date__max']
+    return (row[0], last, *row[1:])
+
+
+def _post_row(post_id):
+    if not sharding.enabled():
+        return Post.objects.filter(pk=post_id).annotate(
+            last=Max('comments__pub_date'), total=Count('comments'),
+        ).values_list(
+            'author_id', 'last', 'total',
+            *(f'author__{field}' for field in STATS_FIELDS),
+        ).first()
+    author_id = sharding.on_post_shard(
+        Post.objects.filter(pk=post_id), post_id).values_list(
+        'author_id', flat=True).first()
+    if author_id is None:
+        return None
+    last, total = sharding.on_post_shard(
+        Comment.objects.filter(post_id=post_id), post_id).aggregate(
+        Max('pub_date'), Count('id')).values()
+    stats = User.objects.filter(pk=author_id).values_list(
+        *STATS_FIELDS).first() or (None,) * len(STATS_FIELDS)
+    return (author_id, last, total, *stats)
+
+
+def index_state(request):
+    # любой новый, изменённый или удалённый пост меняет поколение ленты
+    parts, times = _viewer(request)
+    times.append(caching.feed_modified())
+    return parts + [caching.feed_generation()], max(times)
+
+
+def group_state(request, slug):
+    group = group_feed.find_group(slug)
+    if group is None:
+        return None
+    # последний пост и число постов — из списка ленты группы
+    feed = group_feed.load(group.pk)
+    last = -feed['keys'][0][0] if feed['keys'] else 0
+    parts, times = _viewer(request)
+    times += [last, caching.feed_modified()]
+    row = [group.pk, last, feed['total'], feed['generation']]
+    return parts + row + [caching.feed_generation()], max(times)
+
+
+def profile_state(request, username):
+    row = _profile_row(username)
+    if row is None:
+        return None
+    parts, times = _viewer(request, row[0])
+    times += [
+        _timestamp(row[1]),
+        caching.feed_modified(),
+        caching.follow_version(row[0]),
+    ]
+    return parts + list(row) + [caching.feed_generation()], max(times)
+
+
+def post_detail_state(request, post_id):
+    # форма комментария несёт CSRF-токен, привязанный к cookie; пока
+    # cookie нет, токен будет новым при каждом рендеринге
+    csrf_cookie = request.META.get('CSRF_COOKIE')
+    if csrf_cookie is None:
+        return None
+    row = _post_row(post_id)
+    if row is None:
+        return None
+    parts, times = _viewer(request, row[0])
+    times += [
+        _timestamp(row[1]),
+        caching.feed_modified(),
+        caching.follow_version(row[0]),
+    ]
+    parts.append(csrf_cookie)
+    return parts + list(row) + [caching.feed_generation()], max(times)
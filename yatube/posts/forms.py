@@ -1,5 +1,6 @@
 from django import forms
 
+from . import uploads
 from .models import Comment, Post
 
 
@@ -8,6 +9,13 @@ class PostForm(forms.ModelForm):
         model = Post
         fields = ('group', 'text', 'image')
 
+    def clean_image(self):
+        image = self.cleaned_data['image']
+        # новая загрузка; False — «очистить», FieldFile — прежняя картинка
+        if image and 'image' in self.changed_data:
+            image = uploads.normalize(image)
+        return image
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,232 @@
+"""Лента группы из заранее упорядоченного списка id.
+
+Группа по slug берётся из словаря процесса и проверяется по версии
+карточки группы в общем кэше: переименование или правка группы в любом
+процессе меняет версию, и запись перечитывается из базы.
+
+Для каждой группы в кэше лежат до GROUP_FEED_LENGTH новейших постов в
+порядке (-pub_date, -id) и общее число постов. Сигналы правят список
+на месте при создании, удалении и смене группы поста, поэтому страница
+ленты — это срез списка и один запрос за постами по id. Список не
+длиннее GROUP_FEED_LENGTH, так что память на страницу не зависит от
+размера группы; страницы глубже списка читаются из базы как раньше.
+
+Список меняется под блокировкой в кэше и сверяется с поколением группы:
+писатель, не получивший блокировку, только меняет поколение, а список,
+собранный по устаревшему снимку базы, при чтении отбрасывается.
+"""
+import bisect
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import caching, sharding
+from .models import Group, Post
+
+LENGTH = 1000
+TIMEOUT = 60 * 60
+SLUG_CACHE_SIZE = 1024
+LOCK_TIMEOUT = 10
+
+FEED_KEY = 'group_feed:{pk}'
+GENERATION_KEY = 'group_feed_generation:{pk}'
+
+_groups = OrderedDict()
+_groups_lock = threading.Lock()
+
+
+def length():
+    return getattr(settings, 'GROUP_FEED_LENGTH', LENGTH)
+
+
+def timeout():
+    return getattr(settings, 'GROUP_FEED_TIMEOUT', TIMEOUT)
+
+
+def find_group(slug):
+    """Группа по slug или None."""
+    with _groups_lock:
+        entry = _groups.get(slug)
+        if entry is not None:
+            _groups.move_to_end(slug)
+    if entry is not None:
+        group, version = entry
+        if caching.version('group', group.pk) == version:
+            return group
+    group = Group.objects.filter(slug=slug).first()
+    with _groups_lock:
+        if group is None:
+            _groups.pop(slug, None)
+            return None
+        _groups[slug] = (group, caching.version('group', group.pk))
+        while len(_groups) > getattr(
+                settings, 'GROUP_SLUG_CACHE_SIZE', SLUG_CACHE_SIZE):
+            _groups.popitem(last=False)
+    return group
+
+
+def _key(post):
+    return (-post.pub_date.timestamp(), -post.pk)
+
+
+def _generation(group_id):
+    key = GENERATION_KEY.format(pk=group_id)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, 0, None)
+        generation = cache.get(key)
+    return generation
+
+
+def _bump(group_id):
+    key = GENERATION_KEY.format(pk=group_id)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # поколение вытеснено: прежние списки уже не совпадут с новым
+        cache.add(key, 0, None)
+        return cache.incr(key)
+
+
+def _build(group_id):
+    posts = list(sharding.scatter(
+        Post.objects.filter(group_id=group_id).only('id', 'pub_date')
+    )[:length()])
+    total = len(posts)
+    if total == length():
+        total = sharding.scatter(
+            Post.objects.filter(group_id=group_id)).count()
+    return {'keys': [_key(post) for post in posts], 'total': total}
+
+
+def load(group_id):
+    """{'keys': [(-pub_date, -id), ...], 'total': n} для группы."""
+    feed_key = FEED_KEY.format(pk=group_id)
+    generation_key = GENERATION_KEY.format(pk=group_id)
+    cached = cache.get_many([feed_key, generation_key])
+    feed = cached.get(feed_key)
+    generation = cached.get(generation_key)
+    if feed is not None and generation is not None and (
+            feed['generation'] == generation):
+        return feed
+    generation = _generation(group_id)
+    feed = _build(group_id)
+    feed['generation'] = generation
+    cache.set(feed_key, feed, timeout())
+    return feed
+
+
+def _update(group_id, change):
+    """Правит список группы; если не вышло — делает его недействительным."""
+    feed_key = FEED_KEY.format(pk=group_id)
+    lock_key = f'{feed_key}:lock'
+    if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+        _bump(group_id)
+        return
+    try:
+        generation = _generation(group_id)
+        feed = cache.get(feed_key)
+        current = feed is not None and feed['generation'] == generation
+        if _bump(group_id) != generation + 1 or not current:
+            return
+        change(feed)
+        feed['generation'] = generation + 1
+        cache.set(feed_key, feed, timeout())
+    finally:
+        cache.delete(lock_key)
+
+
+def _insert(post):
+    def change(feed):
+        key = _key(post)
+        keys = feed['keys']
+        position = bisect.bisect_left(keys, key)
+        if position < len(keys) and keys[position] == key:
+            return
+        feed['total'] += 1
+        # пост старше окна списка: он на глубокой странице
+        if position < len(keys) or len(keys) == feed['total'] - 1:
+            keys.insert(position, key)
+            del keys[length():]
+    _update(post.group_id, change)
+
+
+def _remove(group_id, post_id):
+    def change(feed):
+        keys = feed['keys']
+        for index, (_, negated_id) in enumerate(keys):
+            if negated_id == -post_id:
+                del keys[index]
+                break
+        feed['total'] = max(feed['total'] - 1, 0)
+    _update(group_id, change)
+
+
+def post_saved(post, created):
+    """Переносит пост в списки групп."""
+    previous = None if created else getattr(post, '_stored_group_id', None)
+    current = post.group_id
+    post._stored_group_id = current
+    if previous == current and not created:
+        return
+    if previous is not None:
+        _remove(previous, post.pk)
+    if current is not None:
+        _insert(post)
+
+
+def post_deleted(post):
+    if post.group_id is not None:
+        _remove(post.group_id, post.pk)
+
+
+def drop(group_id):
+    """Забывает список группы, например после её удаления."""
+    _bump(group_id)
+    cache.delete(FEED_KEY.format(pk=group_id))
+
+
+def reset():
+    """Забывает списки всех групп после записи в обход сигналов."""
+    for group_id in Group.objects.values_list('pk', flat=True).iterator():
+        drop(group_id)
+
+
+class GroupFeed:
+    """Посты группы для пагинатора.
+
+    Срез в пределах списка из кэша читается одним запросом по id;
+    остальное, в том числе фильтры CursorPaginator, идёт к самому
+    запросу.
+    """
+
+    def __init__(self, group):
+        self.group_id = group.pk
+        self.queryset = sharding.scatter(
+            group.posts.select_related('author', 'group'))
+        self._feed = None
+
+    def __getattr__(self, name):
+        return getattr(self.queryset, name)
+
+    def feed(self):
+        if self._feed is None:
+            self._feed = load(self.group_id)
+        return self._feed
+
+    def count(self):
+        return self.feed()['total']
+
+    def __getitem__(self, key):
+        if isinstance(key, slice) and key.step is None:
+            keys = self.feed()['keys']
+            complete = len(keys) == self.count()
+            start = key.start or 0
+            stop = key.stop
+            if stop is not None and (stop <= len(keys) or complete):
+                ids = [-negated_id for _, negated_id in keys[start:stop]]
+                posts = self.queryset.in_bulk(ids)
+                return [posts[pk] for pk in ids if pk in posts]
+        return self.queryset[key]
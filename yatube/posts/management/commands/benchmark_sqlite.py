@@ -0,0 +1,184 @@
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connection
+from django.db.models import Max, Min
+from django.test import override_settings
+
+from posts import sharding
+from posts.models import Comment, Post, User
+from posts.seeding import SHARDED_ERROR, Seeder
+
+from .benchmark_views import summarize
+
+ROLES = ('чтение', 'запись')
+
+
+def read(rng, dataset):
+    """Главная страница и страница случайного поста с комментариями."""
+    list(Post.objects.select_related('author', 'group')[:10])
+    post_id = rng.randint(*dataset['posts'])
+    list(Comment.objects.filter(post_id=post_id).select_related('author'))
+
+
+def write(rng, dataset):
+    """Новый пост или комментарий со всеми сигналами, как в представлениях."""
+    author_id = rng.choice(dataset['users'])
+    if rng.random() < 0.5:
+        Post.objects.create(author_id=author_id, text=f'Замер {rng.random()}')
+    else:
+        Comment.objects.create(
+            author_id=author_id, post_id=rng.randint(*dataset['posts']),
+            text=f'Замер {rng.random()}')
+
+
+OPERATIONS = dict(zip(ROLES, (read, write)))
+
+
+def work(role, dataset, seed, start, seconds, pipe):
+    rng = random.Random(seed)
+    operation = OPERATIONS[role]
+    latencies = []
+    errors = 0
+    start.wait()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        # как в запросе: соединение закрывается по CONN_MAX_AGE
+        close_old_connections()
+        started = time.perf_counter()
+        try:
+            operation(rng, dataset)
+        except OperationalError:
+            # «database is locked»
+            errors += 1
+        else:
+            latencies.append((time.perf_counter() - started) * 1000)
+        close_old_connections()
+    connection.close()
+    pipe.send((latencies, errors))
+    pipe.close()
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность одновременных чтений и '
+            'записей SQLite с PRAGMA по умолчанию и с SQLITE_PRAGMAS '
+            'и постоянными соединениями.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4,
+                            help='Сколько процессов читают.')
+        parser.add_argument('--writers', type=int, default=4,
+                            help='Сколько процессов пишут.')
+        parser.add_argument('--seconds', type=float, default=5,
+                            help='Длительность замера каждого варианта.')
+        parser.add_argument('--users', type=int, default=200,
+                            help='Сколько создать пользователей.')
+        parser.add_argument('--posts', type=int, default=20_000,
+                            help='Сколько создать постов.')
+        parser.add_argument('--comments', type=int, default=20_000,
+                            help='Сколько создать комментариев.')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Зерно генератора данных и операций.')
+
+    def modes(self):
+        """{вариант: (PRAGMA, CONN_MAX_AGE)}."""
+        return {
+            'до': ({}, 0),
+            'после': (
+                settings.SQLITE_PRAGMAS,
+                settings.DATABASES['default'].get('CONN_MAX_AGE') or 60),
+        }
+
+    def use(self, name, conn_max_age):
+        connection.close()
+        connection.settings_dict['NAME'] = name
+        connection.settings_dict['CONN_MAX_AGE'] = conn_max_age
+
+    def prepare(self, path, options):
+        """Заполняет базу без PRAGMA: файл остаётся в журнале DELETE."""
+        self.use(path, 0)
+        with override_settings(SQLITE_PRAGMAS={}):
+            call_command('migrate', verbosity=0)
+            Seeder(
+                users=options['users'], groups=10, posts=options['posts'],
+                comments=options['comments'], follows=10,
+                seed=options['seed'],
+            ).run(log=self.stdout.write)
+            bounds = Post.objects.aggregate(Min('id'), Max('id'))
+            dataset = {
+                'users': list(User.objects.values_list('id', flat=True)),
+                'posts': (bounds['id__min'], bounds['id__max']),
+            }
+        connection.close()
+        return dataset
+
+    def measure(self, dataset, options):
+        # соединение не должно пережить fork
+        connection.close()
+        context = multiprocessing.get_context('fork')
+        start = context.Event()
+        workers = []
+        roles = [ROLES[0]] * options['readers'] + [ROLES[1]] * options[
+            'writers']
+        for index, role in enumerate(roles):
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=work, args=(
+                role, dataset, options['seed'] + index, start,
+                options['seconds'], sender))
+            process.start()
+            workers.append((role, process, receiver))
+        start.set()
+        results = {role: ([], 0) for role in ROLES}
+        for role, process, receiver in workers:
+            latencies, errors = receiver.recv()
+            process.join()
+            total, failed = results[role]
+            results[role] = (total + latencies, failed + errors)
+        return {
+            role: summarize(latencies, errors, options['seconds'])
+            for role, (latencies, errors) in results.items()
+        }
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Замер предназначен для SQLite.')
+        if sharding.enabled():
+            raise CommandError(SHARDED_ERROR)
+        saved = dict(connection.settings_dict)
+        reports = {}
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                base = os.path.join(directory, 'base.sqlite3')
+                dataset = self.prepare(base, options)
+                for mode, (pragmas, conn_max_age) in self.modes().items():
+                    path = os.path.join(directory, f'{mode}.sqlite3')
+                    shutil.copyfile(base, path)
+                    self.use(path, conn_max_age)
+                    with override_settings(SQLITE_PRAGMAS=pragmas):
+                        reports[mode] = self.measure(dataset, options)
+        finally:
+            connection.close()
+            connection.settings_dict.update(saved)
+        self.print_report(reports)
+
+    def print_report(self, reports):
+        self.stdout.write(
+            f'{"вариант":<8}{"операции":<10}{"N":>8}{"ошибок":>8}'
+            f'{"p50":>9}{"p95":>9}{"p99":>9}{"оп./с":>9}')
+        for mode, report in reports.items():
+            for role, item in report.items():
+                self.stdout.write(
+                    f'{mode:<8}{role:<10}{item["requests"]:>8}'
+                    f'{item["errors"]:>8}{item["p50_ms"]:>9.1f}'
+                    f'{item["p95_ms"]:>9.1f}{item["p99_ms"]:>9.1f}'
+                    f'{item["rps"]:>9.1f}')
+        self.stdout.write(
+            'p50-p99 — задержка успешных операций, мс; ошибки — '
+            '«database is locked».')
@@ -0,0 +1,130 @@
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from posts import uploads
+
+# размер миниатюры карточки, которую строит лента после загрузки
+CARD_SIZE = (960, 339)
+
+
+def rss_kb(field):
+    """VmRSS или VmHWM текущего процесса в килобайтах."""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def reset_peak():
+    # Linux сбрасывает VmHWM записью «5» в clear_refs
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+
+def store_as_is(path):
+    """Прежний путь: оригинал сохраняется целиком и декодируется
+    полностью при построении миниатюры."""
+    with Image.open(path) as image:
+        image.load()
+        image.thumbnail(CARD_SIZE)
+    return os.path.getsize(path)
+
+
+def store_normalized(path):
+    """Новый путь: нормализация при загрузке, миниатюра из копии."""
+    with open(path, 'rb') as source:
+        stored = uploads.normalize(File(source, name=path))
+        stored.seek(0)
+        with Image.open(stored) as image:
+            image.load()
+            image.thumbnail(CARD_SIZE)
+        return stored.size
+
+
+def measure(mode, path, pipe):
+    reset_peak()
+    baseline = rss_kb('VmRSS')
+    started = time.perf_counter()
+    size = MODES[mode](path)
+    elapsed = time.perf_counter() - started
+    pipe.send((rss_kb('VmHWM') - baseline, elapsed, size))
+    pipe.close()
+
+
+MODES = {
+    'до': store_as_is,
+    'после': store_normalized,
+}
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пиковую память и время обработки одной загрузки '
+            'до и после нормализации картинок.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--megapixels',
+            type=float,
+            default=40,
+            help='Размер тестовой фотографии в мегапикселях.',
+        )
+        parser.add_argument(
+            '--runs',
+            type=int,
+            default=3,
+            help='Сколько раз измерять каждый вариант.',
+        )
+
+    def make_photo(self, directory, megapixels):
+        """JPEG 4:3 с EXIF и поворотом, как у снимка с телефона."""
+        height = max(1, int((megapixels * 1_000_000 * 3 / 4) ** 0.5))
+        width = max(1, int(height * 4 / 3))
+        gradient = Image.linear_gradient('L').resize((width, height))
+        photo = Image.merge(
+            'RGB', (gradient, gradient.transpose(Image.FLIP_LEFT_RIGHT),
+                    gradient.transpose(Image.FLIP_TOP_BOTTOM)))
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010F] = 'Benchmark Phone'
+        path = os.path.join(directory, 'photo.jpg')
+        photo.save(path, 'JPEG', quality=92, exif=exif)
+        return path, width, height
+
+    def handle(self, *args, **options):
+        # каждая попытка — отдельный процесс, иначе пик памяти один на всех
+        context = multiprocessing.get_context('fork')
+        with tempfile.TemporaryDirectory() as directory:
+            path, width, height = self.make_photo(
+                directory, options['megapixels'])
+            self.stdout.write(
+                f'Снимок {width}x{height}, '
+                f'{os.path.getsize(path) / 2 ** 20:.1f} МБ')
+            for mode in MODES:
+                results = []
+                for _ in range(max(options['runs'], 1)):
+                    receiver, sender = context.Pipe(duplex=False)
+                    worker = context.Process(
+                        target=measure, args=(mode, path, sender))
+                    worker.start()
+                    results.append(receiver.recv())
+                    worker.join()
+                peak = max(result[0] for result in results)
+                elapsed = min(result[1] for result in results)
+                size = results[0][2]
+                self.stdout.write(
+                    f'{mode}: пик RSS {peak / 1024:.1f} МБ, '
+                    f'{elapsed:.2f} с, хранится {size / 2 ** 20:.2f} МБ')
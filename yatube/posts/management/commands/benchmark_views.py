@@ -0,0 +1,306 @@
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import (setup_test_environment,
+                               teardown_test_environment)
+from django.urls import reverse
+
+from posts import sharding
+from posts.models import Comment, Follow, Group, Post, User
+from posts.seeding import SHARDED_ERROR, Seeder
+
+ENDPOINTS = (
+    'index', 'group_list', 'profile', 'post_detail', 'follow_index',
+    'post_create', 'add_comment',
+)
+QUANTILES = {'p50': 0.5, 'p95': 0.95, 'p99': 0.99}
+# ограничение частоты комментариев мешало бы замеру add_comment
+UNTHROTTLED = (10 ** 9, 60)
+
+
+def percentile(sorted_values, q):
+    """Квантиль по ближайшему рангу."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    result = {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'mean_ms': round(sum(latencies) / len(latencies), 2)
+        if latencies else 0.0,
+        'max_ms': round(latencies[-1], 2) if latencies else 0.0,
+    }
+    for name, q in QUANTILES.items():
+        result[f'{name}_ms'] = round(percentile(latencies, q), 2)
+    return result
+
+
+def git_revision():
+    try:
+        revision = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True,
+            check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return revision, dirty
+
+
+class Dataset:
+    """То, из чего собираются адреса запросов."""
+
+    def __init__(self, readers):
+        self.groups = list(Group.objects.values_list('slug', 'pk'))
+        # профили выбираются пропорционально числу постов автора
+        authors = User.objects.annotate(total=Count('posts')).filter(
+            total__gt=0).values_list('username', 'total')
+        self.usernames = [username for username, _ in authors]
+        self.author_weights = list(accumulate(total for _, total in authors))
+        bounds = Post.objects.order_by('id').values_list('id', flat=True)
+        self.first_post = bounds.first()
+        self.last_post = bounds.last()
+        self.reader_ids = list(Follow.objects.order_by('user_id').values_list(
+            'user_id', flat=True).distinct()[:readers])
+
+    def counts(self):
+        return {
+            'users': User.objects.count(),
+            'groups': len(self.groups),
+            'posts': Post.objects.count(),
+            'comments': Comment.objects.count(),
+            'follows': Follow.objects.count(),
+        }
+
+    def post_id(self, rng):
+        return rng.randint(self.first_post, self.last_post)
+
+    def username(self, rng):
+        return rng.choices(
+            self.usernames, cum_weights=self.author_weights)[0]
+
+
+class Worker:
+    """Поток замера: свои клиенты и свой генератор случайных чисел."""
+
+    def __init__(self, dataset, seed):
+        self.dataset = dataset
+        self.random = random.Random(seed)
+        self.guest = Client()
+        self.readers = []
+        for user in User.objects.filter(pk__in=dataset.reader_ids):
+            client = Client()
+            client.force_login(user)
+            self.readers.append(client)
+
+    def request(self, endpoint):
+        """(клиент, метод, адрес, данные) для очередного запроса."""
+        rng = self.random
+        data = self.dataset
+        reader = rng.choice(self.readers)
+        if endpoint == 'index':
+            return self.guest, 'get', reverse('posts:index'), None
+        if endpoint == 'group_list':
+            slug, _ = rng.choice(data.groups)
+            return self.guest, 'get', reverse(
+                'posts:group_list', args=[slug]), None
+        if endpoint == 'profile':
+            username = data.username(rng)
+            return self.guest, 'get', reverse(
+                'posts:profile', args=[username]), None
+        if endpoint == 'post_detail':
+            return self.guest, 'get', reverse(
+                'posts:post_detail', args=[data.post_id(rng)]), None
+        if endpoint == 'follow_index':
+            return reader, 'get', reverse('posts:follow_index'), None
+        if endpoint == 'post_create':
+            payload = {'text': f'Замер {rng.random()}'}
+            if data.groups:
+                _, payload['group'] = rng.choice(data.groups)
+            return reader, 'post', reverse('posts:post_create'), payload
+        return reader, 'post', reverse(
+            'posts:add_comment', args=[data.post_id(rng)]), {
+            'text': f'Замер {rng.random()}'}
+
+    def run(self, endpoint, count):
+        latencies = []
+        errors = 0
+        try:
+            for _ in range(count):
+                client, method, url, payload = self.request(endpoint)
+                started = time.perf_counter()
+                response = getattr(client, method)(url, payload)
+                latencies.append((time.perf_counter() - started) * 1000)
+                if response.status_code >= 400:
+                    errors += 1
+        finally:
+            connections.close_all()
+        return latencies, errors
+
+
+class Command(BaseCommand):
+    help = ('Заполняет отдельную базу синтетическими данными и замеряет '
+            'задержки и пропускную способность основных страниц.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000,
+                            help='Сколько создать пользователей.')
+        parser.add_argument('--groups', type=int, default=20,
+                            help='Сколько создать групп.')
+        parser.add_argument('--posts', type=int, default=100_000,
+                            help='Сколько создать постов.')
+        parser.add_argument('--comments', type=int, default=200_000,
+                            help='Сколько создать комментариев.')
+        parser.add_argument('--follows', type=int, default=20,
+                            help='Подписок на пользователя в среднем.')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Зерно генератора данных и запросов.')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Запросов на каждую страницу.')
+        parser.add_argument('--warmup', type=int, default=20,
+                            help='Неучитываемых запросов перед замером.')
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='Сколько потоков шлют запросы.')
+        parser.add_argument('--readers', type=int, default=50,
+                            help='Сколько вошедших пользователей читают '
+                                 'ленту подписок и пишут.')
+        parser.add_argument('--endpoint', action='append', choices=ENDPOINTS,
+                            help='Замерить только эти страницы.')
+        parser.add_argument('--database-name',
+                            help='Имя базы для замера; для SQLite — путь к '
+                                 'файлу. По умолчанию во временном каталоге.')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='Не удалять базу и переиспользовать '
+                                 'заполненную в следующий раз.')
+        parser.add_argument('--output',
+                            help='Куда сохранить результаты в JSON.')
+        parser.add_argument('--compare',
+                            help='JSON прошлого замера для сравнения.')
+
+    def setup_database(self, options):
+        name = options['database_name']
+        if name is None and connection.vendor == 'sqlite':
+            name = os.path.join(
+                tempfile.gettempdir(), 'yatube-benchmark.sqlite3')
+        if name is not None:
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = name
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options['keepdb'],
+            serialize=False)
+        return old_name
+
+    def seed(self, options):
+        if options['keepdb'] and Post.objects.exists():
+            self.stdout.write('Данные уже есть, заполнение пропущено.')
+            return
+        Seeder(
+            users=options['users'], groups=options['groups'],
+            posts=options['posts'], comments=options['comments'],
+            follows=options['follows'], seed=options['seed'],
+        ).run(log=self.stdout.write)
+
+    def measure(self, dataset, endpoint, options):
+        concurrency = max(1, options['concurrency'])
+        count = max(1, options['requests'] // concurrency)
+        workers = [
+            Worker(dataset, options['seed'] + index)
+            for index in range(concurrency)
+        ]
+        if options['warmup']:
+            workers[0].run(endpoint, options['warmup'])
+        cache.clear()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(
+                lambda worker: worker.run(endpoint, count), workers))
+        elapsed = time.perf_counter() - started
+        latencies = [value for result in results for value in result[0]]
+        errors = sum(result[1] for result in results)
+        return summarize(latencies, errors, elapsed)
+
+    def handle(self, *args, **options):
+        if sharding.enabled():
+            raise CommandError(SHARDED_ERROR)
+        setup_test_environment()
+        old_name = self.setup_database(options)
+        try:
+            self.seed(options)
+            with override_settings(
+                    COMMENT_USER_RATE=UNTHROTTLED,
+                    COMMENT_POST_RATE=UNTHROTTLED):
+                report = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+        self.print_report(report, options['compare'])
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Результаты сохранены в {options["output"]}')
+
+    def run(self, options):
+        dataset = Dataset(options['readers'])
+        revision, dirty = git_revision()
+        report = {
+            'revision': revision,
+            'dirty': dirty,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'options': {
+                name: options[name] for name in (
+                    'seed', 'requests', 'warmup', 'concurrency', 'readers')
+            },
+            'dataset': dataset.counts(),
+            'endpoints': {},
+        }
+        for endpoint in options['endpoint'] or ENDPOINTS:
+            report['endpoints'][endpoint] = self.measure(
+                dataset, endpoint, options)
+        return report
+
+    def print_report(self, report, compare):
+        previous = {}
+        if compare:
+            with open(compare) as file:
+                previous = json.load(file)['endpoints']
+        self.stdout.write(
+            f'{"страница":<14}{"N":>7}{"ошибок":>8}{"p50":>9}{"p95":>9}'
+            f'{"p99":>9}{"запр./с":>10}{"Δ p95":>9}')
+        for endpoint, item in report['endpoints'].items():
+            delta = '—'
+            before = previous.get(endpoint)
+            if before and before['p95_ms']:
+                delta = f'{item["p95_ms"] / before["p95_ms"] - 1:+.0%}'
+            self.stdout.write(
+                f'{endpoint:<14}{item["requests"]:>7}{item["errors"]:>8}'
+                f'{item["p50_ms"]:>9.1f}{item["p95_ms"]:>9.1f}'
+                f'{item["p99_ms"]:>9.1f}{item["rps"]:>10.1f}{delta:>9}')
+        self.stdout.write(
+            'p50-p99 — задержка, мс; Δ p95 — изменение к прошлому замеру.')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from posts import media
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = ('Удаляет картинки постов и их миниатюры, на которые '
+            'не ссылается ни один пост.')
+
+    def handle(self, *args, **options):
+        directory = Post._meta.get_field('image').upload_to
+        removed = media.collect_orphans(directory)
+        self.stdout.write(f'Удалено картинок: {removed}')
@@ -0,0 +1,50 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from posts import export
+
+
+class Command(BaseCommand):
+    help = ('Выгружает посты, комментарии или подписки в JSONL или CSV '
+            'потоком, не загружая таблицу в память.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(export.EXPORTS),
+                            help='Что выгрузить.')
+        parser.add_argument('--format', choices=sorted(export.FORMATS),
+                            default='jsonl', help='Формат строк.')
+        parser.add_argument('--since',
+                            help='Только записи с pub_date не раньше этого '
+                                 'момента (ISO 8601).')
+        parser.add_argument('--output', default='-',
+                            help='Файл выгрузки; «-» — стандартный вывод.')
+        parser.add_argument('--gzip', action='store_true',
+                            help='Сжать выгрузку в gzip.')
+        parser.add_argument('--batch-size', type=int,
+                            help='Строк в одном запросе к базе.')
+
+    def handle(self, *args, **options):
+        # следующая инкрементальная выгрузка начнётся с этого момента
+        started = timezone.now()
+        since = options['since']
+        try:
+            if since is not None:
+                since = export.parse_since(since)
+            chunks = export.stream(
+                options['kind'], options['format'], since,
+                compress=options['gzip'], size=options['batch_size'])
+        except ValueError as error:
+            raise CommandError(error)
+        if options['output'] == '-':
+            self.write(chunks, sys.stdout.buffer)
+        else:
+            with open(options['output'], 'wb') as output:
+                self.write(chunks, output)
+        self.stderr.write(f'Следующий --since: {started.isoformat()}')
+
+    def write(self, chunks, output):
+        for chunk in chunks:
+            output.write(chunk)
+        output.flush()
@@ -0,0 +1,63 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from posts import thumbnails
+from posts.models import Post, ThumbnailJob
+
+
+def drain():
+    close_old_connections()
+    try:
+        return thumbnails.process_pending()
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = 'Строит миниатюры для всех заданий из очереди.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=getattr(settings, 'THUMBNAIL_WORKERS', 2),
+            help='Число потоков, разбирающих очередь.',
+        )
+        parser.add_argument(
+            '--retry-failed',
+            action='store_true',
+            help='Вернуть в очередь задания, исчерпавшие попытки.',
+        )
+        parser.add_argument(
+            '--backfill',
+            action='store_true',
+            help='Поставить в очередь старые картинки без вариантов.',
+        )
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            queued = 0
+            posts = Post.objects.exclude(image='').filter(image_variants='')
+            for post in posts.exclude(
+                    thumbnail_jobs__status=ThumbnailJob.PENDING).iterator():
+                thumbnails.enqueue(post, start=False)
+                queued += 1
+            self.stdout.write(f'Поставлено в очередь: {queued}')
+        released = thumbnails.release_stale()
+        if released:
+            self.stdout.write(f'Возвращено зависших заданий: {released}')
+        if options['retry_failed']:
+            ThumbnailJob.objects.filter(status=ThumbnailJob.FAILED).update(
+                status=ThumbnailJob.PENDING, attempts=0)
+        workers = max(options['workers'], 1)
+        if workers == 1:
+            done = thumbnails.process_pending()
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                done = sum(pool.map(lambda _: drain(), range(workers)))
+        failed = ThumbnailJob.objects.filter(
+            status=ThumbnailJob.FAILED).count()
+        self.stdout.write(f'Обработано заданий: {done}, с ошибкой: {failed}')
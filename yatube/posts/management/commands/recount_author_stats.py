@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.models import AuthorStats, User
+from posts.stats import COUNTERS, actual_all
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики авторов и сообщает о расхождениях.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать расхождения, ничего не исправляя.',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        expected = actual_all()
+        stored = {
+            stats.author_id: stats for stats in AuthorStats.objects.all()
+        }
+        drifted = 0
+        users = User.objects.values_list('id', 'username')
+        with transaction.atomic():
+            for author_id, username in users.iterator():
+                values = {
+                    counter: expected[counter].get(author_id, 0)
+                    for counter in COUNTERS
+                }
+                stats = stored.get(author_id)
+                if stats is None:
+                    if not dry_run:
+                        AuthorStats.objects.create(
+                            author_id=author_id, **values)
+                    continue
+                changes = {
+                    counter: value for counter, value in values.items()
+                    if getattr(stats, counter) != value
+                }
+                if not changes:
+                    continue
+                drifted += 1
+                self.stdout.write(f'{username}: ' + ', '.join(
+                    f'{counter} {getattr(stats, counter)} -> {value}'
+                    for counter, value in changes.items()
+                ))
+                if not dry_run:
+                    AuthorStats.objects.filter(pk=stats.pk).update(**changes)
+        self.stdout.write(f'Авторов с расхождениями: {drifted}')
@@ -0,0 +1,79 @@
+import os
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from posts import sharding
+from posts.seeding import BATCH_SIZE, SHARDED_ERROR, Seeder
+
+
+def moment(value):
+    """Дата и время в ISO 8601; без часового пояса — в текущем."""
+    try:
+        result = datetime.fromisoformat(value)
+    except ValueError as error:
+        raise CommandError(f'Неверная дата {value!r}: {error}')
+    if timezone.is_naive(result):
+        result = timezone.make_aware(result)
+    return result
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими пользователями, группами, '
+            'постами, подписками и комментариями.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10_000,
+                            help='Сколько создать пользователей.')
+        parser.add_argument('--groups', type=int, default=100,
+                            help='Сколько создать групп.')
+        parser.add_argument('--posts', type=int, default=1_000_000,
+                            help='Сколько создать постов.')
+        parser.add_argument('--comments', type=int, default=2_000_000,
+                            help='Сколько создать комментариев.')
+        parser.add_argument('--follows', type=float, default=20,
+                            help='Подписок на пользователя в среднем.')
+        parser.add_argument('--activity', type=float, default=1.1,
+                            help='Показатель Ципфа для числа постов и '
+                                 'комментариев автора.')
+        parser.add_argument('--popularity', type=float, default=1.1,
+                            help='Показатель Ципфа для числа подписчиков.')
+        parser.add_argument('--follow-shape', type=float, default=2.0,
+                            help='Параметр Парето для числа подписок '
+                                 'читателя, больше 1.')
+        parser.add_argument('--days', type=int, default=365,
+                            help='За сколько дней распределить посты.')
+        parser.add_argument('--until', type=moment,
+                            help='Дата последнего поста, ISO 8601; '
+                                 'по умолчанию сейчас.')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Зерно генератора: при одном зерне и '
+                                 'одной дате данные совпадают.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Строк в одном bulk_create.')
+        parser.add_argument('--processes', type=int,
+                            default=os.cpu_count() or 1,
+                            help='Сколько процессов генерируют строки.')
+
+    def handle(self, *args, **options):
+        if sharding.enabled():
+            raise CommandError(SHARDED_ERROR)
+        if options['follow_shape'] <= 1:
+            raise CommandError('--follow-shape должен быть больше 1')
+        started = time.perf_counter()
+        created = Seeder(
+            users=options['users'], groups=options['groups'],
+            posts=options['posts'], comments=options['comments'],
+            follows=options['follows'], activity=options['activity'],
+            popularity=options['popularity'],
+            follow_shape=options['follow_shape'], days=options['days'],
+            until=options['until'], seed=options['seed'],
+            batch_size=options['batch_size'],
+            processes=max(1, options['processes']),
+        ).run(log=self.stdout.write)
+        elapsed = time.perf_counter() - started
+        rows = sum(created.values())
+        self.stdout.write(
+            f'{rows} строк за {elapsed:.1f} с, {rows / elapsed:.0f} строк/с')
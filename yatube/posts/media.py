@@ -0,0 +1,81 @@
+"""Уборка картинок, на которые больше не ссылаются посты.
+
+Число ссылок на файл — это число постов с таким Post.image; его считает
+база по индексу post_image_idx. Файл освобождается после коммита
+удаления или замены картинки и удаляется вместе с миниатюрами, только
+если ссылок не осталось. Файлы, изменённые недавнее
+POST_IMAGE_ORPHAN_GRACE секунд, не трогаются: их могла только что
+переиспользовать чужая незакоммиченная загрузка. Такие файлы позже
+подбирает команда collect_orphan_images.
+"""
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import transaction
+from django.utils import timezone
+from sorl.thumbnail import delete
+from sorl.thumbnail.images import ImageFile
+
+from . import sharding
+from .models import Post
+
+ORPHAN_GRACE = 600
+
+
+def storage():
+    return Post._meta.get_field('image').storage
+
+
+def orphan_grace():
+    return timedelta(
+        seconds=getattr(settings, 'POST_IMAGE_ORPHAN_GRACE', ORPHAN_GRACE))
+
+
+def is_referenced(name):
+    return sharding.scatter(Post.objects.filter(image=name)).exists()
+
+
+def release(name):
+    """Проверяет файл на сиротство, когда транзакция закоммичена."""
+    if name:
+        transaction.on_commit(lambda: collect(name))
+
+
+def collect(name):
+    """Удаляет файл и его миниатюры, если на него нет ссылок."""
+    files = storage()
+    try:
+        if is_referenced(name) or not files.exists(name):
+            return False
+    except SuspiciousFileOperation:
+        # путь вне MEDIA_ROOT, записанный в обход формы, не наш
+        return False
+    if timezone.now() - files.get_modified_time(name) < orphan_grace():
+        return False
+    delete(ImageFile(name, files))
+    return True
+
+
+def stored_names(directory):
+    files = storage()
+    subdirectories, names = files.listdir(directory)
+    for name in names:
+        yield os.path.join(directory, name)
+    for subdirectory in subdirectories:
+        yield from stored_names(os.path.join(directory, subdirectory))
+
+
+def collect_orphans(directory):
+    """Удаляет все осиротевшие файлы каталога; возвращает их число."""
+    if not storage().exists(directory):
+        return 0
+    referenced = set(sharding.scatter(
+        Post.objects.exclude(image='').values_list('image', flat=True)
+    ).iterator())
+    removed = 0
+    for name in stored_names(directory):
+        if name not in referenced and collect(name):
+            removed += 1
+    return removed
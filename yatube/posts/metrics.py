@@ -0,0 +1,22 @@
+"""Метрики подсистем постов для /metrics."""
+from core.metrics import Counter, Histogram
+
+THUMBNAIL_JOBS = Counter(
+    'yatube_thumbnail_jobs_total',
+    'Задания миниатюр: done, retry или failed.', ['result'])
+THUMBNAIL_SECONDS = Histogram(
+    'yatube_thumbnail_build_seconds',
+    'Время сборки всех вариантов одной картинки.',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+FOLLOWS = Counter(
+    'yatube_follows_total', 'Подписки и отписки: create или delete.',
+    ['action'])
+COMMENTS = Counter(
+    'yatube_comments_inserted_total', 'Записанные комментарии.')
+COMMENT_BATCH_SIZE = Histogram(
+    'yatube_comment_batch_size', 'Комментариев в одной записи в базу.',
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250))
+COMMENTS_THROTTLED = Counter(
+    'yatube_comments_throttled_total',
+    'Комментарии, отклонённые ограничением частоты: user или post.',
+    ['scope'])
@@ -0,0 +1,61 @@
+# Generated by Django 2.2.16 on 2026-10-17 04:32
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def fill_author_stats(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    AuthorStats = apps.get_model('posts', 'AuthorStats')
+    counters = {
+        'posts_count': (apps.get_model('posts', 'Post'), 'author_id'),
+        'followers_count': (apps.get_model('posts', 'Follow'), 'author_id'),
+        'following_count': (apps.get_model('posts', 'Follow'), 'user_id'),
+        'comments_count': (apps.get_model('posts', 'Comment'), 'author_id'),
+    }
+    totals = {
+        counter: dict(
+            model.objects.order_by().values(column).annotate(
+                total=Count('pk')).values_list(column, 'total')
+        )
+        for counter, (model, column) in counters.items()
+    }
+    AuthorStats.objects.bulk_create(
+        (
+            AuthorStats(author_id=author_id, **{
+                counter: totals[counter].get(author_id, 0)
+                for counter in counters
+            })
+            for author_id in User.objects.values_list('id', flat=True)
+        ),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0010_timelineentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('posts_count', models.PositiveIntegerField(default=0, verbose_name='Постов')),
+                ('followers_count', models.PositiveIntegerField(default=0, verbose_name='Подписчиков')),
+                ('following_count', models.PositiveIntegerField(default=0, verbose_name='Подписок')),
+                ('comments_count', models.PositiveIntegerField(default=0, verbose_name='Комментариев')),
+                ('author', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+            ],
+            options={
+                'verbose_name': 'Статистика автора',
+                'verbose_name_plural': 'Статистика авторов',
+            },
+        ),
+        migrations.RunPython(fill_author_stats, migrations.RunPython.noop),
+    ]
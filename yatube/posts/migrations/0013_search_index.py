@@ -0,0 +1,67 @@
+"""Полнотекстовый индекс постов и комментариев (SQLite FTS5).
+
+SQL повторяет posts/search.py на момент этой миграции: модуль может
+меняться, миграция — нет. Из приложения берётся только стеммер, он не
+зависит от моделей.
+"""
+from django.db import migrations
+
+from posts.stemmer import tokenize
+
+TABLE = 'posts_search'
+POST = 0
+COMMENT = 1
+BATCH_SIZE = 2000
+
+CREATE_TABLE = (
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5('
+    'body, post_id UNINDEXED, '
+    'tokenize = "unicode61 remove_diacritics 0")'
+)
+INSERT = (
+    f'INSERT OR REPLACE INTO {TABLE} (rowid, body, post_id) '
+    'VALUES (%s, %s, %s)'
+)
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    sources = (
+        (POST, Post.objects.using(connection.alias).values_list(
+            'id', 'text', 'id')),
+        (COMMENT, Comment.objects.using(connection.alias).filter(
+            post__isnull=False).values_list('id', 'text', 'post_id')),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_TABLE)
+        for kind, rows in sources:
+            batch = []
+            for pk, text, post_id in rows.iterator(chunk_size=BATCH_SIZE):
+                # rowid кодирует тип и ключ: pk * 2 + тип
+                batch.append((pk * 2 + kind, ' '.join(tokenize(text)),
+                              post_id))
+                if len(batch) == BATCH_SIZE:
+                    cursor.executemany(INSERT, batch)
+                    batch = []
+            if batch:
+                cursor.executemany(INSERT, batch)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.16 on 2026-10-17 04:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_thumbnail_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_variants',
+            field=models.TextField(blank=True, editable=False, help_text='JSON с именами и размерами готовых миниатюр', verbose_name='Варианты картинки'),
+        ),
+    ]
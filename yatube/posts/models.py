@@ -2,19 +2,36 @@ from core.models import CreatedModel
 from django.contrib.auth import get_user_model
 from django.db import models
 
+from .storage import ContentAddressedStorage
+from .uploads import normalize
+
 User = get_user_model()
 
 
+class RoutedQuerySet(models.QuerySet):
+    def create(self, **kwargs):
+        # без using() базу выбирает роутер по самому объекту: при
+        # шардировании пост пишется в шард своего автора
+        obj = self.model(**kwargs)
+        self._for_write = True
+        obj.save(force_insert=True, using=self._db)
+        return obj
+
+
 class Post(CreatedModel):
+    objects = RoutedQuerySet.as_manager()
+
     text = models.TextField(
         verbose_name='Текст поста',
         help_text='Текст нового поста'
     )
+    # при шардировании пост лежит не в той базе, что автор и группа
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         related_name='posts',
-        verbose_name='Автор'
+        verbose_name='Автор',
+        db_constraint=False,
     )
     group = models.ForeignKey(
         'Group',
@@ -23,22 +40,64 @@ class Post(CreatedModel):
         related_name='posts',
         on_delete=models.SET_NULL,
         verbose_name='Группа',
-        help_text='Группа, к которой будет относиться пост'
+        help_text='Группа, к которой будет относиться пост',
+        db_constraint=False,
     )
     image = models.ImageField(
         verbose_name='Картинка',
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
         blank=True,
         help_text='Картинка, загружаемая к посту'
     )
+    thumbnails_ready = models.BooleanField(
+        verbose_name='Миниатюры готовы',
+        default=False,
+        editable=False,
+    )
+    image_variants = models.TextField(
+        verbose_name='Варианты картинки',
+        blank=True,
+        editable=False,
+        help_text='JSON с именами и размерами готовых миниатюр',
+    )
 
     def __str__(self):
         return self.text[:15]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        stored = dict(zip(field_names, values))
+        # по прежнему имени картинки сигнал найдёт осиротевший файл,
+        # по прежней группе — ленту, из которой убрать пост
+        instance._stored_image = stored.get('image')
+        instance._stored_group_id = stored.get('group_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        # загрузки мимо PostForm (админка, shell) нормализуются здесь
+        if self.image and not self.image._committed and not getattr(
+                self.image.file, 'normalized', False):
+            self.image = normalize(self.image.file)
+        super().save(*args, **kwargs)
+
     class Meta:
-        ordering = ['-pub_date']
+        ordering = ['-pub_date', '-id']
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        indexes = [
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='post_author_date_idx'),
+            models.Index(
+                fields=['group', '-pub_date', '-id'],
+                name='post_group_date_idx'),
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='post_date_id_idx'),
+            models.Index(fields=['image'], name='post_image_idx'),
+        ]
 
 
 class Group(models.Model):
@@ -51,6 +110,8 @@ class Group(models.Model):
 
 
 class Comment(CreatedModel):
+    objects = RoutedQuerySet.as_manager()
+
     post = models.ForeignKey(
         'Post',
         on_delete=models.CASCADE,
@@ -64,7 +125,8 @@ class Comment(CreatedModel):
         User,
         on_delete=models.CASCADE,
         related_name='comments',
-        verbose_name='Автор'
+        verbose_name='Автор',
+        db_constraint=False,
     )
     text = models.TextField(
         verbose_name='Комментарий',
@@ -74,6 +136,13 @@ class Comment(CreatedModel):
     def __str__(self):
         return self.text[:15]
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['post', 'pub_date', 'id'],
+                name='comment_post_date_idx'),
+        ]
+
 
 class Follow(models.Model):
     user = models.ForeignKey(
@@ -88,3 +157,123 @@ class Follow(models.Model):
         related_name='following',
         verbose_name='Подписка'
     )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'author'], name='unique_follow'),
+        ]
+
+
+class TimelineEntry(models.Model):
+    """Материализованная лента подписок: пост, разосланный подписчику."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Читатель'
+    )
+    post = models.ForeignKey(
+        'Post',
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Пост'
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    class Meta:
+        ordering = ['-pub_date']
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'], name='unique_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-post'],
+                name='timeline_user_date_idx'),
+        ]
+
+
+class AuthorStats(models.Model):
+    """Счётчики автора, которые обновляются сигналами при записи."""
+    author = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        related_name='stats',
+        verbose_name='Автор'
+    )
+    posts_count = models.PositiveIntegerField(
+        verbose_name='Постов', default=0)
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Подписчиков', default=0)
+    following_count = models.PositiveIntegerField(
+        verbose_name='Подписок', default=0)
+    comments_count = models.PositiveIntegerField(
+        verbose_name='Комментариев', default=0)
+
+    class Meta:
+        verbose_name = 'Статистика автора'
+        verbose_name_plural = 'Статистика авторов'
+
+    def __str__(self):
+        return f'Статистика {self.author_id}'
+
+
+class ThumbnailJob(models.Model):
+    """Задание очереди на подготовку миниатюр загруженной картинки."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    )
+
+    post = models.ForeignKey(
+        'Post',
+        on_delete=models.CASCADE,
+        related_name='thumbnail_jobs',
+        verbose_name='Пост',
+        db_constraint=False,
+    )
+    image = models.CharField(verbose_name='Картинка', max_length=100)
+    status = models.CharField(
+        verbose_name='Состояние',
+        max_length=16,
+        choices=STATUSES,
+        default=PENDING,
+    )
+    attempts = models.PositiveSmallIntegerField(
+        verbose_name='Попыток', default=0)
+    error = models.TextField(verbose_name='Последняя ошибка', blank=True)
+    created = models.DateTimeField(
+        verbose_name='Поставлено', auto_now_add=True)
+    updated = models.DateTimeField(verbose_name='Изменено', auto_now=True)
+
+    class Meta:
+        ordering = ['created', 'id']
+        verbose_name = 'Задание на миниатюры'
+        verbose_name_plural = 'Задания на миниатюры'
+        indexes = [
+            models.Index(
+                fields=['status', 'created', 'id'],
+                name='thumbnail_job_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.image} ({self.status})'
+
+
+class ShardSequence(models.Model):
+    """Счётчик, из которого выдаются id постов и комментариев шардов."""
+    last = models.BigIntegerField(
+        verbose_name='Последний выданный номер', default=0)
+
+    class Meta:
+        verbose_name = 'Счётчик id шардов'
+        verbose_name_plural = 'Счётчики id шардов'
@@ -0,0 +1,176 @@
+import base64
+import json
+from collections.abc import Sequence
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db.models import Q
+
+CURSOR_PARAM = 'cursor'
+FORWARD = 'n'
+BACKWARD = 'p'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_token(direction, values):
+    """Непрозрачный для клиента курсор: направление и значения ключа."""
+    raw = json.dumps([direction, values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_token(cursor, size):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        direction, values = json.loads(
+            base64.urlsafe_b64decode(padded.encode()).decode()
+        )
+        if direction not in (FORWARD, BACKWARD):
+            raise ValueError(direction)
+        if not isinstance(values, list) or len(values) != size:
+            raise ValueError(values)
+    except Exception as error:
+        raise InvalidCursor(cursor) from error
+    return direction, values
+
+
+class CursorPage(Sequence):
+    """Страница ленты, полученная по курсору.
+
+    Повторяет интерфейс django.core.paginator.Page там, где его используют
+    шаблоны, но не знает ни номера страницы, ни общего числа записей.
+    """
+
+    def __init__(self, object_list, paginator, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return '<CursorPage of %s objects>' % len(self)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """Keyset-пагинация по упорядоченному набору полей.
+
+    Вместо OFFSET и COUNT(*) следующая страница выбирается условием
+    «строго после последней записи», поэтому стоимость запроса не зависит
+    от глубины прокрутки. Последнее поле ordering должно быть уникальным.
+    """
+
+    is_cursor = True
+
+    def __init__(self, object_list, per_page,
+                 ordering=('-pub_date', '-id'), cursor_param=CURSOR_PARAM,
+                 base_query=''):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.cursor_param = cursor_param
+        # прочие GET-параметры, которые ссылки пагинатора должны сохранить
+        self.base_query = base_query
+        self.fields = [name.lstrip('-') for name in self.ordering]
+
+    def encode_cursor(self, obj, direction):
+        return encode_token(direction, [
+            self._field(name).value_to_string(obj) for name in self.fields
+        ])
+
+    def decode_cursor(self, cursor):
+        direction, values = decode_token(cursor, len(self.fields))
+        try:
+            values = [
+                self._field(name).to_python(value)
+                for name, value in zip(self.fields, values)
+            ]
+        except Exception as error:
+            raise InvalidCursor(cursor) from error
+        return direction, values
+
+    def get_page(self, cursor=None):
+        """Возвращает страницу; неверный курсор ведёт на первую страницу."""
+        direction, values = FORWARD, None
+        if cursor:
+            try:
+                direction, values = self.decode_cursor(cursor)
+            except InvalidCursor:
+                pass
+        queryset = self.object_list
+        if direction == FORWARD:
+            ordering = self.ordering
+        else:
+            ordering = tuple(self._reverse(name) for name in self.ordering)
+        if values is not None:
+            queryset = queryset.filter(self._after(ordering, values))
+        rows = list(queryset.order_by(*ordering)[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if direction == BACKWARD:
+            rows.reverse()
+        has_next = has_more if direction == FORWARD else values is not None
+        has_previous = values is not None if direction == FORWARD else has_more
+        return CursorPage(
+            rows,
+            self,
+            self.encode_cursor(rows[-1], FORWARD)
+            if rows and has_next else None,
+            self.encode_cursor(rows[0], BACKWARD)
+            if rows and has_previous else None,
+        )
+
+    def _field(self, name):
+        return self.object_list.model._meta.get_field(name)
+
+    @staticmethod
+    def _reverse(name):
+        return name[1:] if name.startswith('-') else '-' + name
+
+    def _after(self, ordering, values):
+        """Условие «строго после values» при сортировке ordering.
+
+        Лишняя с точки зрения логики граница по первому полю даёт базе
+        диапазон индекса: без неё OR читает индекс с самого начала.
+        """
+        condition = Q()
+        for position, name in enumerate(ordering):
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            field = self.fields[position]
+            step = Q(**{f'{field}__{lookup}': values[position]})
+            for prev in range(position):
+                step &= Q(**{self.fields[prev]: values[prev]})
+            condition |= step
+        bound = 'lte' if ordering[0].startswith('-') else 'gte'
+        return Q(**{f'{self.fields[0]}__{bound}': values[0]}) & condition
+
+
+def cursor_mode(request):
+    """Режим курсоров включается настройкой или параметром ?cursor=."""
+    mode = getattr(settings, 'POSTS_PAGINATION_MODE', 'page')
+    return mode == 'cursor' or CURSOR_PARAM in request.GET
+
+
+def get_page(request, object_list, per_page):
+    """Страница ленты в режиме номеров страниц или курсоров."""
+    if cursor_mode(request):
+        paginator = CursorPaginator(object_list, per_page)
+        return paginator.get_page(request.GET.get(CURSOR_PARAM))
+    paginator = Paginator(object_list, per_page)
+    return paginator.get_page(request.GET.get('page'))
@@ -0,0 +1,232 @@
+"""Полнотекстовый поиск по постам и комментариям.
+
+Индекс — виртуальная таблица SQLite FTS5, в которую пишутся основы слов
+(см. stemmer.py), а не исходный текст. Пост и комментарии к нему
+индексируются отдельными строками с общим post_id; rowid кодирует тип
+и первичный ключ объекта. Сигналы поддерживают индекс в актуальном
+состоянии. На других СУБД поиск откатывается к LIKE по тексту.
+"""
+from urllib.parse import urlencode
+
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from . import sharding
+from .models import Comment, Post
+from .pagination import (BACKWARD, CURSOR_PARAM, FORWARD, CursorPage,
+                         CursorPaginator, InvalidCursor, decode_token,
+                         encode_token)
+from .stemmer import tokenize
+
+TABLE = 'posts_search'
+POST = 0
+COMMENT = 1
+REBUILD_CHUNK_SIZE = 2000
+# SQLite ограничивает число параметров в одном запросе
+STORE_BATCH_SIZE = 300
+
+RANKED = (
+    f'SELECT post_id, MIN(rank) AS score FROM {TABLE} '
+    f'WHERE {TABLE} MATCH %s GROUP BY post_id'
+)
+MATCHING = (
+    f'SELECT rowid / 2 FROM {TABLE} WHERE {TABLE} MATCH %s '
+    'AND rowid %% 2 = %s'
+)
+RANK = (
+    f'SELECT rank FROM {TABLE} WHERE {TABLE} MATCH %s '
+    'AND rowid = {column} * 2 + %s'
+)
+
+
+def available():
+    return connection.vendor == 'sqlite'
+
+
+def _rowid(kind, pk):
+    return pk * 2 + kind
+
+
+def _execute(sql, params=()):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        if cursor.description:
+            return cursor.fetchall()
+    return []
+
+
+def _store(rows):
+    _execute(
+        f'INSERT OR REPLACE INTO {TABLE} (rowid, body, post_id) '
+        'VALUES ' + ', '.join(['(%s, %s, %s)'] * len(rows)),
+        [value for row in rows for value in row],
+    )
+
+
+def _document(text):
+    return ' '.join(tokenize(text))
+
+
+def index_post(post):
+    if available():
+        _store([(_rowid(POST, post.pk), _document(post.text), post.pk)])
+
+
+def index_comment(comment):
+    index_comments([comment])
+
+
+def index_comments(comments):
+    """Индексирует пачку комментариев, записанную через bulk_create."""
+    if not available():
+        return
+    rows = [
+        (_rowid(COMMENT, comment.pk), _document(comment.text), comment.post_id)
+        for comment in comments if comment.post_id is not None
+    ]
+    for start in range(0, len(rows), STORE_BATCH_SIZE):
+        _store(rows[start:start + STORE_BATCH_SIZE])
+
+
+def unindex(kind, pk):
+    if available():
+        _execute(
+            f'DELETE FROM {TABLE} WHERE rowid = %s', [_rowid(kind, pk)])
+
+
+def rebuild():
+    """Пересобирает индекс целиком, например после bulk_create."""
+    if not available():
+        return
+    _execute(f'DELETE FROM {TABLE}')
+    sources = (
+        (POST, Post.objects.values_list('id', 'text', 'id')),
+        (COMMENT, Comment.objects.filter(
+            post__isnull=False).values_list('id', 'text', 'post_id')),
+    )
+    for kind, rows in sources:
+        batch = []
+        for pk, text, post_id in rows.iterator(chunk_size=REBUILD_CHUNK_SIZE):
+            batch.append((_rowid(kind, pk), _document(text), post_id))
+            if len(batch) == STORE_BATCH_SIZE:
+                _store(batch)
+                batch = []
+        if batch:
+            _store(batch)
+
+
+def match_expression(query):
+    """Запрос FTS5: все основы слов запроса, каждая в кавычках."""
+    stems = dict.fromkeys(stem for stem in tokenize(query) if stem)
+    return ' '.join('"{}"'.format(stem.replace('"', '""')) for stem in stems)
+
+
+def matching_ids(query, kind):
+    """Ключи постов или комментариев, подходящих под запрос, по рангу."""
+    expression = match_expression(query)
+    if not expression:
+        return []
+    if not available():
+        model = Post if kind == POST else Comment
+        return list(model.objects.filter(
+            text__icontains=query).values_list('id', flat=True))
+    rows = _execute(
+        f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s '
+        'AND rowid %% 2 = %s ORDER BY rank',
+        [expression, kind],
+    )
+    return [rowid // 2 for rowid, in rows]
+
+
+def matching(queryset, query, kind):
+    """queryset, суженный до подходящих под запрос объектов kind.
+
+    Совпадения отбирает подзапрос к индексу, а не список ключей, а
+    аннотация search_rank несёт ранг bm25 (чем меньше, тем лучше).
+    """
+    expression = match_expression(query)
+    if not expression:
+        return queryset.none().annotate(
+            search_rank=Value(0, FloatField()))
+    quote = connection.ops.quote_name
+    meta = queryset.model._meta
+    column = f'{quote(meta.db_table)}.{quote(meta.pk.column)}'
+    # pk__in=RawSQL(...) дало бы IN ((SELECT ...)), а SQLite читает это
+    # как список из одного значения
+    return queryset.extra(
+        where=[f'{column} IN ({MATCHING})'], params=[expression, kind],
+    ).annotate(search_rank=RawSQL(
+        RANK.format(column=column), [expression, kind], FloatField()))
+
+
+class SearchPaginator:
+    """Keyset-пагинация результатов поиска по (рангу, post_id).
+
+    Пост попадает в выдачу один раз с лучшим рангом среди его текста
+    и комментариев. Ранг bm25 тем лучше, чем меньше.
+    """
+
+    is_cursor = True
+
+    def __init__(self, query, per_page, cursor_param=CURSOR_PARAM):
+        self.query = query
+        self.per_page = int(per_page)
+        self.cursor_param = cursor_param
+        self.base_query = urlencode({'q': query})
+
+    def get_page(self, cursor=None):
+        expression = match_expression(self.query)
+        if not expression:
+            return CursorPage([], self, None, None)
+        direction, values = FORWARD, None
+        if cursor:
+            try:
+                direction, values = decode_token(cursor, 2)
+                values = [float(values[0]), int(values[1])]
+            except (InvalidCursor, TypeError, ValueError):
+                direction, values = FORWARD, None
+        order, compare = ('ASC', '>') if direction == FORWARD else (
+            'DESC', '<')
+        sql = f'SELECT post_id, score FROM ({RANKED})'
+        params = [expression]
+        if values is not None:
+            sql += (
+                f' WHERE score {compare} %s '
+                f'OR (score = %s AND post_id {compare} %s)'
+            )
+            params += [values[0], values[0], values[1]]
+        sql += f' ORDER BY score {order}, post_id {order} LIMIT %s'
+        params.append(self.per_page + 1)
+        rows = _execute(sql, params)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if direction == BACKWARD:
+            rows.reverse()
+        has_next = has_more if direction == FORWARD else values is not None
+        has_previous = values is not None if direction == FORWARD else has_more
+        posts = sharding.scatter(
+            Post.objects.select_related('author', 'group')).in_bulk(
+            [post_id for post_id, _ in rows])
+        return CursorPage(
+            [posts[post_id] for post_id, _ in rows if post_id in posts],
+            self,
+            encode_token(FORWARD, [rows[-1][1], rows[-1][0]])
+            if rows and has_next else None,
+            encode_token(BACKWARD, [rows[0][1], rows[0][0]])
+            if rows and has_previous else None,
+        )
+
+
+def search_page(query, per_page, cursor=None):
+    """Страница результатов поиска по постам и комментариям."""
+    if available():
+        return SearchPaginator(query, per_page).get_page(cursor)
+    posts = Post.objects.none()
+    if query:
+        posts = sharding.scatter(Post.objects.filter(
+            Q(text__icontains=query) | Q(comments__text__icontains=query)
+        ).distinct().select_related('author', 'group'))
+    return CursorPaginator(
+        posts, per_page, base_query=urlencode({'q': query})
+    ).get_page(cursor)
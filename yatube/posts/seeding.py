@@ -0,0 +1,379 @@
+"""Синтетические данные для замеров производительности.
+
+Пользователи и группы собираются через mixer, тексты постов и
+комментариев — из предложений Faker; всё пишется bulk_create пачками.
+Активность авторов и число их подписчиков распределены по закону Ципфа,
+число подписок читателя — по Парето: немногие авторы пишут большую часть
+постов, немногие собирают большую часть подписок. Ранги активности и
+популярности независимы: если бы самые плодовитые авторы были и самыми
+читаемыми, ленты подписок росли бы на порядок. Показатели распределений
+настраиваются. Даты постов растут вместе с id и растянуты на days дней
+назад от until.
+
+Строки генерируются кусками по CHUNK_SIZE в нескольких процессах, а
+пишет их один основной процесс: SQLite всё равно допускает одного
+писателя. У каждого куска свой генератор случайных чисел, зерно
+которого выводится из seed и номера куска, поэтому одинаковый seed даёт
+одинаковые данные при любом числе процессов.
+
+bulk_create не шлёт сигналов, поэтому счётчики авторов, поисковый
+индекс и ленты подписок пересчитываются в конце, в refresh().
+
+С шардами (POST_SHARDS) генератор не работает: bulk_create пишет мимо
+роутера в основную базу и раздаёт id без ShardSequence.
+"""
+import multiprocessing
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import accumulate, chain
+
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+from faker import Faker
+from mixer.backend.django import Mixer
+
+from . import caching, group_feed, search, sharding, timeline
+from .models import AuthorStats, Comment, Follow, Group, Post, User
+from .stats import COUNTERS, actual_all
+
+BATCH_SIZE = 5000
+CHUNK_SIZE = 20000
+SENTENCES = 2000
+# доля постов без группы
+UNGROUPED = 0.3
+# комментарии приходят в первую неделю после поста
+COMMENT_SPAN = timedelta(days=7)
+# PRAGMA SQLite на время заливки; cache_size в КиБ со знаком минус
+BULK_PRAGMAS = {'synchronous': 'OFF', 'cache_size': -262144}
+
+SHARDED_ERROR = 'Синтетические данные не заливаются в шарды (POST_SHARDS).'
+
+# Seeder, чьи данные наследуют процессы-генераторы
+_plan = None
+
+
+def zipf_weights(count, exponent):
+    """Накопленные веса рангов 1..count для random.choices."""
+    return list(accumulate(1 / rank ** exponent
+                           for rank in range(1, count + 1)))
+
+
+@contextmanager
+def explicit_dates(*models):
+    """Отключает auto_now_add у pub_date, чтобы сохранить заданные даты."""
+    fields = [model._meta.get_field('pub_date') for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+@contextmanager
+def bulk_load():
+    """Ослабляет гарантии SQLite на время заливки.
+
+    Без fsync на каждый коммит и с большим кэшем страниц индексы
+    обновляются в памяти. Сбой посреди заливки может испортить базу, но
+    такую базу всё равно заполняют заново. Внутри транзакции SQLite не
+    даёт менять synchronous, и настройки остаются как есть.
+    """
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        yield
+        return
+    with connection.cursor() as cursor:
+        saved = {}
+        for name, value in BULK_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name}')
+            saved[name] = cursor.fetchone()[0]
+            cursor.execute(f'PRAGMA {name} = {value}')
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            for name, value in saved.items():
+                cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def _max_id(model):
+    return model.objects.aggregate(top=Max('id'))['top'] or 0
+
+
+def _new_ids(model, after):
+    return list(model.objects.filter(id__gt=after).order_by('id').values_list(
+        'id', flat=True))
+
+
+def _write(model, objects, batch_size):
+    """Пишет объекты пачками в одной транзакции; возвращает их число."""
+    batch = []
+    total = 0
+    with transaction.atomic():
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) == batch_size:
+                model.objects.bulk_create(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            model.objects.bulk_create(batch)
+            total += len(batch)
+    return total
+
+
+def _chunks(total):
+    """(номер, начало, размер) кусков по CHUNK_SIZE."""
+    for index, start in enumerate(range(0, total, CHUNK_SIZE)):
+        yield index, start, min(CHUNK_SIZE, total - start)
+
+
+def _run(function, chunk):
+    return getattr(_plan, function)(*chunk)
+
+
+def _generate(seeder, function, total):
+    """Объекты кусков по порядку; куски генерируют seeder.processes
+    процессов, впереди записи готовится не больше двух кусков на процесс.
+    """
+    global _plan
+    chunks = _chunks(total)
+    if seeder.processes <= 1:
+        _plan = seeder
+        yield from chain.from_iterable(
+            _run(function, chunk) for chunk in chunks)
+        return
+    # потомки наследуют соединение с базой, но не пользуются им
+    _plan = seeder
+    context = multiprocessing.get_context('fork')
+    with context.Pool(seeder.processes) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(_run, (function, chunk)))
+            if len(pending) > seeder.processes * 2:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+
+class Seeder:
+    """Генератор набора данных; одинаковый seed даёт одинаковые данные.
+
+    activity — показатель Ципфа для числа постов и комментариев автора,
+    popularity — для числа подписчиков автора, follow_shape — параметр
+    Парето для числа подписок читателя (больше единицы; чем меньше, тем
+    длиннее хвост). В среднем у читателя follows подписок.
+    """
+
+    def __init__(self, users=1000, groups=20, posts=100_000,
+                 comments=200_000, follows=20, activity=1.1, popularity=1.1,
+                 follow_shape=2.0, days=365, until=None, seed=0,
+                 batch_size=BATCH_SIZE, processes=1):
+        if follow_shape <= 1:
+            raise ValueError('follow_shape должен быть больше единицы')
+        if sharding.enabled():
+            raise ValueError(SHARDED_ERROR)
+        self.users = users
+        self.groups = groups
+        self.posts = posts
+        self.comments = comments
+        self.follows = follows
+        self.activity = activity
+        self.popularity = popularity
+        self.follow_shape = follow_shape
+        self.seed = seed
+        self.batch_size = batch_size
+        self.processes = processes
+        faker = Faker('ru_RU')
+        faker.seed_instance(seed)
+        self.sentences = [faker.sentence() for _ in range(SENTENCES)]
+        self.now = until or timezone.now()
+        self.start = self.now - timedelta(days=days)
+
+    def rng(self, kind, index=0):
+        return random.Random(f'{self.seed}:{kind}:{index}')
+
+    def mixer(self, kind, index=0):
+        # mixer берёт значения и из Faker, и из модуля random
+        random.seed(f'{self.seed}:{kind}:{index}')
+        mixer = Mixer(commit=False)
+        mixer.faker.seed_instance(f'{self.seed}:{kind}:{index}')
+        return mixer
+
+    def text(self, rng, low, high):
+        return ' '.join(rng.sample(self.sentences, rng.randint(low, high)))
+
+    def user_chunk(self, index, start, count):
+        mixer = self.mixer('users', index)
+        # пароль «!» — непригодный: под этими пользователями не войти
+        names = (f'{self.user_prefix}{number}'
+                 for number in range(start, start + count))
+        return mixer.cycle(count).blend(
+            User, username=names, password='!', is_staff=False,
+            is_superuser=False, date_joined=self.start,
+        )
+
+    def create_users(self):
+        after = _max_id(User)
+        self.user_prefix = f'seed{after}_'
+        _write(User, _generate(self, 'user_chunk', self.users),
+               self.batch_size)
+        ids = _new_ids(User, after)
+        self.user_ids = ids
+        # ранги не должны совпадать с порядком регистрации
+        self.active_ids = list(ids)
+        self.rng('activity').shuffle(self.active_ids)
+        self.popular_ids = list(ids)
+        self.rng('popularity').shuffle(self.popular_ids)
+        self.activity_weights = zipf_weights(len(ids), self.activity)
+        self.popularity_weights = zipf_weights(len(ids), self.popularity)
+        return len(ids)
+
+    def create_groups(self):
+        after = _max_id(Group)
+        mixer = self.mixer('groups')
+        _write(Group, mixer.cycle(self.groups).blend(
+            Group, slug=mixer.sequence(f'seed-{after}-{{0}}'),
+        ), self.batch_size)
+        self.group_ids = _new_ids(Group, after)
+        self.group_weights = zipf_weights(len(self.group_ids), self.activity)
+        return len(self.group_ids)
+
+    def author(self, rng):
+        return rng.choices(
+            self.active_ids, cum_weights=self.activity_weights)[0]
+
+    def post_date(self, index):
+        step = (self.now - self.start) / max(self.posts, 1)
+        return self.start + step * (index + 0.5)
+
+    def post_chunk(self, index, start, count):
+        rng = self.rng('posts', index)
+        posts = []
+        for number in range(start, start + count):
+            group_id = None
+            if self.group_ids and rng.random() >= UNGROUPED:
+                group_id = rng.choices(
+                    self.group_ids, cum_weights=self.group_weights)[0]
+            posts.append(Post(
+                text=self.text(rng, 1, 6),
+                author_id=self.author(rng),
+                group_id=group_id,
+                pub_date=self.post_date(number),
+            ))
+        return posts
+
+    def create_posts(self):
+        after = _max_id(Post)
+        _write(Post, _generate(self, 'post_chunk', self.posts),
+               self.batch_size)
+        # пишет один процесс, поэтому id новых постов идут подряд
+        bounds = Post.objects.filter(id__gt=after).aggregate(
+            first=Min('id'), last=Max('id'))
+        self.first_post = bounds['first'] or after + 1
+        self.last_post = bounds['last'] or after
+        return self.last_post - self.first_post + 1
+
+    def follow_chunk(self, index, start, count):
+        rng = self.rng('follows', index)
+        limit = len(self.user_ids) - 1
+        # среднее Парето — shape * scale / (shape - 1)
+        scale = self.follows * (self.follow_shape - 1) / self.follow_shape
+        follows = []
+        for user_id in self.user_ids[start:start + count]:
+            wanted = min(limit, int(rng.paretovariate(self.follow_shape)
+                                    * scale))
+            authors = set()
+            for _ in range(wanted * 2):
+                if len(authors) == wanted:
+                    break
+                author_id = rng.choices(
+                    self.popular_ids, cum_weights=self.popularity_weights)[0]
+                if author_id != user_id:
+                    authors.add(author_id)
+            follows.extend(
+                Follow(user_id=user_id, author_id=author_id)
+                for author_id in sorted(authors))
+        return follows
+
+    def create_follows(self):
+        return _write(
+            Follow, _generate(self, 'follow_chunk', len(self.user_ids)),
+            self.batch_size)
+
+    def comment_chunk(self, index, start, count):
+        rng = self.rng('comments', index)
+        span = self.last_post - self.first_post + 1
+        comments = []
+        for _ in range(count):
+            # свежие посты комментируют чаще
+            number = int(span * rng.random() ** 0.5)
+            posted = self.post_date(number)
+            window = min(COMMENT_SPAN, self.now - posted)
+            comments.append(Comment(
+                text=self.text(rng, 1, 2),
+                author_id=self.author(rng),
+                post_id=self.first_post + number,
+                pub_date=posted + window * rng.random(),
+            ))
+        return comments
+
+    def create_comments(self):
+        if self.last_post < self.first_post:
+            return 0
+        return _write(
+            Comment, _generate(self, 'comment_chunk', self.comments),
+            self.batch_size)
+
+    def run(self, log=None):
+        """Создаёт весь набор; возвращает число строк по моделям.
+
+        log, если передан, получает строку о каждом готовом этапе.
+        """
+        phases = {
+            'users': self.create_users,
+            'groups': self.create_groups,
+            'posts': self.create_posts,
+            'follows': self.create_follows,
+            'comments': self.create_comments,
+        }
+        created = {}
+        with bulk_load():
+            with explicit_dates(Post, Comment):
+                for name, create in phases.items():
+                    started = time.perf_counter()
+                    created[name] = create()
+                    if log:
+                        log(f'{name}: {created[name]} за '
+                            f'{time.perf_counter() - started:.1f} с')
+            started = time.perf_counter()
+            refresh(self.batch_size)
+        if log:
+            log(f'счётчики, поиск и ленты: '
+                f'{time.perf_counter() - started:.1f} с')
+        return created
+
+
+def refresh(batch_size=BATCH_SIZE):
+    """Пересчитывает то, что обычно поддерживают сигналы."""
+    expected = actual_all()
+    with transaction.atomic():
+        AuthorStats.objects.all().delete()
+        _write(AuthorStats, (
+            AuthorStats(author_id=author_id, **{
+                counter: expected[counter].get(author_id, 0)
+                for counter in COUNTERS
+            })
+            for author_id in User.objects.values_list(
+                'id', flat=True).iterator()
+        ), batch_size)
+    search.rebuild()
+    with transaction.atomic():
+        timeline.rebuild_all()
+    group_feed.reset()
+    caching.bump_feed_generation()
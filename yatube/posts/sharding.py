@@ -0,0 +1,393 @@
+"""Шардирование постов и комментариев по автору.
+
+Когда POST_SHARDS перечисляет алиасы баз, посты автора живут в шарде
+crc32(author_id) % N, а комментарии — в шарде своего поста. Остальные
+модели (пользователи, группы, подписки, счётчики, поисковый индекс)
+остаются в основной базе. Без POST_SHARDS модуль ничего не меняет.
+
+Номера постов и комментариев выдаёт счётчик ShardSequence основной
+базы: id = номер * N + номер шарда, поэтому id уникальны во всех шардах
+и по id поста сразу понятно, где он лежит. Страница поста, правка и
+комментарий идут в один шард, профиль — в шард автора. Главная лента,
+группа и подписки опрашивают шарды параллельными потоками строк,
+упорядоченными по -pub_date, и сливают их heapq.merge: на страницу из
+каждого шарда читается не больше нужного числа строк.
+
+Внешние ключи на пользователя и группу в шардах ведут в пустые таблицы,
+поэтому select_related по ним заменяется prefetch_related_objects из
+основной базы уже после слияния. По той же причине посты и комментарии
+удалённого пользователя удаляет из шардов сигнал, а не каскад; так же
+снимается удалённая группа с постов шардов и удаляются задания миниатюр
+удалённого поста из основной базы. Перенос существующих постов в шарды
+и изменение числа шардов сюда не входят.
+"""
+import heapq
+import zlib
+from collections import Counter
+from itertools import chain, islice
+from operator import attrgetter
+
+from core import routers
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import (Count, F, Max, Min, Sum,
+                              prefetch_related_objects)
+from django.db.models.query import ModelIterable
+
+from .models import Comment, Post, ShardSequence, User
+
+SHARDED_MODELS = (Post, Comment)
+
+
+def shards():
+    return getattr(settings, 'POST_SHARDS', [])
+
+
+def enabled():
+    return bool(shards())
+
+
+def author_index(author_id):
+    return zlib.crc32(str(author_id).encode()) % len(shards())
+
+
+def post_index(post_id):
+    return post_id % len(shards())
+
+
+def for_author(author_id):
+    """Шард постов автора."""
+    return shards()[author_index(author_id)]
+
+
+def for_post(post_id):
+    """Шард поста и его комментариев."""
+    return shards()[post_index(post_id)]
+
+
+def databases(model):
+    """Базы, в которых лежат строки модели."""
+    if enabled() and model in SHARDED_MODELS:
+        return list(shards())
+    return [DEFAULT_DB_ALIAS]
+
+
+def _index(obj):
+    if isinstance(obj, Post):
+        return author_index(obj.author_id)
+    # комментарий без поста некуда отнести: пусть живёт в первом шарде
+    return post_index(obj.post_id) if obj.post_id is not None else 0
+
+
+def database_for(obj):
+    """База, в которую пишется пост или комментарий."""
+    if not enabled():
+        return DEFAULT_DB_ALIAS
+    return shards()[_index(obj)]
+
+
+def allocate(count):
+    """Резервирует count номеров; возвращает range."""
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        sequence = ShardSequence.objects.filter(pk=1)
+        if not sequence.update(last=F('last') + count):
+            ShardSequence.objects.get_or_create(pk=1)
+            sequence.update(last=F('last') + count)
+        last = sequence.values_list('last', flat=True).get()
+    return range(last - count + 1, last + 1)
+
+
+def assign_ids(objects):
+    """Проставляет глобальные id новым постам или комментариям."""
+    new = [obj for obj in objects if obj.pk is None]
+    if not enabled() or not new:
+        return
+    total = len(shards())
+    for obj, number in zip(new, allocate(len(new))):
+        obj.pk = number * total + _index(obj)
+
+
+def _shard_of(model, instance):
+    """Шард строки model, связанной с instance, или None."""
+    if isinstance(instance, Post) and instance.author_id is not None:
+        return for_author(instance.author_id)
+    if model is Post and isinstance(instance, User):
+        return for_author(instance.pk)
+    post_id = getattr(instance, 'post_id', None)
+    if post_id is not None:
+        return for_post(post_id)
+    return None
+
+
+def _on_shard(instance):
+    return getattr(getattr(instance, '_state', None), 'db', None) in shards()
+
+
+class ShardRouter:
+    """Посты и комментарии — в шард автора, остальное — мимо шардов.
+
+    Стоит перед ReplicaRouter. Связанные с шардом объекты других
+    моделей (автор поста, группа) читаются с основной базы или реплики.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not enabled():
+            return None
+        instance = hints.get('instance')
+        if model in SHARDED_MODELS:
+            return _shard_of(model, instance)
+        if _on_shard(instance):
+            return routers.current_replica() or DEFAULT_DB_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        if not enabled():
+            return None
+        instance = hints.get('instance')
+        if model in SHARDED_MODELS:
+            alias = _shard_of(model, instance)
+        elif _on_shard(instance):
+            alias = DEFAULT_DB_ALIAS
+        else:
+            return None
+        if alias is not None:
+            routers.record_write()
+        return alias
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if not enabled():
+            return None
+        databases = {obj1._state.db, obj2._state.db}
+        if databases & set(shards()) and databases <= {
+                DEFAULT_DB_ALIAS, *routers.replicas(), *shards()}:
+            return True
+        return None
+
+
+def _select_paths(select_related, prefix=''):
+    if not isinstance(select_related, dict):
+        return []
+    paths = []
+    for name, nested in select_related.items():
+        paths.append(prefix + name)
+        paths.extend(_select_paths(nested, f'{prefix}{name}__'))
+    return paths
+
+
+def _ordering(queryset):
+    if queryset.query.order_by:
+        return tuple(queryset.query.order_by)
+    if queryset.query.default_ordering:
+        return tuple(queryset.model._meta.ordering)
+    return ()
+
+
+COMBINE = {
+    Count: sum,
+    Sum: lambda values: sum(value or 0 for value in values),
+    Max: lambda values: max(
+        (value for value in values if value is not None), default=None),
+    Min: lambda values: min(
+        (value for value in values if value is not None), default=None),
+}
+
+
+class ShardedQuerySet:
+    """Один запрос к нескольким шардам.
+
+    Цепочечные методы применяются к запросу каждого шарда; строки
+    сливаются по порядку сортировки, если это объекты модели, и
+    идут подряд по шардам, если это values(). select_related
+    превращается в prefetch_related_objects после слияния.
+    """
+
+    CHAINABLE = (
+        'filter', 'exclude', 'annotate', 'order_by', 'distinct', 'values',
+        'values_list', 'only', 'defer', 'none',
+    )
+
+    def __init__(self, model, querysets, related=()):
+        self.model = model
+        self.related = list(related)
+        self.querysets = []
+        for queryset in querysets:
+            select_related = queryset.query.select_related
+            if select_related is True:
+                self.related += [
+                    field.name for field in model._meta.concrete_fields
+                    if field.is_relation and not field.null]
+            else:
+                self.related += _select_paths(select_related)
+            if select_related:
+                queryset = queryset.select_related(None)
+            self.querysets.append(queryset)
+        self.related = list(dict.fromkeys(self.related))
+
+    def __repr__(self):
+        return (f'<ShardedQuerySet {self.model.__name__} '
+                f'in {len(self.querysets)} shards>')
+
+    def __getattr__(self, name):
+        if name not in self.CHAINABLE:
+            raise AttributeError(name)
+
+        def chained(*args, **kwargs):
+            return self._clone([
+                getattr(queryset, name)(*args, **kwargs)
+                for queryset in self.querysets
+            ])
+        return chained
+
+    def _clone(self, querysets, related=None):
+        return ShardedQuerySet(
+            self.model, querysets,
+            self.related if related is None else related)
+
+    def select_related(self, *fields):
+        if fields == (None,):
+            return self._clone(self.querysets, related=[])
+        return self._clone(self.querysets, related=self.related + list(
+            fields))
+
+    def all(self):
+        return self._clone(self.querysets)
+
+    @property
+    def ordered(self):
+        return all(queryset.ordered for queryset in self.querysets)
+
+    def _merges(self):
+        return len(self.querysets) > 1 and all(
+            queryset._iterable_class is ModelIterable
+            for queryset in self.querysets)
+
+    def _stream(self, stop=None, chunk_size=2000):
+        querysets = self.querysets
+        if stop is not None:
+            querysets = [queryset[:stop] for queryset in querysets]
+        streams = [queryset.iterator(chunk_size) for queryset in querysets]
+        ordering = _ordering(self.querysets[0]) if self.querysets else ()
+        if not self._merges() or not ordering:
+            return chain.from_iterable(streams)
+        descending = {name.startswith('-') for name in ordering}
+        if len(descending) > 1:
+            raise ValueError(
+                'Шарды сливаются только при сортировке в одну сторону.')
+        key = attrgetter(*(name.lstrip('-') for name in ordering))
+        return heapq.merge(*streams, key=key, reverse=descending.pop())
+
+    def _rows(self, start=0, stop=None):
+        rows = list(islice(self._stream(stop), start, stop))
+        if self.related and rows and isinstance(rows[0], self.model):
+            prefetch_related_objects(rows, *self.related)
+        return rows
+
+    def __iter__(self):
+        return iter(self._rows())
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            if key.step is not None:
+                raise ValueError('Шаг среза не поддерживается.')
+            return self._rows(key.start or 0, key.stop)
+        rows = self._rows(key, key + 1)
+        if not rows:
+            raise IndexError(key)
+        return rows[0]
+
+    def iterator(self, chunk_size=2000):
+        return self._stream(chunk_size=chunk_size)
+
+    def count(self):
+        return sum(queryset.count() for queryset in self.querysets)
+
+    def exists(self):
+        return any(queryset.exists() for queryset in self.querysets)
+
+    def update(self, **kwargs):
+        return sum(queryset.update(**kwargs) for queryset in self.querysets)
+
+    def delete(self):
+        total = 0
+        deleted = Counter()
+        for queryset in self.querysets:
+            count, per_model = queryset.delete()
+            total += count
+            deleted.update(per_model)
+        return total, dict(deleted)
+
+    def aggregate(self, *args, **kwargs):
+        for expression in args:
+            kwargs[expression.default_alias] = expression
+        for name, expression in kwargs.items():
+            if type(expression) not in COMBINE:
+                raise ValueError(
+                    f'{name}: агрегат нельзя сложить по шардам.')
+        results = [
+            queryset.aggregate(**kwargs) for queryset in self.querysets]
+        return {
+            name: COMBINE[type(expression)](
+                result[name] for result in results)
+            for name, expression in kwargs.items()
+        }
+
+    def first(self):
+        feed = self if self.ordered else self.order_by('pk')
+        rows = feed[:1]
+        return rows[0] if rows else None
+
+    def get(self, *args, **kwargs):
+        rows = self.filter(*args, **kwargs)[:2]
+        if not rows:
+            raise self.model.DoesNotExist(
+                f'{self.model._meta.object_name} matching query does not '
+                f'exist.')
+        if len(rows) > 1:
+            raise self.model.MultipleObjectsReturned(
+                f'get() returned more than one {self.model._meta.object_name}')
+        return rows[0]
+
+    def in_bulk(self, id_list):
+        found = {}
+        for queryset in self.querysets:
+            found.update(queryset.in_bulk(id_list))
+        if self.related and found:
+            prefetch_related_objects(list(found.values()), *self.related)
+        return found
+
+
+def _sharded(queryset, aliases):
+    return ShardedQuerySet(
+        queryset.model, [queryset.using(alias) for alias in aliases])
+
+
+def scatter(queryset):
+    """Запрос ко всем шардам модели; без шардирования — он же."""
+    if not enabled() or queryset.model not in SHARDED_MODELS:
+        return queryset
+    return _sharded(queryset, shards())
+
+
+def on_author_shard(queryset, author_id):
+    """Запрос только к шарду автора."""
+    if not enabled():
+        return queryset
+    return _sharded(queryset, [for_author(author_id)])
+
+
+def on_post_shard(queryset, post_id):
+    """Запрос только к шарду поста."""
+    if not enabled():
+        return queryset
+    return _sharded(queryset, [for_post(int(post_id))])
+
+
+def by_authors(queryset, author_ids):
+    """Посты авторов: по запросу на каждый шард, где они есть."""
+    groups = {}
+    for author_id in author_ids:
+        groups.setdefault(for_author(author_id), []).append(author_id)
+    return ShardedQuerySet(queryset.model, [
+        queryset.using(alias).filter(author_id__in=ids)
+        for alias, ids in groups.items()
+    ])
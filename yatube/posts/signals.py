@@ -0,0 +1,207 @@
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import (caching, group_feed, media, metrics, search, sharding,
+               stats, thumbnails, timeline)
+from .models import Comment, Follow, Group, Post, ThumbnailJob, User
+
+
+@receiver(pre_save, sender=Post)
+@receiver(pre_save, sender=Comment)
+def assign_shard_id(sender, instance, raw=False, **kwargs):
+    if not raw:
+        sharding.assign_ids([instance])
+
+
+@receiver(post_delete, sender=User)
+def delete_sharded_rows(sender, instance, **kwargs):
+    # каскад основной базы не видит строк в шардах
+    if sharding.enabled():
+        sharding.scatter(Post.objects.filter(author_id=instance.pk)).delete()
+        sharding.scatter(
+            Comment.objects.filter(author_id=instance.pk)).delete()
+
+
+@receiver(post_delete, sender=Group)
+def clear_sharded_group(sender, instance, **kwargs):
+    # SET_NULL обновляет посты только в основной базе
+    if sharding.enabled():
+        sharding.scatter(
+            Post.objects.filter(group_id=instance.pk)).update(group=None)
+
+
+@receiver(post_delete, sender=Post)
+def delete_thumbnail_jobs(sender, instance, **kwargs):
+    # задания лежат в основной базе, а каскад поста идёт в его шарде
+    if sharding.enabled():
+        ThumbnailJob.objects.using(DEFAULT_DB_ALIAS).filter(
+            post_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=Post)
+def count_new_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        stats.bump(instance.author_id, 'posts_count', 1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    stats.bump(instance.author_id, 'posts_count', -1)
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        stats.bump(instance.author_id, 'comments_count', 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    stats.bump(instance.author_id, 'comments_count', -1)
+
+
+@receiver(post_save, sender=Follow)
+def count_new_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        stats.bump(instance.author_id, 'followers_count', 1)
+        stats.bump(instance.user_id, 'following_count', 1)
+
+
+@receiver(post_delete, sender=Follow)
+def count_deleted_follow(sender, instance, **kwargs):
+    stats.bump(instance.author_id, 'followers_count', -1)
+    stats.bump(instance.user_id, 'following_count', -1)
+
+
+@receiver(post_save, sender=Post)
+def fan_out_new_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        timeline.fan_out_post(instance)
+
+
+@receiver(post_save, sender=Follow)
+def record_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        metrics.FOLLOWS.inc(action='create')
+
+
+@receiver(post_delete, sender=Follow)
+def record_unfollow(sender, instance, **kwargs):
+    metrics.FOLLOWS.inc(action='delete')
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        timeline.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def prune_timeline(sender, instance, **kwargs):
+    timeline.prune(instance.user_id, instance.author_id)
+    if stats.followers_count(instance.author_id) == (
+            timeline.fanout_limit()):
+        timeline.fan_out_author(instance.author_id)
+
+
+@receiver(post_save, sender=Post)
+def bump_post_card(sender, instance, **kwargs):
+    caching.bump_card_version('post', instance.pk)
+    caching.bump_feed_generation()
+
+
+@receiver(post_delete, sender=Post)
+def bump_feed_on_delete(sender, instance, **kwargs):
+    caching.bump_feed_generation()
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def bump_follow_versions(sender, instance, **kwargs):
+    caching.bump_follow_version(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Group)
+def bump_group_cards(sender, instance, **kwargs):
+    caching.bump_card_version('group', instance.pk)
+    caching.bump_feed_generation()
+
+
+@receiver(post_delete, sender=Group)
+def drop_group_feed(sender, instance, **kwargs):
+    caching.bump_card_version('group', instance.pk)
+    group_feed.drop(instance.pk)
+    # посты группы теряют её одним UPDATE (SET_NULL), без сигналов
+    caching.bump_feed_generation()
+
+
+@receiver(post_save, sender=Post)
+def update_group_feed(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        group_feed.post_saved(instance, created)
+
+
+@receiver(post_delete, sender=Post)
+def remove_from_group_feed(sender, instance, **kwargs):
+    group_feed.post_deleted(instance)
+
+
+@receiver(post_save, sender=User)
+def bump_author_cards(sender, instance, update_fields=None, **kwargs):
+    # вход в систему сохраняет только last_login: карточки не меняются
+    if update_fields is None or 'username' in update_fields:
+        caching.bump_card_version('author', instance.pk)
+        caching.bump_feed_generation()
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search.unindex(search.POST, instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def index_comment(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_comment(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def unindex_comment(sender, instance, **kwargs):
+    search.unindex(search.COMMENT, instance.pk)
+
+
+@receiver(pre_save, sender=Post)
+def reset_thumbnails(sender, instance, raw=False, update_fields=None,
+                     **kwargs):
+    touched = update_fields is None or 'image' in update_fields
+    instance._thumbnails_stale = (
+        not raw and touched and thumbnails.image_changed(instance))
+    if instance._thumbnails_stale:
+        thumbnails.reset(instance)
+
+
+@receiver(post_save, sender=Post)
+def queue_thumbnails(sender, instance, **kwargs):
+    if getattr(instance, '_thumbnails_stale', False):
+        instance._thumbnails_stale = False
+        thumbnails.enqueue(instance)
+
+
+@receiver(post_save, sender=Post)
+def release_replaced_image(sender, instance, raw=False, **kwargs):
+    previous = getattr(instance, '_stored_image', None)
+    if not raw and previous and previous != instance.image.name:
+        media.release(previous)
+    instance._stored_image = instance.image.name
+
+
+@receiver(post_delete, sender=Post)
+def release_deleted_image(sender, instance, **kwargs):
+    media.release(instance.image.name)
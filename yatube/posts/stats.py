@@ -0,0 +1,84 @@
+"""Денормализованные счётчики автора.
+
+Сигналы меняют счётчики выражениями F() при создании и удалении постов,
+подписок и комментариев. Строка AuthorStats создаётся лениво: при первом
+обращении счётчики считаются по базе.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+
+from . import sharding
+from .models import AuthorStats, Comment, Follow, Post
+
+COUNTERS = {
+    'posts_count': (Post, 'author_id'),
+    'followers_count': (Follow, 'author_id'),
+    'following_count': (Follow, 'user_id'),
+    'comments_count': (Comment, 'author_id'),
+}
+
+
+def actual(author_id):
+    """Значения счётчиков, посчитанные по базе."""
+    return {
+        counter: sharding.scatter(
+            model.objects.filter(**{column: author_id})).count()
+        for counter, (model, column) in COUNTERS.items()
+    }
+
+
+def actual_all():
+    """Значения счётчиков всех авторов: {counter: {author_id: n}}."""
+    result = {}
+    for counter, (model, column) in COUNTERS.items():
+        totals = Counter()
+        for database in sharding.databases(model):
+            totals.update(dict(
+                model.objects.using(database).order_by().values(column)
+                .annotate(total=Count('pk')).values_list(column, 'total')))
+        result[counter] = dict(totals)
+    return result
+
+
+def _create(author_id):
+    try:
+        with transaction.atomic():
+            return AuthorStats.objects.create(
+                author_id=author_id, **actual(author_id))
+    except IntegrityError:
+        return AuthorStats.objects.get(author_id=author_id)
+
+
+def get_stats(author):
+    """Счётчики автора; при отсутствии строки она создаётся."""
+    try:
+        return AuthorStats.objects.get(author=author)
+    except AuthorStats.DoesNotExist:
+        return _create(author.pk)
+
+
+def bump(author_id, counter, delta):
+    """Меняет счётчик на delta, не перечитывая значение.
+
+    Разъехавшийся с базой счётчик не уходит ниже нуля: поле
+    беззнаковое, и UPDATE упал бы с IntegrityError.
+    """
+    updated = AuthorStats.objects.filter(author_id=author_id).update(
+        **{counter: Greatest(F(counter) + delta, 0)})
+    if not updated and delta > 0:
+        # строки ещё нет: пересчёт уже учтёт только что записанный объект
+        _create(author_id)
+
+
+def followers_count(author_id):
+    """Число подписчиков без создания строки: функцию зовут и при
+    каскадном удалении автора.
+    """
+    stats = AuthorStats.objects.filter(
+        author_id=author_id).values_list('followers_count', flat=True)
+    for count in stats:
+        return count
+    return Follow.objects.filter(author_id=author_id).count()
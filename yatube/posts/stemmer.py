@@ -0,0 +1,125 @@
+"""Стеммер Портера (Snowball) для русского языка.
+
+Используется поисковым индексом: и тексты, и запросы приводятся к основам,
+поэтому «котами» находит пост про «кота». Слова без кириллицы
+возвращаются в нижнем регистре без изменений.
+"""
+import re
+from functools import lru_cache
+
+# словарь живых текстов невелик: одни и те же слова стеммятся снова
+STEM_CACHE_SIZE = 65536
+
+VOWELS = 'аеиоуыэюя'
+AFTER_A = ('а', 'я')
+
+GERUND_AFTER_A = ('в', 'вши', 'вшись')
+GERUND = ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись')
+ADJECTIVE = (
+    'ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем',
+    'им', 'ым', 'ом', 'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю',
+    'ая', 'яя', 'ою', 'ею',
+)
+PARTICIPLE_AFTER_A = ('ем', 'нн', 'вш', 'ющ', 'щ')
+PARTICIPLE = ('ивш', 'ывш', 'ующ')
+REFLEXIVE = ('ся', 'сь')
+VERB_AFTER_A = (
+    'ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет',
+    'ют', 'ны', 'ть', 'ешь', 'нно',
+)
+VERB = (
+    'ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй',
+    'ил', 'ыл', 'им', 'ым', 'ен', 'ило', 'ыло', 'ено', 'ят', 'ует', 'уют',
+    'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю',
+)
+NOUN = (
+    'а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и',
+    'ией', 'ей', 'ой', 'ий', 'й', 'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о',
+    'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю', 'ия', 'ья', 'я',
+)
+SUPERLATIVE = ('ейш', 'ейше')
+DERIVATIONAL = ('ост', 'ость')
+
+WORD_RE = re.compile(r'\w+')
+CYRILLIC_RE = re.compile('[а-я]')
+
+
+def _regions(word):
+    """Начала областей RV и R2 по правилам Snowball."""
+    rv = r1 = r2 = len(word)
+    for position, letter in enumerate(word):
+        if letter in VOWELS:
+            rv = position + 1
+            break
+    for position in range(1, len(word)):
+        if word[position] not in VOWELS and word[position - 1] in VOWELS:
+            r1 = position + 1
+            break
+    for position in range(r1 + 1, len(word)):
+        if word[position] not in VOWELS and word[position - 1] in VOWELS:
+            r2 = position + 1
+            break
+    return rv, r2
+
+
+def _strip(word, start, endings, endings_after_a=()):
+    """Отрезает самое длинное окончание, лежащее в word[start:].
+
+    Окончания из endings_after_a отрезаются, только если перед ними
+    стоит «а» или «я» (сама буква остаётся).
+    """
+    region = word[start:]
+    candidates = sorted(endings + endings_after_a, key=len, reverse=True)
+    for ending in candidates:
+        if not region.endswith(ending):
+            continue
+        if ending in endings_after_a and (
+                region[:-len(ending)][-1:] not in AFTER_A):
+            continue
+        return word[:-len(ending)]
+    return None
+
+
+def _strip_inflection(word, rv):
+    """Шаг 1: деепричастие, иначе возвратная частица и часть речи."""
+    result = _strip(word, rv, GERUND, GERUND_AFTER_A)
+    if result is not None:
+        return result
+    word = _strip(word, rv, REFLEXIVE) or word
+    result = _strip(word, rv, ADJECTIVE)
+    if result is not None:
+        return _strip(result, rv, PARTICIPLE, PARTICIPLE_AFTER_A) or result
+    result = _strip(word, rv, VERB, VERB_AFTER_A)
+    if result is not None:
+        return result
+    return _strip(word, rv, NOUN) or word
+
+
+def _strip_superlative(word, rv):
+    """Шаг 4: «нн», превосходная степень или мягкий знак."""
+    if word[rv:].endswith('нн'):
+        return word[:-1]
+    result = _strip(word, rv, SUPERLATIVE)
+    if result is not None:
+        return result[:-1] if result[rv:].endswith('нн') else result
+    if word[rv:].endswith('ь'):
+        return word[:-1]
+    return word
+
+
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    if not CYRILLIC_RE.search(word):
+        return word
+    rv, r2 = _regions(word)
+    word = _strip_inflection(word, rv)
+    if word[rv:].endswith('и'):
+        word = word[:-1]
+    word = _strip(word, r2, DERIVATIONAL) or word
+    return _strip_superlative(word, rv)
+
+
+def tokenize(text):
+    """Основы слов текста в порядке появления."""
+    return [stem(word) for word in WORD_RE.findall(text or '')]
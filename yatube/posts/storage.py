@@ -0,0 +1,40 @@
+"""Хранилище картинок постов с адресацией по содержимому.
+
+Имя файла — SHA-256 его содержимого, поэтому повторная загрузка той же
+картинки не пишет новый файл и получает готовые миниатюры: ключи sorl
+строятся по имени исходника. Когда на файл больше не ссылается ни один
+пост, его удаляет posts.media.
+"""
+import hashlib
+import os
+
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Сохраняет файл как <каталог>/<2 символа хеша>/<хеш>.<расширение>."""
+
+    def hashed_name(self, name, content):
+        sha = hashlib.sha256()
+        for chunk in content.chunks():
+            sha.update(chunk)
+        digest = sha.hexdigest()
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(directory, digest[:2], digest + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            # свежая дата изменения защищает файл от уборки, пока
+            # транзакция нового поста ещё не закоммичена
+            os.utime(self.path(name))
+            return name
+        return super().save(name, content, max_length)
@@ -0,0 +1,51 @@
+from django import template
+from django.core.cache.utils import make_template_fragment_key
+
+from posts import caching
+
+register = template.Library()
+
+
+class FeedCacheNode(template.Node):
+    def __init__(self, nodelist, timeout, fragment_name, vary_on):
+        self.nodelist = nodelist
+        self.timeout = timeout
+        self.fragment_name = fragment_name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        try:
+            timeout = int(self.timeout.resolve(context))
+        except (ValueError, TypeError):
+            raise template.TemplateSyntaxError(
+                f'"feed_cache" tag got a non-integer timeout value: '
+                f'{self.timeout.var!r}')
+        generation = caching.feed_generation()
+        vary_on = [generation, caching.replica_scope(generation)] + [
+            var.resolve(context) for var in self.vary_on]
+        key = make_template_fragment_key(self.fragment_name, vary_on)
+        return caching.get_or_render(
+            key, timeout, lambda: self.nodelist.render(context))
+
+
+@register.tag('feed_cache')
+def do_feed_cache(parser, token):
+    """Как {% cache %}, но ключ включает поколение ленты, а пересборку
+    истёкшего фрагмента выполняет только один воркер.
+
+        {% feed_cache 21600 index_page request.GET.urlencode %}
+            ...
+        {% endfeed_cache %}
+    """
+    nodelist = parser.parse(('endfeed_cache',))
+    parser.delete_first_token()
+    tokens = token.split_contents()
+    if len(tokens) < 3:
+        raise template.TemplateSyntaxError(
+            f"'{tokens[0]}' tag requires at least 2 arguments.")
+    return FeedCacheNode(
+        nodelist,
+        parser.compile_filter(tokens[1]),
+        tokens[2],
+        [parser.compile_filter(token) for token in tokens[3:]],
+    )
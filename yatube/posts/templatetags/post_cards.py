@@ -0,0 +1,16 @@
+from django import template
+
+from posts import thumbnails
+from posts.caching import card_version
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_card_version(post):
+    return card_version(post)
+
+
+@register.inclusion_tag('posts/includes/picture.html')
+def post_picture(post):
+    return thumbnails.picture(post)
@@ -1,13 +1,17 @@
+import hashlib
 import shutil
 import tempfile
 from http import HTTPStatus
+from io import BytesIO, StringIO
 
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 from posts.forms import PostForm
 from posts.models import Comment, Group, Post, User
+from PIL import Image
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
@@ -71,10 +75,11 @@ class PostFormTests(TestCase):
         self.assertRedirects(response, reverse(
             'posts:profile',
             kwargs={'username': self.user.username}))
+        digest = hashlib.sha256(small_gif).hexdigest()
         self.assertTrue(Post.objects.filter(
             text='Новый пост 2',
             group__slug='test-slug',
-            image='posts/small.gif').exists()
+            image=f'posts/{digest[:2]}/{digest}.gif').exists()
         )
 
     def test_edit_form(self):
@@ -118,3 +123,101 @@ class PostFormTests(TestCase):
         self.assertRedirects(response, reverse(
             'posts:post_detail',
             kwargs={'post_id': post_id}))
+
+
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT,
+    POST_IMAGE_MAX_SIDE=16,
+    POST_IMAGE_MAX_PIXELS=2000,
+)
+class ImageUploadTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Фотограф')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.author_client = Client()
+        self.author_client.force_login(ImageUploadTests.user)
+
+    @staticmethod
+    def photo(name, size, image_format='JPEG', orientation=None):
+        exif = Image.Exif()
+        exif[0x010F] = 'Phone'
+        if orientation:
+            exif[0x0112] = orientation
+        buffer = BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, image_format, exif=exif)
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def upload(self, image):
+        return self.author_client.post(reverse('posts:post_create'), {
+            'text': 'Пост с фотографией',
+            'image': image,
+        })
+
+    def stored(self):
+        post = Post.objects.get(text='Пост с фотографией')
+        return Image.open(post.image.path)
+
+    def test_large_photo_is_downscaled_rotated_and_stripped(self):
+        """Большая фотография ужимается, поворачивается и теряет EXIF."""
+        self.upload(self.photo('phone.jpeg', (40, 20), orientation=6))
+        image = self.stored()
+        self.assertEqual(image.size, (8, 16))
+        self.assertEqual(image.format, 'JPEG')
+        self.assertFalse(image.getexif())
+        self.assertTrue(image.filename.endswith('.jpg'))
+
+    def test_metadata_is_stripped_from_small_png(self):
+        """Метаданные удаляются и у картинки, не превышающей предел."""
+        self.upload(self.photo('small.png', (10, 10), 'PNG'))
+        image = self.stored()
+        self.assertEqual(image.size, (10, 10))
+        self.assertFalse(image.getexif())
+
+    def test_clean_image_is_stored_untouched(self):
+        """Картинка без метаданных в пределах нормы сохраняется как есть."""
+        buffer = BytesIO()
+        Image.new('RGB', (10, 10), 'blue').save(buffer, 'PNG')
+        self.upload(SimpleUploadedFile('clean.png', buffer.getvalue()))
+        post = Post.objects.get(text='Пост с фотографией')
+        with post.image.open('rb') as stored:
+            self.assertEqual(stored.read(), buffer.getvalue())
+
+    def test_decompression_bomb_is_rejected(self):
+        """Картинка больше POST_IMAGE_MAX_PIXELS отклоняется формой."""
+        response = self.upload(self.photo('bomb.png', (50, 50), 'PNG'))
+        self.assertFalse(
+            Post.objects.filter(text='Пост с фотографией').exists())
+        self.assertFormError(
+            response, 'form', 'image',
+            'Картинка слишком большая: 2500 пикселей при пределе 2000.')
+
+    def test_model_save_normalizes_direct_uploads(self):
+        """Post.save нормализует картинку, загруженную мимо формы."""
+        post = Post.objects.create(
+            text='Пост с фотографией',
+            author=ImageUploadTests.user,
+            image=self.photo('admin.jpg', (32, 32)),
+        )
+        image = Image.open(post.image.path)
+        self.assertEqual(image.size, (16, 16))
+        self.assertFalse(image.getexif())
+
+
+class UploadBenchmarkTests(TestCase):
+    def test_benchmark_reports_both_pipelines(self):
+        """Бенчмарк сравнивает память до и после нормализации."""
+        out = StringIO()
+        call_command(
+            'benchmark_uploads', '--megapixels', '0.05', '--runs', '1',
+            stdout=out)
+        output = out.getvalue()
+        self.assertIn('до: пик RSS', output)
+        self.assertIn('после: пик RSS', output)
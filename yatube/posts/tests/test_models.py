@@ -1,9 +1,30 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from PIL import Image
 
-from ..models import Group, Post
+from .. import seeding, thumbnails
+from ..management.commands import benchmark_views
+from ..models import (AuthorStats, Comment, Follow, Group, Post,
+                      TimelineEntry)
 
 User = get_user_model()
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
 
 class PostModelTest(TestCase):
@@ -55,3 +76,286 @@ class PostModelTest(TestCase):
             with self.subTest(field=field):
                 self.assertEqual(
                     post._meta.get_field(field).help_text, expected_value)
+
+
+class AuthorStatsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+
+    def stats(self, user):
+        return AuthorStats.objects.get(author=user)
+
+    def test_counters_follow_writes(self):
+        """Счётчики меняются при создании и удалении объектов."""
+        author = AuthorStatsTest.author
+        reader = AuthorStatsTest.reader
+        post = Post.objects.create(author=author, text='Пост')
+        Post.objects.create(author=author, text='Ещё пост')
+        Comment.objects.create(author=reader, post=post, text='Коммент')
+        Follow.objects.create(user=reader, author=author)
+        author_stats = self.stats(author)
+        reader_stats = self.stats(reader)
+        self.assertEqual(author_stats.posts_count, 2)
+        self.assertEqual(author_stats.followers_count, 1)
+        self.assertEqual(reader_stats.following_count, 1)
+        self.assertEqual(reader_stats.comments_count, 1)
+        post.delete()
+        Follow.objects.all().delete()
+        author_stats = self.stats(author)
+        reader_stats = self.stats(reader)
+        self.assertEqual(author_stats.posts_count, 1)
+        self.assertEqual(author_stats.followers_count, 0)
+        self.assertEqual(reader_stats.following_count, 0)
+        self.assertEqual(reader_stats.comments_count, 0)
+
+    def test_drifted_counter_stops_at_zero(self):
+        """Удаление при счётчике, уже равном нулю, не роняет запись."""
+        Follow.objects.create(
+            user=AuthorStatsTest.reader, author=AuthorStatsTest.author)
+        AuthorStats.objects.filter(author=AuthorStatsTest.author).update(
+            followers_count=0)
+        Follow.objects.get(author=AuthorStatsTest.author).delete()
+        self.assertEqual(self.stats(AuthorStatsTest.author).followers_count, 0)
+        self.assertEqual(self.stats(AuthorStatsTest.reader).following_count, 0)
+
+    def test_recount_command_reports_and_fixes_drift(self):
+        """recount_author_stats находит и исправляет расхождения."""
+        Post.objects.create(author=AuthorStatsTest.author, text='Пост')
+        AuthorStats.objects.filter(author=AuthorStatsTest.author).update(
+            posts_count=5)
+        out = StringIO()
+        call_command('recount_author_stats', '--dry-run', stdout=out)
+        self.assertIn('author: posts_count 5 -> 1', out.getvalue())
+        self.assertEqual(self.stats(AuthorStatsTest.author).posts_count, 5)
+        call_command('recount_author_stats', stdout=StringIO())
+        self.assertEqual(self.stats(AuthorStatsTest.author).posts_count, 1)
+        self.assertEqual(self.stats(AuthorStatsTest.reader).posts_count, 0)
+
+
+class FeedIndexesTest(TestCase):
+    """Планировщик SQLite использует индексы лент, а не сортирует."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(author=cls.user, text='Пост')
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_feed_queries_use_composite_indexes(self):
+        """Ленты автора, группы и главная читаются по индексу."""
+        cursor = {'pub_date__lt': FeedIndexesTest.post.pub_date}
+        plans = {
+            'post_date_id_idx': Post.objects.filter(**cursor),
+            'post_author_date_idx': Post.objects.filter(
+                author=FeedIndexesTest.user, **cursor),
+            'post_group_date_idx': Post.objects.filter(
+                group=FeedIndexesTest.group, **cursor),
+            'comment_post_date_idx': Comment.objects.filter(
+                post=FeedIndexesTest.post).order_by('pub_date', 'id'),
+        }
+        for index, queryset in plans.items():
+            with self.subTest(index=index):
+                self.assertUsesIndex(queryset[:10], index)
+
+    def test_follow_lookup_uses_unique_index(self):
+        """Проверка подписки ищет по уникальному индексу (user, author)."""
+        plan = Follow.objects.filter(
+            user=FeedIndexesTest.user, author=FeedIndexesTest.user
+        ).explain()
+        self.assertIn('INDEX', plan)
+        self.assertIn('user_id=? AND author_id=?', plan)
+
+    def test_follow_is_unique(self):
+        """Повторная подписка на автора невозможна."""
+        Follow.objects.create(
+            user=FeedIndexesTest.user, author=FeedIndexesTest.user)
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Follow.objects.create(
+                    user=FeedIndexesTest.user, author=FeedIndexesTest.user)
+
+
+# без пула потоков: миниатюры не строятся в уже удалённом MEDIA_ROOT
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, POST_IMAGE_ORPHAN_GRACE=0,
+                   THUMBNAIL_WORKERS=0)
+class ContentAddressedImageTest(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='Фотограф')
+
+    def tearDown(self):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    @staticmethod
+    def image(name, color='red'):
+        buffer = BytesIO()
+        Image.new('RGB', (4, 4), color).save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def create_post(self, image):
+        return Post.objects.create(author=self.user, text='Пост', image=image)
+
+    def test_duplicate_uploads_share_one_file(self):
+        """Одинаковые картинки хранятся одним файлом с именем по хешу."""
+        first = self.create_post(self.image('first.png'))
+        second = self.create_post(self.image('second.png'))
+        self.assertEqual(first.image.name, second.image.name)
+        digest = hashlib.sha256(
+            self.image('any.png').read()).hexdigest()
+        self.assertEqual(
+            first.image.name, f'posts/{digest[:2]}/{digest}.png')
+        self.assertEqual(os.listdir(os.path.dirname(first.image.path)),
+                         [os.path.basename(first.image.path)])
+
+    def test_file_is_removed_with_its_last_post(self):
+        """Файл и миниатюры живут, пока на них ссылается хоть один пост."""
+        first = self.create_post(self.image('first.png'))
+        second = self.create_post(self.image('second.png'))
+        path = first.image.path
+        built = thumbnails.build(first.image.name)
+        thumbnail_paths = [
+            default_storage.path(name)
+            for files in built.values() for name, _, _ in files
+        ]
+        first.delete()
+        self.assertTrue(os.path.exists(path))
+        second.delete()
+        self.assertFalse(os.path.exists(path))
+        for thumbnail_path in thumbnail_paths:
+            self.assertFalse(os.path.exists(thumbnail_path))
+
+    def test_replaced_image_is_released(self):
+        """Замена картинки удаляет прежний файл, если он больше не нужен."""
+        post = self.create_post(self.image('old.png'))
+        old_path = post.image.path
+        post = Post.objects.get(pk=post.pk)
+        post.image = self.image('new.png', 'blue')
+        post.save()
+        self.assertFalse(os.path.exists(old_path))
+        self.assertTrue(os.path.exists(post.image.path))
+
+    def test_cascade_delete_releases_images(self):
+        """Удаление автора каскадом удаляет картинки его постов."""
+        path = self.create_post(self.image('cascade.png')).image.path
+        self.user.delete()
+        self.assertFalse(os.path.exists(path))
+
+    @override_settings(POST_IMAGE_ORPHAN_GRACE=3600)
+    def test_recent_orphans_wait_for_collect_command(self):
+        """Недавно тронутый файл остаётся до запуска уборки."""
+        post = self.create_post(self.image('recent.png'))
+        path = post.image.path
+        post.delete()
+        self.assertTrue(os.path.exists(path))
+        hour_ago = time.time() - 3601
+        os.utime(path, (hour_ago, hour_ago))
+        out = StringIO()
+        call_command('collect_orphan_images', stdout=out)
+        self.assertIn('Удалено картинок: 1', out.getvalue())
+        self.assertFalse(os.path.exists(path))
+
+
+class SeedingTest(TestCase):
+    def test_seeded_data_is_consistent(self):
+        """Seeder пишет набор пачками и пересчитывает производные данные."""
+        created = seeding.Seeder(
+            users=20, groups=3, posts=200, comments=100, follows=4,
+            batch_size=50,
+        ).run()
+        self.assertEqual(created['users'], User.objects.count())
+        self.assertEqual(created['posts'], Post.objects.count())
+        self.assertEqual(created['comments'], Comment.objects.count())
+        self.assertEqual(created['follows'], Follow.objects.count())
+        self.assertFalse(Follow.objects.filter(user=F('author')).exists())
+        dates = list(Post.objects.order_by('id').values_list(
+            'pub_date', flat=True))
+        self.assertEqual(dates, sorted(dates))
+        self.assertGreater(dates[-1] - dates[0], timedelta(days=300))
+        out = StringIO()
+        call_command('recount_author_stats', '--dry-run', stdout=out)
+        self.assertIn('Авторов с расхождениями: 0', out.getvalue())
+        follow = Follow.objects.first()
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=follow.user_id).count(),
+            Post.objects.filter(author__following__user=follow.user_id)
+            .count())
+
+    def snapshot(self):
+        return (
+            list(Post.objects.order_by('id').values_list(
+                'text', 'author__username', 'group__slug', 'pub_date')),
+            list(Follow.objects.order_by('id').values_list(
+                'user__username', 'author__username')),
+            list(Comment.objects.order_by('id').values_list(
+                'text', 'author__username', 'post__text', 'pub_date')),
+        )
+
+    def test_same_seed_gives_same_data_with_any_processes(self):
+        """Данные зависят от seed, но не от числа процессов."""
+        options = dict(
+            users=30, groups=3, posts=120, comments=60, follows=3,
+            until=timezone.now(), seed=7)
+        with mock.patch.object(seeding, 'CHUNK_SIZE', 25):
+            seeding.Seeder(processes=1, **options).run()
+            first = self.snapshot()
+            User.objects.all().delete()
+            Group.objects.all().delete()
+            seeding.Seeder(processes=2, **options).run()
+        self.assertEqual(self.snapshot(), first)
+        User.objects.all().delete()
+        seeding.Seeder(**dict(options, seed=8)).run()
+        self.assertNotEqual(self.snapshot()[0], first[0])
+
+    def test_authors_activity_is_skewed(self):
+        """Десятая часть авторов пишет заметно больше десятой части постов."""
+        seeding.Seeder(users=50, groups=2, posts=1000, comments=0).run()
+        counts = sorted(Post.objects.order_by().values('author').annotate(
+            total=Count('id')).values_list('total', flat=True), reverse=True)
+        self.assertGreater(sum(counts[:5]), 300)
+
+    def test_seed_command(self):
+        """seed_yatube сообщает о каждом этапе и проверяет параметры."""
+        out = StringIO()
+        call_command(
+            'seed_yatube', '--users=10', '--groups=2', '--posts=30',
+            '--comments=20', '--follows=2', '--processes=1', stdout=out)
+        self.assertIn('posts: 30', out.getvalue())
+        self.assertEqual(Post.objects.count(), 30)
+        with self.assertRaises(CommandError):
+            call_command('seed_yatube', '--follow-shape=1')
+        with self.assertRaises(CommandError):
+            call_command('seed_yatube', '--until=вчера')
+
+    @override_settings(POST_SHARDS=['default'])
+    def test_seeding_refuses_shards(self):
+        """bulk_create обошёл бы роутер шардов: генератор отказывается."""
+        for command in ('seed_yatube', 'benchmark_views', 'benchmark_sqlite'):
+            with self.subTest(command=command):
+                with self.assertRaises(CommandError):
+                    call_command(command, stdout=StringIO())
+        with self.assertRaises(ValueError):
+            seeding.Seeder()
+        self.assertFalse(Post.objects.exists())
+
+    def test_percentiles(self):
+        """Квантили замера считаются по ближайшему рангу."""
+        latencies = list(range(100, 0, -1))
+        result = benchmark_views.summarize(latencies, 2, elapsed=2)
+        self.assertEqual(result['p50_ms'], 50)
+        self.assertEqual(result['p95_ms'], 95)
+        self.assertEqual(result['p99_ms'], 99)
+        self.assertEqual(result['max_ms'], 100)
+        self.assertEqual(result['rps'], 50)
+        self.assertEqual(result['errors'], 2)
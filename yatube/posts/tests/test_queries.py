@@ -0,0 +1,146 @@
+from django.contrib.auth.tokens import default_token_generator
+from django.core.cache import cache
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+from posts import timeline
+from posts.models import Comment, Follow, Group, Post, User
+
+from .utils import query_budget
+
+SCALES = (10, 1000, 10000)
+# данные запроса для представлений, которые их читают
+DATA = {
+    'posts:add_comment': {'text': 'Комментарий'},
+    'posts:search': {'q': 'пост'},
+}
+
+
+# выгрузка тратит запрос на пачку: пачка больше таблицы — один запрос
+@override_settings(EXPORT_BATCH_SIZE=2 * SCALES[-1])
+class QueryBudgetTest(TestCase):
+    """Число запросов каждой страницы не зависит от объёма данных."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(
+            username='Автор', email='author@yatube.ru')
+        cls.reader = User.objects.create_user(username='Читатель')
+        cls.staff = User.objects.create_user(
+            username='Сотрудник', is_staff=True)
+        cls.group = Group.objects.create(
+            title='Тестовое название группы',
+            slug='test-slug',
+            description='Тестовое описание'
+        )
+        cls.post = Post.objects.create(
+            text='Пост с комментариями', author=cls.author, group=cls.group)
+        Comment.objects.bulk_create(
+            Comment(post=cls.post, author=author, text='Комментарий')
+            for author in (cls.author, cls.reader) * 10
+        )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        cls.uid = urlsafe_base64_encode(force_bytes(cls.author.pk))
+        cls.token = default_token_generator.make_token(cls.author)
+
+    def setUp(self):
+        self.guest_client = Client()
+        self.author_client = Client()
+        self.author_client.force_login(QueryBudgetTest.author)
+        self.reader_client = Client()
+        self.reader_client.force_login(QueryBudgetTest.reader)
+        self.staff_client = Client()
+        self.staff_client.force_login(QueryBudgetTest.staff)
+
+    def seed(self, total):
+        missing = total - Post.objects.count()
+        Post.objects.bulk_create(
+            (
+                Post(
+                    text=f'Пост {i}',
+                    author=QueryBudgetTest.author,
+                    group=QueryBudgetTest.group if i % 2 else None,
+                )
+                for i in range(missing)
+            ),
+            batch_size=500,
+        )
+        timeline.rebuild(QueryBudgetTest.reader.pk)
+
+    def requests(self):
+        """(имя, клиент, метод, URL, бюджет запросов); данные — в DATA.
+
+        Ленты группы, профиля и страница поста тратят один запрос на
+        агрегат для ETag, главная берёт его из кэша; повторный визит без
+        изменений обходится без рендеринга.
+        """
+        author = QueryBudgetTest.author
+        post_id = QueryBudgetTest.post.pk
+        guest = self.guest_client
+        reader = self.reader_client
+        return (
+            ('posts:index', guest, 'get', reverse('posts:index'), 2),
+            ('posts:index', reader, 'get', reverse('posts:index'), 4),
+            ('posts:group_list', guest, 'get',
+             reverse('posts:group_list', args=[QueryBudgetTest.group.slug]),
+             4),
+            ('posts:profile', guest, 'get',
+             reverse('posts:profile', args=[author.username]), 5),
+            ('posts:post_detail', guest, 'get',
+             reverse('posts:post_detail', args=[post_id]), 4),
+            ('posts:post_detail', reader, 'get',
+             reverse('posts:post_detail', args=[post_id]), 7),
+            ('posts:post_create', reader, 'get',
+             reverse('posts:post_create'), 3),
+            ('posts:post_edit', self.author_client, 'get',
+             reverse('posts:post_edit', args=[post_id]), 4),
+            ('posts:add_comment', reader, 'post',
+             reverse('posts:add_comment', args=[post_id]), 6),
+            ('posts:search', guest, 'get', reverse('posts:search'), 2),
+            ('posts:follow_index', reader, 'get',
+             reverse('posts:follow_index'), 4),
+            ('posts:profile_unfollow', reader, 'get',
+             reverse('posts:profile_unfollow', args=[author.username]), 9),
+            ('posts:profile_follow', reader, 'get',
+             reverse('posts:profile_follow', args=[author.username]), 9),
+            ('about:author', guest, 'get', reverse('about:author'), 0),
+            ('about:tech', guest, 'get', reverse('about:tech'), 0),
+            ('users:signup', guest, 'get', reverse('users:signup'), 0),
+            ('users:login', guest, 'get', reverse('users:login'), 0),
+            ('users:logout', guest, 'get', reverse('users:logout'), 0),
+            ('users:password_change', reader, 'get',
+             reverse('users:password_change'), 2),
+            ('users:password_change_done', reader, 'get',
+             reverse('users:password_change_done'), 2),
+            ('users:password_reset', guest, 'get',
+             reverse('users:password_reset'), 0),
+            ('users:password_reset_done', guest, 'get',
+             reverse('users:password_reset_done'), 0),
+            ('users:password_reset_confirm', guest, 'get',
+             reverse('users:password_reset_confirm', kwargs={
+                 'uidb64': QueryBudgetTest.uid,
+                 'token': QueryBudgetTest.token,
+             }), 1),
+            ('users:password_reset_complete', guest, 'get',
+             reverse('users:password_reset_complete'), 0),
+            ('posts:export', self.staff_client, 'get',
+             reverse('posts:export', args=['posts']), 3),
+        )
+
+    def test_views_stay_within_query_budget(self):
+        """Страницы укладываются в бюджет запросов на любом объёме."""
+        for scale in SCALES:
+            self.seed(scale)
+            for name, client, method, url, budget in self.requests():
+                with self.subTest(scale=scale, view=name, url=url):
+                    cache.clear()
+                    label = f'{name} ({url}) при {scale} постах'
+                    with query_budget(budget, label):
+                        response = getattr(client, method)(
+                            url, DATA.get(name))
+                        if response.streaming:
+                            # запросы потокового ответа идут при чтении
+                            b''.join(response.streaming_content)
+                    self.assertLess(response.status_code, 500)
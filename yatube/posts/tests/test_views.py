@@ -1,15 +1,35 @@
+import csv
+import gzip
+import json
+import os
 import shutil
+import sqlite3
 import tempfile
+import threading
+from io import BytesIO, StringIO
+from unittest import mock
 
+from core import routers
 from django import forms
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage, default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from posts.models import Follow, Group, Post, User
-from posts.views import POST_LIMIT
+from django.utils import timezone
+from posts import (comments, export, group_feed, search, sharding, stats,
+                   thumbnails, timeline)
+from posts.models import (Comment, Follow, Group, Post, ThumbnailJob,
+                          TimelineEntry, User)
+from posts.caching import get_or_render
+from posts.views import COMMENT_LIMIT, POST_LIMIT
+from PIL import Image
 
 User = get_user_model()
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
@@ -318,6 +338,307 @@ class PaginatorViewsTest(TestCase):
                 ).object_list), POST_LIMIT)
 
 
+class CursorPaginatorViewsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Тест_автор')
+        cls.follower = User.objects.create_user(username='Подписчик')
+        cls.group = Group.objects.create(
+            title='Тестовое название группы',
+            slug='test-slug',
+            description='Тестовое описание'
+        )
+        Post.objects.bulk_create(
+            Post(
+                text=f'Тестовый текст поста{i}',
+                group=cls.group,
+                author=cls.author
+            )
+            for i in range(31)
+        )
+        # половина постов с одинаковой датой: порядок держится на id
+        Post.objects.filter(id__in=Post.objects.order_by(
+            'id').values('id')[:15]).update(pub_date=timezone.now())
+        # bulk_create не шлёт сигналов: лента заполнится при подписке
+        Follow.objects.create(user=cls.follower, author=cls.author)
+        cls.expected = list(Post.objects.order_by('-pub_date', '-id'))
+        cls.urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', args=[cls.group.slug]),
+            reverse('posts:profile', args=[cls.author.username]),
+            reverse('posts:follow_index'),
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(CursorPaginatorViewsTest.follower)
+
+    def walk(self, url):
+        pages = []
+        response = self.client.get(url + '?cursor=')
+        while True:
+            page_obj = response.context['page_obj']
+            pages.append(page_obj)
+            if not page_obj.has_next():
+                return pages
+            response = self.client.get(
+                url, {'cursor': page_obj.next_cursor})
+
+    def test_cursor_walks_all_posts_in_order(self):
+        """Курсоры проходят ленту целиком без пропусков и повторов."""
+        for url in CursorPaginatorViewsTest.urls:
+            with self.subTest(url=url):
+                pages = self.walk(url)
+                self.assertEqual(
+                    [len(page) for page in pages],
+                    [POST_LIMIT, POST_LIMIT, POST_LIMIT, 1]
+                )
+                posts = [post for page in pages for post in page]
+                self.assertEqual(posts, CursorPaginatorViewsTest.expected)
+                self.assertFalse(pages[0].has_previous())
+
+    def test_previous_cursor_returns_previous_page(self):
+        """Курсор назад возвращает предыдущую страницу."""
+        url = reverse('posts:index')
+        first, second = self.walk(url)[:2]
+        response = self.client.get(url, {'cursor': second.previous_cursor})
+        page_obj = response.context['page_obj']
+        self.assertEqual(list(page_obj), list(first))
+        self.assertTrue(page_obj.has_next())
+
+    def test_invalid_cursor_returns_first_page(self):
+        """Испорченный курсор ведёт на первую страницу."""
+        response = self.client.get(
+            reverse('posts:index'), {'cursor': 'испорчен'})
+        self.assertEqual(
+            list(response.context['page_obj']),
+            CursorPaginatorViewsTest.expected[:POST_LIMIT]
+        )
+
+    def test_cursor_mode_skips_count_query(self):
+        """В режиме курсоров лента не считает записи через COUNT(*)."""
+        url = reverse('posts:index')
+        page_obj = self.walk(url)[1]
+        with CaptureQueriesContext(connection) as queries:
+            list(page_obj.paginator.get_page(page_obj.next_cursor))
+        self.assertFalse(
+            [query for query in queries if 'COUNT' in query['sql']])
+
+
+class FollowTimelineTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Автор')
+        cls.reader = User.objects.create_user(username='Читатель')
+        cls.another_reader = User.objects.create_user(username='Другой')
+        cls.old_post = Post.objects.create(
+            text='Пост до подписки', author=cls.author)
+
+    def setUp(self):
+        self.reader_client = Client()
+        self.reader_client.force_login(FollowTimelineTest.reader)
+
+    def follow(self, user, author):
+        Follow.objects.create(user=user, author=author)
+
+    def feed(self):
+        response = self.reader_client.get(reverse('posts:follow_index'))
+        return list(response.context['page_obj'])
+
+    def test_follow_backfills_timeline(self):
+        """Подписка переносит в ленту уже опубликованные посты."""
+        self.follow(FollowTimelineTest.reader, FollowTimelineTest.author)
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=FollowTimelineTest.reader,
+            post=FollowTimelineTest.old_post).exists())
+        self.assertEqual(self.feed(), [FollowTimelineTest.old_post])
+
+    def test_new_post_fans_out_to_followers(self):
+        """Новый пост попадает в ленты всех подписчиков."""
+        self.follow(FollowTimelineTest.reader, FollowTimelineTest.author)
+        self.follow(
+            FollowTimelineTest.another_reader, FollowTimelineTest.author)
+        post = Post.objects.create(
+            text='Новый пост', author=FollowTimelineTest.author)
+        self.assertEqual(
+            TimelineEntry.objects.filter(post=post).count(), 2)
+        self.assertEqual(self.feed()[0], post)
+
+    def test_unfollow_prunes_timeline(self):
+        """Отписка убирает посты автора из ленты."""
+        self.follow(FollowTimelineTest.reader, FollowTimelineTest.author)
+        self.reader_client.get(reverse(
+            'posts:profile_unfollow',
+            kwargs={'username': FollowTimelineTest.author.username}))
+        self.assertFalse(TimelineEntry.objects.filter(
+            user=FollowTimelineTest.reader).exists())
+        self.assertEqual(self.feed(), [])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_celebrity_posts_are_read_on_demand(self):
+        """Посты автора с большим числом подписчиков не рассылаются,
+        но видны в ленте, в том числе после падения числа подписчиков.
+        """
+        self.follow(FollowTimelineTest.reader, FollowTimelineTest.author)
+        self.follow(
+            FollowTimelineTest.another_reader, FollowTimelineTest.author)
+        post = Post.objects.create(
+            text='Пост знаменитости', author=FollowTimelineTest.author)
+        self.assertFalse(TimelineEntry.objects.filter(post=post).exists())
+        self.assertEqual(self.feed(), [post, FollowTimelineTest.old_post])
+        Follow.objects.filter(
+            user=FollowTimelineTest.another_reader).delete()
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=FollowTimelineTest.reader, post=post).exists())
+        self.assertEqual(self.feed(), [post, FollowTimelineTest.old_post])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_celebrity_posts_merge_into_pages(self):
+        """Посты «знаменитости» и ленты чередуются по дате на всех
+        страницах в обоих режимах пагинации.
+        """
+        celebrity = User.objects.create_user(username='Знаменитость')
+        self.follow(FollowTimelineTest.reader, FollowTimelineTest.author)
+        self.follow(FollowTimelineTest.reader, celebrity)
+        self.follow(FollowTimelineTest.another_reader, celebrity)
+        now = timezone.now()
+        for number in range(POST_LIMIT):
+            for author in (FollowTimelineTest.author, celebrity):
+                Post.objects.create(
+                    text=f'Пост {number}', author=author,
+                    pub_date=now - timezone.timedelta(minutes=number))
+        expected = list(Post.objects.filter(
+            author__in=[FollowTimelineTest.author, celebrity],
+        ).order_by('-pub_date', '-id'))
+        feed = timeline.follow_feed(FollowTimelineTest.reader)
+        self.assertEqual(feed.count(), len(expected))
+        pages = []
+        for page in (1, 2, 3):
+            response = self.reader_client.get(
+                reverse('posts:follow_index'), {'page': page})
+            pages += response.context['page_obj']
+        self.assertEqual(pages, expected)
+        pages, params = [], {'cursor': ''}
+        while params:
+            response = self.reader_client.get(
+                reverse('posts:follow_index'), params)
+            page_obj = response.context['page_obj']
+            pages += page_obj
+            params = {'cursor': page_obj.next_cursor} if (
+                page_obj.has_next()) else None
+        self.assertEqual(pages, expected)
+
+
+class PostCardCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Тест_автор')
+        cls.group = Group.objects.create(
+            title='Тестовое название группы',
+            slug='test-slug',
+            description='Тестовое описание'
+        )
+        cls.post = Post.objects.create(
+            text='Исходный текст',
+            group=cls.group,
+            author=cls.author,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse(
+            'posts:profile', args=[PostCardCacheTest.author.username])
+
+    def content(self, url=None):
+        return self.client.get(url or self.url).content.decode()
+
+    def test_card_is_cached_until_post_is_saved(self):
+        """Карточка берётся из кэша, пока пост не сохранят."""
+        self.content()
+        Post.objects.filter(pk=PostCardCacheTest.post.pk).update(
+            text='Правка в обход сигналов')
+        self.assertIn('Исходный текст', self.content())
+        post = Post.objects.get(pk=PostCardCacheTest.post.pk)
+        post.text = 'Новый текст'
+        post.save()
+        content = self.content()
+        self.assertIn('Новый текст', content)
+        self.assertNotIn('Исходный текст', content)
+
+    def test_card_is_shared_between_pages(self):
+        """Карточка, отрисованная в профиле, используется в группе."""
+        self.content()
+        Post.objects.filter(pk=PostCardCacheTest.post.pk).update(
+            text='Правка в обход сигналов')
+        self.assertIn('Исходный текст', self.content(reverse(
+            'posts:group_list', args=[PostCardCacheTest.group.slug])))
+
+    def test_group_and_author_changes_invalidate_card(self):
+        """Сохранение группы или смена имени автора обновляют карточку."""
+        self.content()
+        group = Group.objects.get(pk=PostCardCacheTest.group.pk)
+        group.title = 'Переименованная группа'
+        group.save()
+        self.assertIn('Переименованная группа', self.content())
+        author = User.objects.get(pk=PostCardCacheTest.author.pk)
+        author.username = 'Новое_имя'
+        author.save()
+        content = self.content(
+            reverse('posts:profile', args=[author.username]))
+        self.assertIn('@Новое_имя', content)
+
+
+class PostDetailCommentsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Тест_автор')
+        cls.post = Post.objects.create(
+            text='Тестовый текст поста', author=cls.author)
+        cls.url = reverse('posts:post_detail', args=[cls.post.pk])
+
+    def setUp(self):
+        cache.clear()
+
+    def add_comments(self, count):
+        start = Comment.objects.count()
+        for i in range(start, start + count):
+            Comment.objects.create(
+                post=PostDetailCommentsTest.post,
+                author=User.objects.create_user(username=f'Комментатор{i}'),
+                text=f'Комментарий {i}',
+            )
+
+    def count_queries(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(PostDetailCommentsTest.url)
+        return len(queries)
+
+    def test_comment_queries_do_not_depend_on_comment_count(self):
+        """Число запросов не растёт вместе с числом комментариев."""
+        self.add_comments(1)
+        one_comment = self.count_queries()
+        self.add_comments(COMMENT_LIMIT - 1)
+        self.assertEqual(self.count_queries(), one_comment)
+
+    def test_comments_are_paginated_by_cursor(self):
+        """Длинная ветка комментариев отдаётся страницами по курсору."""
+        self.add_comments(COMMENT_LIMIT + 5)
+        response = self.client.get(PostDetailCommentsTest.url)
+        comments = response.context['comments']
+        self.assertEqual(len(comments), COMMENT_LIMIT)
+        self.assertEqual(comments[0].text, 'Комментарий 0')
+        response = self.client.get(
+            PostDetailCommentsTest.url, {'comments': comments.next_cursor})
+        comments = response.context['comments']
+        self.assertEqual(len(comments), 5)
+        self.assertFalse(comments.has_next())
+
+
 class CacheViewsTest(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -337,21 +658,1025 @@ class CacheViewsTest(TestCase):
             author=cls.author,
         )
 
+    def setUp(self):
+        cache.clear()
+
     def test_cache_index(self):
         """Проверка хранения и обновления кэша для /."""
         response = CacheViewsTest.authorized_client.get(reverse('posts:index'))
         posts = response.content
-        Post.objects.create(
-            text='Тестовый текст нового поста',
-            author=CacheViewsTest.author,
-        )
+        Post.objects.filter(pk=CacheViewsTest.post.pk).update(
+            text='Правка в обход сигналов')
         response_old = CacheViewsTest.authorized_client.get(
             reverse('posts:index'))
         old_posts = response_old.content
         self.assertEqual(old_posts, posts,
                          'Не возвращается кэшированная страница.')
-        cache.clear()
+        Post.objects.create(
+            text='Тестовый текст нового поста',
+            author=CacheViewsTest.author,
+        )
         response_new = CacheViewsTest.authorized_client.get(
             reverse('posts:index'))
         new_posts = response_new.content
         self.assertNotEqual(old_posts, new_posts, 'Не сбрасывается кэш.')
+        self.assertIn('Тестовый текст нового поста', new_posts.decode())
+
+    def test_cache_index_after_delete(self):
+        """Удаление поста сразу убирает его с главной страницы."""
+        post = Post.objects.create(
+            text='Пост под удаление',
+            author=CacheViewsTest.author,
+        )
+        response = CacheViewsTest.authorized_client.get(reverse('posts:index'))
+        self.assertIn('Пост под удаление', response.content.decode())
+        post.delete()
+        response = CacheViewsTest.authorized_client.get(reverse('posts:index'))
+        self.assertNotIn('Пост под удаление', response.content.decode())
+
+    def test_stale_fragment_is_rebuilt_by_one_worker(self):
+        """Истёкший фрагмент пересобирает только владелец блокировки."""
+        renders = []
+
+        def render():
+            renders.append(1)
+            return f'версия {len(renders)}'
+
+        self.assertEqual(get_or_render('fragment', 60, render), 'версия 1')
+        self.assertEqual(get_or_render('fragment', 60, render), 'версия 1')
+        cache.set('fragment', (0, 'версия 1'))
+        cache.add('fragment:lock', 1)
+        self.assertEqual(get_or_render('fragment', 60, render), 'версия 1')
+        self.assertEqual(len(renders), 1)
+        cache.delete('fragment:lock')
+        self.assertEqual(get_or_render('fragment', 60, render), 'версия 2')
+        self.assertIsNone(cache.get('fragment:lock'))
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Автор_етег')
+        cls.reader = User.objects.create_user(username='Читатель_етег')
+        cls.group = Group.objects.create(
+            title='Группа', slug='etag-slug', description='Описание')
+        cls.post = Post.objects.create(
+            text='Пост для условного GET', group=cls.group, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.author_client = Client()
+        self.author_client.force_login(ConditionalGetTest.author)
+        self.reader_client = Client()
+        self.reader_client.force_login(ConditionalGetTest.reader)
+
+    def urls(self):
+        post = ConditionalGetTest.post
+        return [
+            reverse('posts:index'),
+            reverse('posts:group_list', args=[post.group.slug]),
+            reverse('posts:profile', args=[post.author.username]),
+            reverse('posts:post_detail', args=[post.pk]),
+        ]
+
+    def test_unchanged_page_is_not_modified(self):
+        """Повторный запрос с ETag или датой получает 304 без рендеринга."""
+        for url in self.urls():
+            with self.subTest(url=url):
+                # первый визит выдаёт CSRF-cookie для формы комментария
+                self.reader_client.get(url)
+                response = self.reader_client.get(url)
+                self.assertEqual(response.status_code, 200)
+                etag = response['ETag']
+                response = self.reader_client.get(
+                    url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.templates, [])
+                self.assertEqual(response['ETag'], etag)
+                self.assertNotIn('Last-Modified', response)
+
+    def test_login_invalidates_guest_date(self):
+        """Дату получают только гости: после входа If-Modified-Since
+        не даёт 304 со страницей гостя."""
+        for url in self.urls()[:3]:
+            with self.subTest(url=url):
+                client = Client()
+                modified = client.get(url)['Last-Modified']
+                response = client.get(url, HTTP_IF_MODIFIED_SINCE=modified)
+                self.assertEqual(response.status_code, 304)
+                client.force_login(ConditionalGetTest.reader)
+                response = client.get(url, HTTP_IF_MODIFIED_SINCE=modified)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, ConditionalGetTest.reader)
+
+    def test_new_post_changes_etag(self):
+        """Новый пост меняет ETag лент и профиля автора."""
+        urls = self.urls()[:3]
+        etags = [self.guest_client.get(url)['ETag'] for url in urls]
+        Post.objects.create(
+            text='Свежий пост', group=ConditionalGetTest.group,
+            author=ConditionalGetTest.author)
+        for url, etag in zip(urls, etags):
+            with self.subTest(url=url):
+                response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('Свежий пост', response.content.decode())
+
+    def test_index_is_validated_without_queries(self):
+        """304 для главной гостю не читает базу."""
+        url = reverse('posts:index')
+        etag = self.guest_client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_edit_and_comment_change_post_etag(self):
+        """Правка поста и новый комментарий меняют ETag страницы поста."""
+        url = reverse('posts:post_detail', args=[ConditionalGetTest.post.pk])
+        self.reader_client.get(url)
+        etag = self.reader_client.get(url)['ETag']
+        self.author_client.post(
+            reverse('posts:post_edit', args=[ConditionalGetTest.post.pk]),
+            {'text': 'Исправленный пост',
+             'group': ConditionalGetTest.group.pk},
+        )
+        response = self.reader_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Исправленный пост', response.content.decode())
+        etag = response['ETag']
+        Comment.objects.create(
+            post=ConditionalGetTest.post, author=ConditionalGetTest.reader,
+            text='Новый комментарий')
+        response = self.reader_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Новый комментарий', response.content.decode())
+
+    def test_follow_changes_profile_etag(self):
+        """Подписка меняет ETag профиля для подписчика."""
+        url = reverse('posts:profile', args=[ConditionalGetTest.author])
+        etag = self.reader_client.get(url)['ETag']
+        Follow.objects.create(
+            user=ConditionalGetTest.reader, author=ConditionalGetTest.author)
+        response = self.reader_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_depends_on_viewer(self):
+        """Автор и другой пользователь видят разные версии страницы."""
+        url = reverse('posts:post_detail', args=[ConditionalGetTest.post.pk])
+        self.author_client.get(url)
+        etag = self.author_client.get(url)['ETag']
+        response = self.reader_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_missing_page_is_not_found(self):
+        """Для несуществующей группы отдаётся обычный 404."""
+        response = self.guest_client.get(
+            reverse('posts:group_list', args=['no-such-group']),
+            HTTP_IF_NONE_MATCH='"whatever"')
+        self.assertEqual(response.status_code, 404)
+
+
+class CommentBatchTest(TransactionTestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='Автор_пачки')
+        self.post = Post.objects.create(text='Пост', author=self.author)
+        self.users = [
+            User.objects.create_user(username=f'Комментатор_пачки{i}')
+            for i in range(4)
+        ]
+
+    def save_concurrently(self, comments_to_save):
+        errors = []
+
+        def target(comment):
+            try:
+                comments.save(comment)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=target, args=[comment])
+            for comment in comments_to_save
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    @override_settings(COMMENT_BATCH_SIZE=4, COMMENT_BATCH_WINDOW=5)
+    def test_concurrent_comments_are_written_in_one_batch(self):
+        """Комментарии потоков записываются одной пачкой со счётчиками
+        и поисковым индексом."""
+        batch = [
+            Comment(post=self.post, author=user, text=f'Шторм {i}')
+            for i, user in enumerate(self.users)
+        ]
+        with mock.patch.object(
+                comments, 'write', wraps=comments.write) as write:
+            self.assertEqual(self.save_concurrently(batch), [])
+        write.assert_called_once()
+        self.assertEqual(len(write.call_args[0][0]), 4)
+        for comment in batch:
+            stored = Comment.objects.get(pk=comment.pk)
+            self.assertEqual(stored.text, comment.text)
+            self.assertEqual(
+                stats.get_stats(comment.author).comments_count, 1)
+        self.assertEqual(
+            set(search.matching_ids('шторм', search.COMMENT)),
+            {comment.pk for comment in batch})
+
+    @override_settings(COMMENT_BATCH_SIZE=2, COMMENT_BATCH_WINDOW=5)
+    def test_broken_comment_fails_alone(self):
+        """Ошибка одного комментария не отменяет остальные в пачке."""
+        good = Comment(post=self.post, author=self.users[0], text='Хороший')
+        broken = Comment(post_id=10 ** 6, author=self.users[1], text='Битый')
+        errors = self.save_concurrently([good, broken])
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(
+            list(Comment.objects.values_list('text', flat=True)), ['Хороший'])
+
+    @override_settings(COMMENT_BATCH_SIZE=2, COMMENT_BATCH_WINDOW=5,
+                       REPLICA_DATABASES=['replica_a'])
+    def test_every_commenter_is_pinned_to_primary(self):
+        """Пачку пишет один поток, но к основной базе закрепляется
+        каждый автор комментария."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        connections.databases['replica_a'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(directory, 'replica_a.sqlite3'),
+        }
+        self.addCleanup(connections.databases.pop, 'replica_a')
+        url = reverse('posts:add_comment', args=[self.post.pk])
+        responses = []
+
+        def target(user):
+            client = Client()
+            client.force_login(user)
+            try:
+                responses.append(client.post(url, {'text': user.username}))
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=target, args=[user])
+            for user in self.users[:2]
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(Comment.objects.count(), 2)
+        self.assertEqual(len(responses), 2)
+        for response in responses:
+            self.assertIn(routers.PIN_COOKIE, response.cookies)
+
+    @override_settings(COMMENT_BATCH_SIZE=2, COMMENT_BATCH_WINDOW=5)
+    def test_followers_record_their_write(self):
+        """Отметку о записи получает и поток, чей комментарий записал
+        ведущий."""
+        batch = [
+            Comment(post=self.post, author=user, text='Отметка')
+            for user in self.users[:2]
+        ]
+        wrote = []
+
+        def target(comment):
+            routers.begin()
+            try:
+                comments.save(comment)
+                wrote.append(routers.end())
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=target, args=[comment])
+            for comment in batch
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(wrote, [True, True])
+
+
+@override_settings(COMMENT_USER_RATE=(2, 60), COMMENT_POST_RATE=(3, 60))
+class CommentRateLimitTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Автор_лимита')
+        cls.post = Post.objects.create(text='Пост', author=cls.author)
+        cls.url = reverse('posts:add_comment', args=[cls.post.pk])
+
+    def setUp(self):
+        cache.clear()
+
+    def client_for(self, username):
+        client = Client()
+        client.force_login(User.objects.create_user(username=username))
+        return client
+
+    def test_user_limit(self):
+        """Лишний комментарий пользователя получает 429 и не пишется."""
+        client = self.client_for('Болтун')
+        for i in range(2):
+            response = client.post(CommentRateLimitTest.url, {'text': i})
+            self.assertEqual(response.status_code, 302)
+        response = client.post(CommentRateLimitTest.url, {'text': 'Ещё'})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertTemplateUsed(response, 'core/429.html')
+        self.assertFalse(Comment.objects.filter(text='Ещё').exists())
+
+    def test_post_limit(self):
+        """Пост принимает не больше COMMENT_POST_RATE комментариев."""
+        for i in range(3):
+            response = self.client_for(f'Гость{i}').post(
+                CommentRateLimitTest.url, {'text': i})
+            self.assertEqual(response.status_code, 302)
+        response = self.client_for('Опоздавший').post(
+            CommentRateLimitTest.url, {'text': 'Поздно'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(Comment.objects.count(), 3)
+
+    def test_invalid_form_is_not_counted(self):
+        """Пустая форма не расходует лимит."""
+        client = self.client_for('Торопыга')
+        for _ in range(3):
+            client.post(CommentRateLimitTest.url, {'text': ''})
+        response = client.post(CommentRateLimitTest.url, {'text': 'Текст'})
+        self.assertEqual(response.status_code, 302)
+
+
+class SearchViewsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Тест_автор')
+        cls.cat_post = Post.objects.create(
+            text='Наш кот любит спать на подоконнике', author=cls.author)
+        cls.dog_post = Post.objects.create(
+            text='Собака гуляла во дворе', author=cls.author)
+        cls.url = reverse('posts:search')
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, query, **params):
+        response = self.client.get(
+            SearchViewsTest.url, {'q': query, **params})
+        return response.context['page_obj']
+
+    def test_search_finds_word_forms(self):
+        """Поиск находит пост по другой форме слова."""
+        self.assertEqual(
+            list(self.search('котами')), [SearchViewsTest.cat_post])
+        self.assertEqual(
+            list(self.search('СОБАКИ')), [SearchViewsTest.dog_post])
+        self.assertEqual(list(self.search('попугай')), [])
+        self.assertEqual(list(self.search('')), [])
+
+    def test_search_requires_every_word(self):
+        """Пост должен содержать все слова запроса."""
+        self.assertEqual(
+            list(self.search('кот подоконники')), [SearchViewsTest.cat_post])
+        self.assertEqual(list(self.search('кот во дворе')), [])
+
+    def test_comment_matches_its_post(self):
+        """Совпадение в комментарии выводит пост, к которому он оставлен."""
+        Comment.objects.create(
+            post=SearchViewsTest.dog_post,
+            author=SearchViewsTest.author,
+            text='Котов во дворе тоже хватает',
+        )
+        self.assertEqual(
+            set(self.search('котов')),
+            {SearchViewsTest.cat_post, SearchViewsTest.dog_post},
+        )
+
+    def test_index_follows_edits_and_deletes(self):
+        """Правка и удаление поста сразу отражаются в выдаче."""
+        post = Post.objects.create(text='Черепаха', author=self.author)
+        self.assertEqual(list(self.search('черепахи')), [post])
+        post.text = 'Ёжик'
+        post.save()
+        self.assertEqual(list(self.search('черепахи')), [])
+        self.assertEqual(list(self.search('ежики')), [post])
+        post.delete()
+        self.assertEqual(list(self.search('ежики')), [])
+
+    def test_more_relevant_post_comes_first(self):
+        """Пост с большим числом совпадений стоит выше."""
+        post = Post.objects.create(
+            text='Кот, кот и ещё раз кот', author=SearchViewsTest.author)
+        self.assertEqual(
+            list(self.search('кот')), [post, SearchViewsTest.cat_post])
+
+    def test_results_are_paginated_by_cursor(self):
+        """Выдача листается по курсору и сохраняет запрос в ссылках."""
+        Post.objects.bulk_create([
+            Post(text=f'Сова номер {i}', author=SearchViewsTest.author)
+            for i in range(POST_LIMIT + 3)
+        ])
+        search.rebuild()
+        page = self.search('совы')
+        self.assertEqual(len(page), POST_LIMIT)
+        self.assertFalse(page.has_previous())
+        response = self.client.get(
+            SearchViewsTest.url, {'q': 'совы', 'cursor': page.next_cursor})
+        self.assertContains(response, 'q=%D1%81%D0%BE%D0%B2%D1%8B&amp;')
+        next_page = response.context['page_obj']
+        self.assertEqual(len(next_page), 3)
+        self.assertFalse(next_page.has_next())
+        self.assertFalse(set(page) & set(next_page))
+        previous_page = self.search('совы', cursor=next_page.previous_cursor)
+        self.assertEqual(list(previous_page), list(page))
+
+    def test_admin_search_uses_index(self):
+        """Поиск в админке находит посты и комментарии по формам слов."""
+        admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='pass')
+        comment = Comment.objects.create(
+            post=SearchViewsTest.dog_post,
+            author=SearchViewsTest.author,
+            text='Прекрасные собаки',
+        )
+        self.client.force_login(admin)
+        response = self.client.get(
+            reverse('admin:posts_post_changelist'), {'q': 'котам'})
+        self.assertEqual(
+            list(response.context['cl'].result_list),
+            [SearchViewsTest.cat_post],
+        )
+        response = self.client.get(
+            reverse('admin:posts_comment_changelist'), {'q': 'собака'})
+        self.assertEqual(list(response.context['cl'].result_list), [comment])
+
+    def test_admin_search_keeps_rank_order(self):
+        """Без выбранной сортировки админка выводит найденное по рангу."""
+        admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='pass')
+        post = Post.objects.create(
+            text='Кот, кот и ещё раз кот', author=SearchViewsTest.author)
+        self.client.force_login(admin)
+        url = reverse('admin:posts_post_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'q': 'кот'})
+        self.assertEqual(
+            list(response.context['cl'].result_list),
+            [post, SearchViewsTest.cat_post])
+        self.assertTrue(any(
+            'MATCH' in query['sql'] and 'search_rank' in query['sql']
+            for query in queries.captured_queries))
+        # сортировка по тексту в обратном порядке
+        response = self.client.get(url, {'q': 'кот', 'o': '-2'})
+        self.assertEqual(
+            list(response.context['cl'].result_list),
+            [SearchViewsTest.cat_post, post])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailQueueTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Тест_автор')
+        cls.authorized_client = Client()
+        cls.authorized_client.force_login(cls.author)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+
+    @staticmethod
+    def image(name, color='red'):
+        buffer = BytesIO()
+        Image.new('RGB', (2, 2), color).save(buffer, 'GIF')
+        return SimpleUploadedFile(
+            name=name, content=buffer.getvalue(), content_type='image/gif')
+
+    def create_post(self):
+        self.authorized_client.post(reverse('posts:post_create'), {
+            'text': 'Пост с картинкой',
+            'image': self.image('queued.gif'),
+        })
+        return Post.objects.get(text='Пост с картинкой')
+
+    def test_upload_is_queued_and_shown_as_placeholder(self):
+        """Загрузка ставит задание, а лента показывает заглушку."""
+        post = self.create_post()
+        job = ThumbnailJob.objects.get(post=post)
+        self.assertEqual(job.status, ThumbnailJob.PENDING)
+        self.assertEqual(job.image, post.image.name)
+        self.assertFalse(post.thumbnails_ready)
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, 'Картинка обрабатывается')
+        self.assertNotContains(response, 'class="card-img my-2" src=')
+
+    def test_worker_builds_every_variant(self):
+        """Воркер строит все ширины и форматы и сохраняет их в посте."""
+        post = self.create_post()
+        self.client.get(reverse('posts:index'))
+        self.assertEqual(thumbnails.process_pending(), 1)
+        post.refresh_from_db()
+        self.assertTrue(post.thumbnails_ready)
+        self.assertEqual(
+            ThumbnailJob.objects.get(post=post).status, ThumbnailJob.DONE)
+        built = json.loads(post.image_variants)
+        self.assertEqual(
+            list(built),
+            thumbnails.source_formats() + [thumbnails.FALLBACK_FORMAT])
+        for files in built.values():
+            self.assertEqual(
+                [width for _, width, _ in files],
+                list(thumbnails.CARD_WIDTHS))
+            for name, _, _ in files:
+                self.assertTrue(default_storage.exists(name))
+
+    def test_card_renders_picture_without_storage_calls(self):
+        """Карточка выводит <picture> со srcset, не трогая хранилище."""
+        post = self.create_post()
+        thumbnails.process_pending()
+        post.refresh_from_db()
+        fallback = json.loads(post.image_variants)['JPEG']
+        cache.clear()
+        with mock.patch.object(
+                FileSystemStorage, 'exists', side_effect=AssertionError), \
+                mock.patch.object(
+                    FileSystemStorage, 'size', side_effect=AssertionError), \
+                mock.patch.object(
+                    FileSystemStorage, '_open', side_effect=AssertionError):
+            response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, '<picture>')
+        self.assertContains(response, f'sizes="{thumbnails.CARD_SIZES}"')
+        self.assertContains(
+            response, f'src="{default_storage.url(fallback[1][0])}"')
+        for image_format in thumbnails.source_formats():
+            self.assertContains(
+                response,
+                f'<source type="{thumbnails.MIME_TYPES[image_format]}"')
+
+    def test_unreadable_variants_fall_back_to_thumbnail(self):
+        """Испорченные варианты не ломают ленту: карточка идёт через sorl."""
+        post = self.create_post()
+        Post.objects.filter(pk=post.pk).update(
+            thumbnails_ready=True, image_variants='не JSON')
+        cache.clear()
+        response = self.client.get(reverse('posts:index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, '<picture>')
+        self.assertContains(response, 'class="card-img my-2" src=')
+
+    def test_new_image_is_requeued(self):
+        """Замена картинки сбрасывает готовность, а старое задание
+        не отмечает пост готовым."""
+        post = self.create_post()
+        self.authorized_client.post(
+            reverse('posts:post_edit', args=[post.pk]),
+            {'text': post.text, 'image': self.image('replaced.gif', 'blue')},
+        )
+        ThumbnailJob.objects.filter(image=post.image.name).update(
+            status=ThumbnailJob.RUNNING)
+        stale = ThumbnailJob.objects.get(image=post.image.name)
+        thumbnails.run(stale)
+        post.refresh_from_db()
+        self.assertFalse(post.thumbnails_ready)
+        self.assertEqual(thumbnails.process_pending(), 1)
+        post.refresh_from_db()
+        self.assertTrue(post.thumbnails_ready)
+
+    def test_workers_start_without_waiting(self):
+        """Пул будится после коммита, запрос его не ждёт."""
+        with mock.patch.object(thumbnails, '_executor') as executor:
+            future = thumbnails.start_workers()
+            executor.submit.assert_called_once_with(thumbnails._work)
+            future.result.assert_not_called()
+            with override_settings(THUMBNAIL_WORKERS=0):
+                self.assertIsNone(thumbnails.start_workers())
+            executor.submit.assert_called_once()
+
+    def test_text_edit_keeps_thumbnails(self):
+        """Правка текста не ставит картинку в очередь заново."""
+        post = self.create_post()
+        thumbnails.process_pending()
+        self.authorized_client.post(
+            reverse('posts:post_edit', args=[post.pk]), {'text': 'Новый'})
+        post.refresh_from_db()
+        self.assertTrue(post.thumbnails_ready)
+        self.assertEqual(ThumbnailJob.objects.filter(post=post).count(), 1)
+
+    def test_broken_image_fails_after_retries(self):
+        """Битая картинка исчерпывает попытки и не блокирует очередь."""
+        post = Post.objects.create(
+            text='Битая', author=ThumbnailQueueTest.author,
+            image='posts/missing.gif')
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(
+                thumbnails.process_pending(), thumbnails.MAX_ATTEMPTS)
+        job = ThumbnailJob.objects.get(post=post)
+        self.assertEqual(job.status, ThumbnailJob.FAILED)
+        self.assertEqual(job.attempts, thumbnails.MAX_ATTEMPTS)
+        self.assertIsNone(thumbnails.claim())
+        # вместо вечной заглушки карточка идёт через sorl
+        post.refresh_from_db()
+        self.assertTrue(post.thumbnails_ready)
+        self.assertEqual(post.image_variants, '')
+        with self.assertLogs('sorl.thumbnail', level='ERROR'):
+            response = self.client.get(reverse('posts:index'))
+        self.assertNotContains(response, 'Картинка обрабатывается')
+
+    def test_saves_outside_views_are_queued(self):
+        """Картинка, сохранённая из админки или shell, тоже в очереди."""
+        post = Post.objects.create(
+            text='Из shell', author=ThumbnailQueueTest.author,
+            image=self.image('shell.gif'))
+        self.assertEqual(
+            ThumbnailJob.objects.get(post=post).image, post.image.name)
+        thumbnails.process_pending()
+        post = Post.objects.get(pk=post.pk)
+        post.text = 'Только текст'
+        post.save()
+        self.assertTrue(post.thumbnails_ready)
+        self.assertEqual(ThumbnailJob.objects.filter(post=post).count(), 1)
+        post.image = self.image('other.gif', 'green')
+        post.save()
+        self.assertFalse(post.thumbnails_ready)
+        self.assertEqual(post.image_variants, '')
+        self.assertEqual(
+            ThumbnailJob.objects.filter(post=post).latest('pk').image,
+            post.image.name)
+
+
+class GroupFeedTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='Автор_группы')
+        self.group = Group.objects.create(
+            title='Группа', slug='feed', description='')
+        self.other = Group.objects.create(
+            title='Другая', slug='other', description='')
+        self.posts = [
+            Post.objects.create(
+                author=self.author, group=self.group, text=f'Пост {i}')
+            for i in range(POST_LIMIT + 3)
+        ]
+        self.newest_first = self.posts[::-1]
+        self.url = reverse('posts:group_list', args=[self.group.slug])
+
+    def assert_feed_is_fresh(self, group):
+        feed = group_feed.load(group.pk)
+        fresh = group_feed._build(group.pk)
+        self.assertEqual(feed['keys'], fresh['keys'])
+        self.assertEqual(feed['total'], fresh['total'])
+
+    def test_warm_feed_is_not_rebuilt(self):
+        self.client.get(self.url)
+        with mock.patch.object(
+                group_feed, '_build', wraps=group_feed._build) as build:
+            first = self.client.get(self.url).context['page_obj']
+            second = self.client.get(self.url + '?page=2').context[
+                'page_obj']
+        build.assert_not_called()
+        self.assertEqual(list(first), self.newest_first[:POST_LIMIT])
+        self.assertEqual(list(second), self.newest_first[POST_LIMIT:])
+        self.assertEqual(first.paginator.count, len(self.posts))
+
+    def test_feed_follows_post_changes(self):
+        group_feed.load(self.group.pk)
+        group_feed.load(self.other.pk)
+        new = Post.objects.create(
+            author=self.author, group=self.group, text='Новый')
+        self.posts[0].delete()
+        moved = self.posts[1]
+        moved.group = self.other
+        moved.save()
+        for group in (self.group, self.other):
+            with self.subTest(group=group.slug):
+                self.assert_feed_is_fresh(group)
+        self.assertEqual(
+            group_feed.load(self.group.pk)['keys'][0][1], -new.pk)
+        self.assertEqual(group_feed.load(self.other.pk)['total'], 1)
+
+    @override_settings(GROUP_FEED_LENGTH=5)
+    def test_deep_pages_fall_back_to_database(self):
+        feed = group_feed.GroupFeed(self.group)
+        self.assertEqual(feed.count(), len(self.posts))
+        self.assertEqual(len(feed.feed()['keys']), 5)
+        with self.assertNumQueries(1):
+            self.assertEqual(feed[0:5], self.newest_first[:5])
+        self.assertEqual(list(feed[5:10]), self.newest_first[5:10])
+        response = self.client.get(self.url + '?page=2')
+        self.assertEqual(
+            list(response.context['page_obj']), self.newest_first[POST_LIMIT:])
+
+    def test_slug_lookup_is_cached_until_group_changes(self):
+        self.assertEqual(group_feed.find_group('feed'), self.group)
+        with self.assertNumQueries(0):
+            self.assertEqual(group_feed.find_group('feed'), self.group)
+        self.group.slug = 'renamed'
+        self.group.save()
+        self.assertIsNone(group_feed.find_group('feed'))
+        self.assertEqual(group_feed.find_group('renamed'), self.group)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_group_delete_refreshes_feeds(self):
+        url = reverse('posts:index')
+        etag = self.client.get(url)['ETag']
+        self.group.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(
+            reverse('posts:group_list', args=['feed']),
+            response.content.decode())
+
+
+SHARDS = ('shard_a', 'shard_b')
+
+
+@override_settings(POST_SHARDS=list(SHARDS))
+class ShardingTest(TransactionTestCase):
+    """Шарды — пустые копии тестовой базы в отдельных файлах SQLite."""
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        connection.ensure_connection()
+        for alias in SHARDS:
+            path = os.path.join(directory, f'{alias}.sqlite3')
+            target = sqlite3.connect(path)
+            connection.connection.backup(target)
+            target.close()
+            connections.databases[alias] = {
+                'ENGINE': 'django.db.backends.sqlite3', 'NAME': path}
+            self.addCleanup(self.drop_shard, alias)
+        # по автору на каждый шард
+        self.authors = {}
+        while len(self.authors) < len(SHARDS):
+            user = User.objects.create_user(
+                username=f'Автор{User.objects.count()}')
+            self.authors.setdefault(sharding.for_author(user.pk), user)
+        self.author_a, self.author_b = (
+            self.authors[alias] for alias in SHARDS)
+        self.reader = User.objects.create_user(username='Читатель')
+        self.group = Group.objects.create(
+            title='Группа', slug='shards', description='')
+        self.client.force_login(self.reader)
+
+    @staticmethod
+    def drop_shard(alias):
+        connections[alias].close()
+        if hasattr(connections._connections, alias):
+            delattr(connections._connections, alias)
+        del connections.databases[alias]
+
+    def create_posts(self, count):
+        """Посты авторов по очереди, от старых к новым."""
+        return [
+            Post.objects.create(
+                author=(self.author_a, self.author_b)[i % 2],
+                group=self.group, text=f'Пост {i}')
+            for i in range(count)
+        ]
+
+    def test_posts_and_comments_live_on_the_author_shard(self):
+        post_a, post_b = self.create_posts(2)
+        comment = Comment.objects.create(
+            post=post_b, author=self.author_a, text='Комментарий')
+        for post, alias in ((post_a, 'shard_a'), (post_b, 'shard_b')):
+            self.assertEqual(sharding.for_post(post.pk), alias)
+            self.assertTrue(
+                Post.objects.using(alias).filter(pk=post.pk).exists())
+        self.assertFalse(Post.objects.using('default').exists())
+        self.assertFalse(
+            Post.objects.using('shard_a').filter(pk=post_b.pk).exists())
+        self.assertEqual(
+            Comment.objects.using('shard_b').get().pk, comment.pk)
+        self.assertEqual(stats.get_stats(self.author_a).posts_count, 1)
+        self.assertEqual(stats.get_stats(self.author_a).comments_count, 1)
+
+    def test_feeds_merge_shards_by_date(self):
+        """Главная и группа сливают шарды по -pub_date на любой странице."""
+        posts = self.create_posts(POST_LIMIT + 3)
+        newest_first = posts[::-1]
+        for url in (reverse('posts:index'),
+                    reverse('posts:group_list', args=[self.group.slug])):
+            with self.subTest(url=url):
+                first = self.client.get(url).context['page_obj']
+                second = self.client.get(url + '?page=2').context['page_obj']
+                self.assertEqual(
+                    list(first), newest_first[:POST_LIMIT])
+                self.assertEqual(
+                    list(second), newest_first[POST_LIMIT:])
+                self.assertEqual(first.paginator.count, len(posts))
+                cursor = self.client.get(url + '?cursor=').context[
+                    'page_obj'].next_cursor
+                self.assertEqual(list(self.client.get(
+                    f'{url}?cursor={cursor}').context['page_obj']),
+                    newest_first[POST_LIMIT:])
+        # авторы и группы подставлены из основной базы
+        self.assertEqual(first[0].author, newest_first[0].author)
+        self.assertEqual(first[0].group, self.group)
+
+    def test_profile_and_post_edit_touch_one_shard(self):
+        self.create_posts(4)
+        post = Post.objects.using('shard_a').first()
+        author_client = Client()
+        author_client.force_login(self.author_a)
+        with CaptureQueriesContext(connections['shard_a']) as own, \
+                CaptureQueriesContext(connections['shard_b']) as other:
+            response = self.client.get(
+                reverse('posts:profile', args=[self.author_a.username]))
+            author_client.post(
+                reverse('posts:post_edit', args=[post.pk]),
+                {'text': 'Правка', 'group': self.group.pk})
+        self.assertEqual(len(response.context['page_obj']), 2)
+        self.assertTrue(own.captured_queries)
+        self.assertEqual(other.captured_queries, [])
+        post.refresh_from_db()
+        self.assertEqual(post.text, 'Правка')
+
+    def test_follow_feed_gathers_followed_authors(self):
+        posts = self.create_posts(4)
+        Post.objects.create(author=self.reader, text='Свой пост')
+        Follow.objects.create(user=self.reader, author=self.author_a)
+        Follow.objects.create(user=self.reader, author=self.author_b)
+        response = self.client.get(reverse('posts:follow_index'))
+        self.assertEqual(list(response.context['page_obj']), posts[::-1])
+        self.assertFalse(TimelineEntry.objects.exists())
+
+    def test_comment_goes_to_the_post_shard(self):
+        post = self.create_posts(2)[1]
+        self.client.post(
+            reverse('posts:add_comment', args=[post.pk]),
+            {'text': 'Из шарда'})
+        comment = Comment.objects.using('shard_b').get()
+        self.assertEqual(comment.author, self.reader)
+        response = self.client.get(
+            reverse('posts:post_detail', args=[post.pk]))
+        self.assertEqual(response.context['post'], post)
+        self.assertEqual(list(response.context['comments']), [comment])
+        self.assertEqual(stats.get_stats(self.reader).comments_count, 1)
+        self.assertEqual(
+            self.client.get(reverse('posts:post_detail', args=[
+                post.pk + len(SHARDS)])).status_code, 404)
+
+    def test_deleted_author_leaves_no_rows_in_shards(self):
+        post_a, post_b = self.create_posts(2)
+        Comment.objects.create(
+            post=post_b, author=self.author_a, text='Чужой пост')
+        Comment.objects.create(
+            post=post_a, author=self.reader, text='Пост удаляемого')
+        author_id = self.author_a.pk
+        self.author_a.delete()
+        for alias in SHARDS:
+            with self.subTest(alias=alias):
+                self.assertFalse(Post.objects.using(alias).filter(
+                    author_id=author_id).exists())
+        self.assertFalse(
+            sharding.scatter(Comment.objects.all()).exists())
+        self.assertEqual(
+            list(self.client.get(reverse('posts:index')).context[
+                'page_obj']), [post_b])
+
+    def test_deleted_group_is_cleared_in_shards(self):
+        posts = self.create_posts(2)
+        self.group.delete()
+        for post in posts:
+            with self.subTest(post=post.pk):
+                stored = Post.objects.using(
+                    sharding.for_post(post.pk)).get(pk=post.pk)
+                self.assertIsNone(stored.group_id)
+
+    def test_deleted_posts_leave_no_thumbnail_jobs(self):
+        """Задания основной базы удаляются и при удалении поста, и при
+        удалении его автора."""
+        post_a, post_b = self.create_posts(2)
+        for post in (post_a, post_b):
+            ThumbnailJob.objects.create(post=post, image=f'{post.pk}.png')
+        post_a.delete()
+        jobs = ThumbnailJob.objects.using('default')
+        self.assertEqual(
+            list(jobs.values_list('post_id', flat=True)), [post_b.pk])
+        self.author_b.delete()
+        self.assertFalse(jobs.exists())
+
+    def test_comment_batch_is_split_by_shard(self):
+        post_a, post_b = self.create_posts(2)
+        batch = [
+            Comment(post=post, author=self.reader, text=f'Пачка {i}')
+            for i, post in enumerate((post_a, post_b, post_b))
+        ]
+        self.assertEqual(comments.write(batch), {})
+        self.assertEqual(Comment.objects.using('shard_a').count(), 1)
+        self.assertEqual(Comment.objects.using('shard_b').count(), 2)
+        self.assertEqual(
+            set(search.matching_ids('пачка', search.COMMENT)),
+            {comment.pk for comment in batch})
+        self.assertEqual(stats.get_stats(self.reader).comments_count, 3)
+
+    def test_export_reads_every_shard(self):
+        posts = self.create_posts(4)
+        Comment.objects.create(
+            post=posts[0], author=self.reader, text='Комментарий')
+        self.assertEqual(
+            sorted(row[0] for row in export.rows('posts')),
+            sorted(post.pk for post in posts))
+        self.assertEqual(len(list(export.rows('comments'))), 1)
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='Автор_выгрузки')
+        self.reader = User.objects.create_user(username='Читатель')
+        self.admin = User.objects.create_user(
+            username='Аналитик', is_staff=True)
+        self.posts = [
+            Post.objects.create(author=self.author, text=f'Пост "{i}",\n')
+            for i in range(5)
+        ]
+        Comment.objects.create(
+            post=self.posts[0], author=self.reader, text='Комментарий')
+        Follow.objects.create(user=self.reader, author=self.author)
+        # два старых поста: их отсекает since
+        Post.objects.filter(pk__in=[p.pk for p in self.posts[:2]]).update(
+            pub_date=timezone.now() - timezone.timedelta(days=2))
+        self.since = (timezone.now() - timezone.timedelta(days=1)).isoformat()
+        self.client.force_login(self.admin)
+
+    def download(self, kind, **params):
+        response = self.client.get(
+            reverse('posts:export', args=[kind]), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        return gzip.decompress(b''.join(response.streaming_content)).decode()
+
+    @override_settings(EXPORT_BATCH_SIZE=2)
+    def test_posts_are_read_in_keyset_batches(self):
+        response = self.client.get(reverse('posts:export', args=['posts']))
+        # 5 постов пачками по 2: три запроса, последний неполный
+        with self.assertNumQueries(3):
+            content = b''.join(response.streaming_content)
+        rows = [
+            json.loads(line)
+            for line in gzip.decompress(content).decode().splitlines()]
+        self.assertEqual(
+            [row['id'] for row in rows],
+            sorted(post.pk for post in self.posts))
+        self.assertEqual(rows[0]['text'], self.posts[0].text)
+        self.assertEqual(rows[0]['author_id'], self.author.pk)
+
+    def test_since_and_csv(self):
+        rows = list(csv.reader(StringIO(
+            self.download('posts', format='csv', since=self.since))))
+        self.assertEqual(rows[0], list(export.EXPORTS['posts'][1]))
+        self.assertEqual(
+            [int(row[0]) for row in rows[1:]],
+            [post.pk for post in self.posts[2:]])
+        self.assertEqual(rows[1][4], self.posts[2].text)
+        follows = self.download('follows').splitlines()
+        self.assertEqual(len(follows), 1)
+        for params in ({'since': self.since}, {'format': 'xml'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(reverse(
+                    'posts:export', args=['follows']), params
+                ).status_code, 400)
+
+    def test_export_is_for_staff_only(self):
+        self.client.force_login(self.reader)
+        response = self.client.get(reverse('posts:export', args=['posts']))
+        self.assertEqual(response.status_code, 302)
+        self.client.force_login(self.admin)
+        self.assertEqual(self.client.get(
+            reverse('posts:export', args=['users'])).status_code, 404)
+
+    def test_command_writes_gzip_file(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'comments.jsonl.gz')
+        err = StringIO()
+        call_command(
+            'export_yatube', 'comments', '--gzip', f'--output={path}',
+            f'--since={self.since[:10]}', '--batch-size=1', stderr=err)
+        with gzip.open(path, 'rt') as output:
+            rows = [json.loads(line) for line in output]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['post_id'], self.posts[0].pk)
+        self.assertIn('Следующий --since', err.getvalue())
+        with self.assertRaises(CommandError):
+            call_command(
+                'export_yatube', 'follows', '--since=2020-01-01',
+                f'--output={path}')
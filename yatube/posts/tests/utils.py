@@ -0,0 +1,42 @@
+from contextlib import ContextDecorator
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class query_budget(ContextDecorator):
+    """Падает, если внутри блока выполнено больше limit запросов к БД.
+
+    Работает и как контекстный менеджер, и как декоратор теста:
+
+        with query_budget(3, 'posts:index'):
+            client.get('/')
+
+    В сообщении об ошибке перечисляются все выполненные запросы.
+    """
+
+    def __init__(self, limit, label=''):
+        self.limit = limit
+        self.label = label
+        self.context = CaptureQueriesContext(connection)
+
+    def __enter__(self):
+        self.context.__enter__()
+        return self.context
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.context.__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return False
+        executed = len(self.context)
+        if executed > self.limit:
+            queries = '\n'.join(
+                f'{number}. {query["sql"]}'
+                for number, query in enumerate(
+                    self.context.captured_queries, start=1)
+            )
+            raise AssertionError(
+                f'{self.label}: {executed} запросов при бюджете '
+                f'{self.limit}.\n{queries}'
+            )
+        return False
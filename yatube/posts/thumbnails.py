@@ -0,0 +1,247 @@
+"""Очередь фоновой подготовки миниатюр.
+
+Сохранение поста с новой картинкой — из формы, админки или shell —
+ставит задание в таблицу ThumbnailJob, а пул потоков
+после коммита транзакции строит все варианты карточки: несколько ширин
+в WebP (и AVIF, если его умеет Pillow) и запасной JPEG. Имена и размеры
+вариантов сохраняются в Post.image_variants, поэтому <picture> строится
+без обращений к хранилищу. Пока миниатюры не готовы, шаблоны показывают
+заглушку. Задания, оставшиеся в очереди после перезапуска, разбирает
+команда process_thumbnails.
+"""
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, features
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.base import EXTENSIONS
+from sorl.thumbnail.images import ImageFile
+
+from . import caching, metrics, sharding
+from .models import Post, ThumbnailJob
+
+logger = logging.getLogger(__name__)
+
+# пропорции картинки в карточке и ширины вариантов для srcset
+CARD_RATIO = (960, 339)
+CARD_WIDTHS = (480, 960, 1440)
+CARD_SIZES = '(max-width: 576px) 100vw, 960px'
+# вариант для <img>: его понимает любой браузер
+FALLBACK_FORMAT = 'JPEG'
+FALLBACK_WIDTH = 960
+MIME_TYPES = {
+    'AVIF': 'image/avif',
+    'WEBP': 'image/webp',
+    'JPEG': 'image/jpeg',
+}
+MAX_ATTEMPTS = 3
+# сколько заданий из головы очереди пробовать захватить за раз
+CLAIM_BATCH = 5
+STALE_AFTER = timedelta(minutes=10)
+
+_executor = None
+
+
+def source_formats():
+    """Современные форматы, которые умеет кодировать установленный Pillow.
+
+    Миниатюру в формате, незнакомом sorl, не назвать: такой формат
+    пропускается.
+    """
+    Image.init()
+    formats = []
+    if 'AVIF' in Image.SAVE and 'AVIF' in EXTENSIONS:
+        formats.append('AVIF')
+    if features.check('webp'):
+        formats.append('WEBP')
+    return formats
+
+
+def variants():
+    """Формат, ширина и геометрия sorl каждого варианта карточки."""
+    width, height = CARD_RATIO
+    for image_format in source_formats() + [FALLBACK_FORMAT]:
+        for size in CARD_WIDTHS:
+            yield image_format, size, f'{size}x{round(size * height / width)}'
+
+
+def build(image):
+    """Строит все варианты картинки и возвращает их описание.
+
+    {'JPEG': [[имя, ширина, высота], ...], ...} в порядке предпочтения.
+    """
+    built = {}
+    # ключи sorl зависят от хранилища: берём то же, что и у Post.image
+    source = ImageFile(image, Post._meta.get_field('image').storage)
+    for image_format, size, geometry in variants():
+        thumbnail = get_thumbnail(
+            source, geometry, crop='center', upscale=True, format=image_format)
+        # sorl глушит ошибки чтения исходника и не сохраняет миниатюру
+        if not thumbnail.exists():
+            raise OSError(f'Миниатюра {image_format} {geometry} не построена')
+        built.setdefault(image_format, []).append(
+            [thumbnail.name, thumbnail.width, thumbnail.height])
+    return built
+
+
+def picture(post):
+    """Контекст <picture> по сохранённым вариантам, без обращений к диску.
+
+    Если варианты не читаются (запись в обход очереди), картинка
+    отдаётся старым путём через тег thumbnail.
+    """
+    try:
+        built = json.loads(post.image_variants)
+        built[FALLBACK_FORMAT][0]
+    except (ValueError, TypeError, KeyError, IndexError):
+        return {'image': post.image}
+
+    def srcset(files):
+        return ', '.join(
+            f'{default.storage.url(name)} {width}w'
+            for name, width, _ in files
+        )
+
+    fallback = built.get(FALLBACK_FORMAT, [])
+    name, width, height = min(
+        fallback, key=lambda file: abs(file[1] - FALLBACK_WIDTH))
+    return {
+        'sources': [
+            {'type': MIME_TYPES[image_format], 'srcset': srcset(files)}
+            for image_format, files in built.items()
+            if image_format != FALLBACK_FORMAT
+        ],
+        'src': default.storage.url(name),
+        'srcset': srcset(fallback),
+        'sizes': CARD_SIZES,
+        'width': width,
+        'height': height,
+    }
+
+
+def image_changed(post):
+    """Картинка поста новая или не та, что была прочитана из базы."""
+    return not post.image._committed or (
+        post.image.name != getattr(post, '_stored_image', None))
+
+
+def reset(post):
+    """Сбрасывает готовые варианты перед сохранением новой картинки."""
+    post.thumbnails_ready = False
+    post.image_variants = ''
+
+
+def enqueue(post, start=True):
+    """Ставит миниатюры картинки поста в очередь.
+
+    start=False оставляет задание тому, кто сам разбирает очередь.
+    """
+    if not post.image:
+        return None
+    job = ThumbnailJob.objects.create(post=post, image=post.image.name)
+    if start:
+        transaction.on_commit(start_workers)
+    return job
+
+
+def start_workers():
+    """Будит пул потоков, который разберёт очередь; не ждёт его.
+
+    При THUMBNAIL_WORKERS = 0 пула нет: очередь разбирает команда
+    process_thumbnails или сам вызывающий через process_pending().
+    """
+    global _executor
+    workers = getattr(settings, 'THUMBNAIL_WORKERS', 2)
+    if not workers:
+        return None
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='thumbnails',
+        )
+    return _executor.submit(_work)
+
+
+def _work():
+    # у каждого потока своё соединение с базой: закрываем его сами
+    close_old_connections()
+    try:
+        process_pending()
+    except Exception:
+        logger.exception('Очередь миниатюр остановилась с ошибкой')
+    finally:
+        close_old_connections()
+
+
+def claim():
+    """Забирает самое старое задание; параллельный вызов его не получит."""
+    for job in ThumbnailJob.objects.filter(
+            status=ThumbnailJob.PENDING)[:CLAIM_BATCH]:
+        taken = ThumbnailJob.objects.filter(
+            pk=job.pk, status=ThumbnailJob.PENDING,
+        ).update(status=ThumbnailJob.RUNNING, updated=timezone.now())
+        if taken:
+            job.status = ThumbnailJob.RUNNING
+            return job
+    return None
+
+
+def run(job):
+    """Строит миниатюры задания и отмечает пост готовым."""
+    start = time.perf_counter()
+    try:
+        built = build(job.image)
+    except Exception as error:
+        job.attempts += 1
+        job.error = repr(error)
+        failed = job.attempts >= MAX_ATTEMPTS
+        job.status = ThumbnailJob.FAILED if failed else ThumbnailJob.PENDING
+        job.save(update_fields=['attempts', 'error', 'status', 'updated'])
+        metrics.THUMBNAIL_JOBS.inc(result='failed' if failed else 'retry')
+        logger.warning('Не удалось построить миниатюры %s', job.image)
+        if failed:
+            # без вариантов карточка строит миниатюру через sorl, а не
+            # показывает заглушку вечно
+            _mark_ready(job, '')
+        return False
+    metrics.THUMBNAIL_SECONDS.observe(time.perf_counter() - start)
+    metrics.THUMBNAIL_JOBS.inc(result='done')
+    job.status = ThumbnailJob.DONE
+    job.save(update_fields=['status', 'updated'])
+    _mark_ready(job, json.dumps(built))
+    return True
+
+
+def _mark_ready(job, image_variants):
+    # картинку могли заменить, пока задание ждало в очереди
+    marked = sharding.on_post_shard(
+        Post.objects.filter(pk=job.post_id, image=job.image), job.post_id,
+    ).update(thumbnails_ready=True, image_variants=image_variants)
+    if marked:
+        caching.bump_card_version('post', job.post_id)
+        caching.bump_feed_generation()
+
+
+def process_pending(limit=None):
+    """Выполняет задания, пока очередь не опустеет; возвращает их число."""
+    done = 0
+    while limit is None or done < limit:
+        job = claim()
+        if job is None:
+            break
+        run(job)
+        done += 1
+    return done
+
+
+def release_stale(older_than=STALE_AFTER):
+    """Возвращает в очередь задания упавших воркеров."""
+    return ThumbnailJob.objects.filter(
+        status=ThumbnailJob.RUNNING,
+        updated__lt=timezone.now() - older_than,
+    ).update(status=ThumbnailJob.PENDING)
@@ -0,0 +1,256 @@
+"""Лента подписок с рассылкой при записи (fan-out on write).
+
+Новый пост сразу раскладывается по лентам подписчиков автора, поэтому
+follow_index читает готовый список из TimelineEntry. Авторы, у которых
+подписчиков больше TIMELINE_FANOUT_LIMIT, не рассылаются: их посты
+подмешиваются в ленту при чтении (FollowFeed).
+
+При шардировании постов рассылки нет: лента собирается слиянием
+шардов, в которых лежат посты авторов из подписок.
+"""
+import copy
+import heapq
+from itertools import groupby, islice
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import (Count, F, IntegerField, OuterRef, Q,
+                              Subquery, Value)
+from django.db.models.functions import Coalesce
+
+from . import sharding, stats
+from .models import AuthorStats, Follow, Post, TimelineEntry, User
+
+INSERT_ENTRIES = (
+    'INSERT INTO {timeline} (user_id, post_id, pub_date) {select} '
+    'ON CONFLICT DO NOTHING'
+)
+NOT_CELEBRITY = (
+    'NOT EXISTS (SELECT 1 FROM {stats} AS s '
+    'WHERE s.author_id = f.author_id AND s.followers_count > %s)'
+)
+
+
+def fanout_limit():
+    return getattr(settings, 'TIMELINE_FANOUT_LIMIT', 10000)
+
+
+def is_celebrity(author_id):
+    return stats.followers_count(author_id) > fanout_limit()
+
+
+def _insert(select, params):
+    """Заполняет ленты одним INSERT ... SELECT, не выгружая строки."""
+    sql = INSERT_ENTRIES.format(
+        timeline=TimelineEntry._meta.db_table,
+        select=select.format(
+            follow=Follow._meta.db_table,
+            post=Post._meta.db_table,
+            not_celebrity=NOT_CELEBRITY.format(
+                stats=AuthorStats._meta.db_table),
+        ),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def fan_out_post(post):
+    """Раскладывает новый пост по лентам подписчиков автора."""
+    if sharding.enabled() or is_celebrity(post.author_id):
+        return
+    _insert(
+        'SELECT f.user_id, p.id, p.pub_date FROM {follow} AS f, {post} AS p '
+        'WHERE p.id = %s AND f.author_id = p.author_id',
+        [post.pk],
+    )
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту читателя все посты автора после подписки."""
+    if sharding.enabled() or is_celebrity(author_id):
+        return
+    _insert(
+        'SELECT %s, p.id, p.pub_date FROM {post} AS p WHERE p.author_id = %s',
+        [user_id, author_id],
+    )
+
+
+def prune(user_id, author_id):
+    """Убирает посты автора из ленты читателя после отписки."""
+    TimelineEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id).delete()
+
+
+def fan_out_author(author_id):
+    """Досылает посты автора, который перестал быть «знаменитостью».
+
+    Пока у автора было слишком много подписчиков, его посты не
+    рассылались; когда их число падает до порога, ленты оставшихся
+    подписчиков нужно дополнить.
+    """
+    _insert(
+        'SELECT f.user_id, p.id, p.pub_date FROM {follow} AS f '
+        'JOIN {post} AS p ON p.author_id = f.author_id '
+        'WHERE f.author_id = %s',
+        [author_id],
+    )
+
+
+def rebuild(user_id):
+    """Пересобирает ленту читателя с нуля."""
+    TimelineEntry.objects.filter(user_id=user_id).delete()
+    _insert(
+        'SELECT f.user_id, p.id, p.pub_date FROM {follow} AS f '
+        'JOIN {post} AS p ON p.author_id = f.author_id '
+        'WHERE f.user_id = %s AND {not_celebrity}',
+        [user_id, fanout_limit()],
+    )
+
+
+def rebuild_all():
+    """Пересобирает ленты всех читателей одним запросом."""
+    TimelineEntry.objects.all().delete()
+    _insert(
+        'SELECT f.user_id, p.id, p.pub_date FROM {follow} AS f '
+        'JOIN {post} AS p ON p.author_id = f.author_id '
+        'WHERE {not_celebrity}',
+        [fanout_limit()],
+    )
+
+
+def _timeline_lookups(condition):
+    """Условие на поля поста, переписанное на поля TimelineEntry."""
+    rewritten = copy.copy(condition)
+    rewritten.children = [
+        _timeline_lookups(child) if isinstance(child, Q) else (
+            ('post_id' + child[0][2:], child[1])
+            if child[0].split('__')[0] == 'id' else child)
+        for child in condition.children
+    ]
+    return rewritten
+
+
+def _timeline_ordering(ordering):
+    return tuple(
+        name[:-2] + 'post_id' if name.lstrip('-') == 'id' else name
+        for name in ordering)
+
+
+class FollowFeed:
+    """Посты ленты подписок для пагинаторов.
+
+    Страница — диапазон индекса timeline_user_date_idx с LIMIT и посты
+    по первичному ключу. Посты «знаменитостей» идут отдельными потоками
+    по индексу автора, тоже с LIMIT, и сливаются с лентой по
+    (pub_date, id). Стоимость страницы не зависит от длины ленты.
+    filter() и order_by() понимают условия CursorPaginator по pub_date
+    и id.
+    """
+
+    model = Post
+    ordered = True
+
+    def __init__(self, user, condition=None, ordering=('-pub_date', '-id'),
+                 related=()):
+        self.user_id = user.pk
+        self.condition = condition or Q()
+        self.ordering = tuple(ordering)
+        self.related = tuple(related)
+        self._summary = None
+
+    def _clone(self, **kwargs):
+        feed = FollowFeed.__new__(FollowFeed)
+        feed.__dict__.update(self.__dict__, **kwargs)
+        return feed
+
+    def filter(self, condition):
+        return self._clone(condition=self.condition & condition)
+
+    def order_by(self, *ordering):
+        return self._clone(ordering=ordering)
+
+    def select_related(self, *fields):
+        return self._clone(related=self.related + fields)
+
+    def summary(self):
+        """(записей в ленте, {автор: число постов} «знаменитостей»).
+
+        Один запрос: строки подписок на «знаменитостей» и строка с
+        числом записей ленты, у которой автор — NULL.
+        """
+        if self._summary is None:
+            # записи, оставшиеся от времени, когда автор ещё не был
+            # «знаменитостью», уже есть в ленте
+            delivered = TimelineEntry.objects.filter(
+                user_id=self.user_id, post__author_id=OuterRef('author_id'),
+            ).order_by().values('user_id').annotate(
+                total=Count('pk')).values('total')
+            celebrities = Follow.objects.filter(
+                user_id=self.user_id,
+                author__stats__followers_count__gt=fanout_limit(),
+            ).annotate(
+                celebrity=F('author_id'),
+                total=F('author__stats__posts_count') - Coalesce(
+                    Subquery(delivered, IntegerField()), 0),
+            ).values_list('celebrity', 'total')
+            entries = TimelineEntry.objects.filter(
+                user_id=OuterRef('pk')).order_by().values('user_id').annotate(
+                total=Count('pk')).values('total')
+            own = User.objects.filter(pk=self.user_id).annotate(
+                celebrity=Value(None, IntegerField()),
+                total=Subquery(entries, IntegerField()),
+            ).values_list('celebrity', 'total')
+            rows = dict(celebrities.union(own, all=True))
+            self._summary = (rows.pop(None, None) or 0, rows)
+        return self._summary
+
+    def count(self):
+        entries, celebrities = self.summary()
+        return entries + sum(total or 0 for total in celebrities.values())
+
+    def _entries(self):
+        return TimelineEntry.objects.filter(
+            _timeline_lookups(self.condition), user_id=self.user_id,
+        ).order_by(*_timeline_ordering(self.ordering))
+
+    def _posts(self, start, stop):
+        _, celebrities = self.summary()
+        if not celebrities:
+            related = [f'post__{name}' for name in self.related]
+            return [
+                entry.post for entry in self._entries().select_related(
+                    'post', *related)[start:stop]
+            ]
+        streams = [self._entries().values_list('pub_date', 'post_id')[:stop]]
+        streams += [
+            Post.objects.filter(self.condition, author_id=author_id).order_by(
+                *self.ordering).values_list('pub_date', 'id')[:stop]
+            for author_id in celebrities
+        ]
+        descending = self.ordering[0].startswith('-')
+        # пост из ленты и из потока автора встаёт рядом с собой
+        merged = (key for key, _ in groupby(
+            heapq.merge(*streams, reverse=descending)))
+        ids = [post_id for _, post_id in islice(merged, start, stop)]
+        posts = Post.objects.select_related(*self.related).in_bulk(ids)
+        return [posts[post_id] for post_id in ids if post_id in posts]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            if key.step is not None or key.stop is None:
+                raise ValueError('Нужен срез с концом и без шага.')
+            return self._posts(key.start or 0, key.stop)
+        posts = self._posts(key, key + 1)
+        if not posts:
+            raise IndexError(key)
+        return posts[0]
+
+
+def follow_feed(user):
+    """Посты ленты подписок: рассылка плюс посты «знаменитостей»."""
+    if sharding.enabled():
+        return sharding.by_authors(
+            Post.objects.all(),
+            Follow.objects.filter(user=user).values_list(
+                'author_id', flat=True))
+    return FollowFeed(user)
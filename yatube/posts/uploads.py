@@ -0,0 +1,111 @@
+"""Нормализация загружаемых картинок постов.
+
+Перед сохранением картинка приводится к виду, удобному для хранения:
+размер ограничен POST_IMAGE_MAX_SIDE по большей стороне, поворот из EXIF
+применён, а EXIF, XMP и текстовые блоки удалены. Большие JPEG
+декодируются в режиме draft, то есть сразу в уменьшенном масштабе,
+поэтому память не растёт пропорционально мегапикселям оригинала.
+Картинки больше POST_IMAGE_MAX_PIXELS отклоняются до декодирования.
+Если менять нечего, файл сохраняется как есть.
+"""
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+MAX_SIDE = 2560
+MAX_PIXELS = 50_000_000
+METADATA_KEYS = ('exif', 'xmp', 'XML:com.adobe.xmp', 'comment', 'photoshop')
+# форматы, в которых картинка пересохраняется; прочие переводятся в PNG
+SAVE_FORMATS = {'JPEG': 'JPEG', 'MPO': 'JPEG', 'PNG': 'PNG', 'WEBP': 'WEBP',
+                'GIF': 'GIF'}
+EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp', 'GIF': '.gif'}
+SAVE_OPTIONS = {
+    'JPEG': {'quality': 85, 'optimize': True, 'progressive': True},
+    'PNG': {'optimize': True},
+    'WEBP': {'quality': 85},
+    'GIF': {},
+}
+
+
+def max_side():
+    return getattr(settings, 'POST_IMAGE_MAX_SIDE', MAX_SIDE)
+
+
+def max_pixels():
+    return getattr(settings, 'POST_IMAGE_MAX_PIXELS', MAX_PIXELS)
+
+
+def has_metadata(image):
+    if any(key in image.info for key in METADATA_KEYS):
+        return True
+    return bool(getattr(image, 'text', None)) or bool(image.getexif())
+
+
+def target_size(size, limit):
+    width, height = size
+    scale = min(1, limit / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def open_checked(file):
+    """Открывает картинку, читая только заголовок, и отсекает бомбы."""
+    file.seek(0)
+    try:
+        image = Image.open(file)
+    except Image.DecompressionBombError:
+        raise ValidationError(
+            'Картинка слишком большая.', code='image_too_large')
+    except Exception:
+        raise ValidationError(
+            'Загрузите правильное изображение.', code='invalid_image')
+    width, height = image.size
+    if width * height > max_pixels():
+        raise ValidationError(
+            'Картинка слишком большая: %(pixels)s пикселей при пределе '
+            '%(limit)s.',
+            code='image_too_large',
+            params={'pixels': width * height, 'limit': max_pixels()},
+        )
+    return image
+
+
+def normalize(file):
+    """Возвращает файл, готовый к сохранению в Post.image.
+
+    Результат помечается атрибутом normalized, чтобы Post.save
+    не обрабатывал его повторно.
+    """
+    image = open_checked(file)
+    limit = max_side()
+    oversized = max(image.size) > limit
+    # у анимации пересохранили бы только первый кадр: её не трогаем
+    if getattr(image, 'is_animated', False) or not (
+            oversized or has_metadata(image)):
+        file.seek(0)
+        file.normalized = True
+        return file
+    image_format = SAVE_FORMATS.get(image.format, 'PNG')
+    size = target_size(image.size, limit)
+    # JPEG сразу декодируется с уменьшением в 2, 4 или 8 раз
+    image.draft('RGB', size)
+    if oversized:
+        image.thumbnail((limit, limit), Image.LANCZOS)
+    # поворот после уменьшения: предел одинаков для обеих сторон
+    image = ImageOps.exif_transpose(image)
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L', 'CMYK'):
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    options = dict(SAVE_OPTIONS[image_format])
+    # цветовой профиль — не метаданные: без него цвета поплывут
+    if image.info.get('icc_profile'):
+        options['icc_profile'] = image.info['icc_profile']
+    image.save(buffer, image_format, **options)
+    root, _ = os.path.splitext(os.path.basename(file.name))
+    result = ContentFile(
+        buffer.getvalue(), name=root + EXTENSIONS[image_format])
+    result.normalized = True
+    return result
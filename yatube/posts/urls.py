@@ -17,6 +17,8 @@ urlpatterns = [
     ),
     path('posts/<int:post_id>/edit/', views.post_edit, name='post_edit'),
     path('group/<slug:slug>/', views.group_posts, name='group_list'),
+    path('search/', views.search_posts, name='search'),
+    path('export/<str:kind>/', views.export_rows, name='export'),
     path('admin/', admin.site.urls),
     path('auth/', include('django.contrib.auth.urls')),
     path('follow/', views.follow_index, name='follow_index'),
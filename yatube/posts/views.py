@@ -1,37 +1,43 @@
+from core.views import too_many_requests
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
+from django.db import IntegrityError
+from django.http import Http404, HttpResponseBadRequest, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.utils import timezone
+from django.views.decorators.http import require_safe
 
+from . import (comments, export, group_feed, search, sharding, stats,
+               timeline)
+from .conditional import (conditional, group_state, index_state,
+                          post_detail_state, profile_state)
 from .forms import CommentForm, PostForm
-from .models import Follow, Group, Post, User
+from .models import Follow, Post, User
+from .pagination import CursorPaginator, get_page
 
 POST_LIMIT = 10
+COMMENT_LIMIT = 50
 
 
+@conditional(index_state)
 def index(request):
     template = 'posts/index.html'
-    post_list = Post.objects.prefetch_related(
-        'author',
-        'group'
-    )
-    paginator = Paginator(post_list, POST_LIMIT)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    post_list = sharding.scatter(
+        Post.objects.select_related('author', 'group'))
+    page_obj = get_page(request, post_list, POST_LIMIT)
     context = {
         'page_obj': page_obj,
     }
     return render(request, template, context)
 
 
+@conditional(group_state)
 def group_posts(request, slug):
     template = 'posts/group_list.html'
-    group = get_object_or_404(
-        Group.objects.prefetch_related('posts'), slug=slug)
-    post_list = group.posts.all()
-    paginator = Paginator(post_list, POST_LIMIT)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    group = group_feed.find_group(slug)
+    if group is None:
+        raise Http404('Группа не найдена')
+    page_obj = get_page(request, group_feed.GroupFeed(group), POST_LIMIT)
     context = {
         'group': group,
         'page_obj': page_obj,
@@ -39,39 +45,46 @@ def group_posts(request, slug):
     return render(request, template, context)
 
 
+@conditional(profile_state)
 def profile(request, username):
     template = 'posts/profile.html'
     author = get_object_or_404(User, username=username)
-    post_list = Post.objects.filter(author__username=username)
-    count = post_list.count()
-    paginator = Paginator(post_list, POST_LIMIT)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    following = Follow.objects.filter(user__username=request.user,
-                                      author=author)
+    post_list = sharding.on_author_shard(
+        author.posts.select_related('author', 'group'), author.pk)
+    author_stats = stats.get_stats(author)
+    page_obj = get_page(request, post_list, POST_LIMIT)
+    following = is_following(request.user, author)
     context = {
         'author': author,
         'page_obj': page_obj,
-        'count': count,
+        'count': author_stats.posts_count,
+        'stats': author_stats,
         'following': following,
     }
     return render(request, template, context)
 
 
+@conditional(post_detail_state)
 def post_detail(request, post_id):
     template = 'posts/post_detail.html'
-    post = get_object_or_404(Post, id=post_id)
+    post = get_object_or_404(sharding.on_post_shard(
+        Post.objects.select_related('author', 'group'), post_id), id=post_id)
     comment_form = CommentForm(request.POST or None)
-    comments = post.comments.all()
+    comments = CursorPaginator(
+        sharding.on_post_shard(
+            post.comments.select_related('author'), post_id),
+        COMMENT_LIMIT,
+        ordering=('pub_date', 'id'),
+        cursor_param='comments',
+    ).get_page(request.GET.get('comments'))
     author = post.author
-    author_posts = post.author.posts.all()
-    count = author_posts.count()
-    following = Follow.objects.filter(user__username=request.user,
-                                      author=author)
+    author_stats = stats.get_stats(author)
+    following = is_following(request.user, author)
     context = {
         'author': author,
         'post': post,
-        'count': count,
+        'count': author_stats.posts_count,
+        'stats': author_stats,
         'form': comment_form,
         'comments': comments,
         'following': following,
@@ -79,6 +92,23 @@ def post_detail(request, post_id):
     return render(request, template, context)
 
 
+def search_posts(request):
+    template = 'posts/search.html'
+    query = request.GET.get('q', '').strip()
+    page_obj = search.search_page(
+        query, POST_LIMIT, request.GET.get('cursor'))
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+    }
+    return render(request, template, context)
+
+
+def is_following(user, author):
+    return user.is_authenticated and Follow.objects.filter(
+        user=user, author=author).exists()
+
+
 @login_required
 def post_create(request):
     template = 'posts/create_post.html'
@@ -99,8 +129,9 @@ def post_create(request):
 @login_required
 def post_edit(request, post_id):
     template = 'posts/create_post.html'
-    post = get_object_or_404(Post, pk=post_id)
-    if request.user != post.author:
+    post = get_object_or_404(
+        sharding.on_post_shard(Post.objects.all(), post_id), pk=post_id)
+    if post.author_id != request.user.pk:
         return redirect('posts:post_detail', post_id=post_id)
     form = PostForm(
         request.POST or None,
@@ -119,23 +150,26 @@ def post_edit(request, post_id):
 
 @login_required
 def add_comment(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_object_or_404(
+        sharding.on_post_shard(Post.objects.all(), post_id), pk=post_id)
     form = CommentForm(request.POST or None)
     if form.is_valid():
+        retry_after = comments.throttle(request.user.pk, post.pk)
+        if retry_after:
+            return too_many_requests(request, retry_after)
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
-        comment.save()
+        comments.save(comment)
     return redirect('posts:post_detail', post_id=post_id)
 
 
 @login_required
 def follow_index(request):
     template = 'posts/follow.html'
-    post_list = Post.objects.filter(author__following__user=request.user)
-    paginator = Paginator(post_list, POST_LIMIT)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    post_list = timeline.follow_feed(request.user).select_related(
+        'author', 'group')
+    page_obj = get_page(request, post_list, POST_LIMIT)
     context = {
         'page_obj': page_obj,
     }
@@ -148,18 +182,45 @@ def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     following = Follow.objects.filter(author=author, user=user).exists()
     if user != author and not following:
-        follow = Follow.objects.create(
-            user=user,
-            author=author
-        )
-        follow.save()
+        try:
+            Follow.objects.create(user=user, author=author)
+        except IntegrityError:
+            # параллельный запрос уже оформил ту же подписку
+            pass
     return redirect('posts:profile', username=username)
 
 
 @login_required
 def profile_unfollow(request, username):
     user = get_object_or_404(User, username=username)
-    unfollow, _ = Follow.objects.get_or_create(
-        user=request.user, author=user)
-    unfollow.delete()
+    Follow.objects.filter(user=request.user, author=user).delete()
     return redirect('posts:profile', username)
+
+
+@staff_member_required
+@require_safe
+def export_rows(request, kind):
+    """Выгрузка kind в JSONL или CSV, сжатая gzip, потоком.
+
+    ?format=csv меняет формат, ?since=<ISO 8601> оставляет записи с
+    pub_date не раньше этого момента. В заголовке X-Export-Watermark —
+    since для следующей выгрузки.
+    """
+    if kind not in export.EXPORTS:
+        raise Http404('Выгрузка не найдена')
+    started = timezone.now()
+    export_format = request.GET.get('format', 'jsonl')
+    since = request.GET.get('since')
+    if export_format not in export.FORMATS:
+        return HttpResponseBadRequest('Неизвестный формат')
+    try:
+        if since:
+            since = export.parse_since(since)
+        chunks = export.stream(kind, export_format, since or None)
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error))
+    response = StreamingHttpResponse(chunks, content_type='application/gzip')
+    response['Content-Disposition'] = (
+        f'attachment; filename="{kind}.{export_format}.gz"')
+    response['X-Export-Watermark'] = started.isoformat()
+    return response
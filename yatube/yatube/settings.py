@@ -11,6 +11,8 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import sys
+import tempfile
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -42,11 +44,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -78,9 +82,38 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # соединение переживает запрос и переиспользуется следующим
+        'CONN_MAX_AGE': 60,
     }
 }
 
+# PRAGMA для каждого нового соединения SQLite (см. core/db.py): журнал
+# WAL, чтобы чтение не ждало запись, и ожидание чужой блокировки записи
+# вместо ошибки «database is locked». Размеры — в байтах для mmap_size
+# и в КиБ (со знаком минус) для cache_size.
+SQLITE_PRAGMAS = {
+    'busy_timeout': 5000,
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+# Реплики только для чтения — алиасы из DATABASES. Ленты, профиль и
+# страница поста читаются с них; после записи пользователь ещё
+# REPLICA_PIN_SECONDS секунд читает с основной базы.
+REPLICA_DATABASES = []
+REPLICA_PIN_SECONDS = 10
+# Шарды постов и комментариев — алиасы из DATABASES. Посты автора
+# живут в одном шарде, ленты собираются слиянием шардов (posts/sharding.py).
+# Пустой список — всё в основной базе.
+POST_SHARDS = []
+DATABASE_ROUTERS = [
+    'posts.sharding.ShardRouter',
+    'core.routers.ReplicaRouter',
+]
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME':
@@ -126,6 +159,68 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Кто отдаёт байты медиафайлов: None — Django через FileResponse
+# (sendfile, если его умеет WSGI-сервер), 'x-sendfile' — Apache или
+# lighttpd, 'x-accel-redirect' — nginx с internal-location по префиксу.
+MEDIA_SENDFILE = None
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+MEDIA_CACHE_MAX_AGE = 86400
+
+# 'page' — ?page=N с COUNT(*) и OFFSET, 'cursor' — keyset-пагинация по
+# (pub_date, id). Параметр ?cursor= включает курсоры для отдельного запроса.
+POSTS_PAGINATION_MODE = 'page'
+
+# Посты авторов, у которых подписчиков больше этого числа, не рассылаются
+# по лентам при публикации, а подмешиваются в /follow/ при чтении.
+TIMELINE_FANOUT_LIMIT = 10000
+
+# Лента группы: в кэше лежат id стольких новейших постов группы, более
+# глубокие страницы читаются из базы. Группы по slug кэшируются в процессе.
+GROUP_FEED_LENGTH = 1000
+GROUP_FEED_TIMEOUT = 60 * 60
+GROUP_SLUG_CACHE_SIZE = 1024
+
+# Загруженные картинки ужимаются до этого размера по большей стороне,
+# а картинки больше POST_IMAGE_MAX_PIXELS пикселей отклоняются.
+POST_IMAGE_MAX_SIDE = 2560
+POST_IMAGE_MAX_PIXELS = 50_000_000
+# Картинка без ссылок удаляется, только если её не трогали столько секунд:
+# её могла только что переиспользовать незакоммиченная загрузка.
+POST_IMAGE_ORPHAN_GRACE = 600
+
+# Потоки, которые строят миниатюры загруженных картинок в фоне;
+# 0 — без потоков, очередь разбирает команда process_thumbnails.
+THUMBNAIL_WORKERS = 2
+# Под pytest фикстуры удаляют временный MEDIA_ROOT сразу после теста, и
+# фоновые потоки писали бы в удаляемый каталог. Тесты manage.py test
+# отключают пул там, где он мешает, через override_settings.
+if 'pytest' in sys.modules:
+    THUMBNAIL_WORKERS = 0
+
+# Комментарии пишутся пачками: ведущий запрос ждёт до
+# COMMENT_BATCH_WINDOW секунд или COMMENT_BATCH_SIZE комментариев.
+COMMENT_BATCH_SIZE = 100
+COMMENT_BATCH_WINDOW = 0.005
+# Не больше N комментариев за столько-то секунд от пользователя и к посту.
+COMMENT_USER_RATE = (10, 60)
+COMMENT_POST_RATE = (120, 60)
+
+# Выгрузки export_yatube и /export/: строк в одном запросе к базе.
+EXPORT_BATCH_SIZE = 2000
+
+# Замеры запросов: сколько последних запросов каждого представления
+# держать в памяти и как часто сбрасывать гистограммы в файл процесса.
+PERF_WINDOW = 1000
+PERF_SNAPSHOT_INTERVAL = 10
+PERF_SNAPSHOT_DIR = os.path.join(tempfile.gettempdir(), 'yatube-perf')
+
+# Метрики для /metrics: каждый процесс раз в METRICS_FLUSH_INTERVAL секунд
+# сохраняет свои значения в METRICS_DIR, выдача складывает все файлы;
+# файлы завершившихся процессов сводятся в один архивный.
+METRICS_DIR = os.path.join(tempfile.gettempdir(), 'yatube-metrics')
+METRICS_FLUSH_INTERVAL = 5
+# Адреса, с которых /metrics доступен без входа (сборщик метрик).
+INTERNAL_IPS = ['127.0.0.1']
 
 CACHES = {
     'default': {